@@ -0,0 +1,275 @@
+import os
+import re
+import shutil
+import hashlib
+import threading
+import logging
+import requests
+from functools import lru_cache
+from datetime import datetime, timedelta
+from urllib.parse import urlparse, parse_qs, urlunparse
+from sqlalchemy import func, or_
+from server.config import ARTIFACT_CACHE_PATH, ARTIFACT_CACHE_QUOTA_MB, ARTIFACT_PIN_TTL
+from server.database import get_db
+from server.models import Artifact
+
+logger = logging.getLogger(__name__)
+
+# 计算校验和时每次读取的字节数
+CHECKSUM_CHUNK_SIZE = 1024 * 1024
+
+# 各站点从URL中提取媒体ID的规则：(域名, 路径中的视频ID, ID前缀)
+MEDIA_ID_PATTERNS = [
+    ('bilibili.com', re.compile(r'/video/(BV[0-9A-Za-z]{10}|av\d+)'), 'bilibili'),
+    # 短链接中直接带视频ID的形式，如https://b23.tv/BV1xx411c7mD
+    ('b23.tv', re.compile(r'^/(BV[0-9A-Za-z]{10})'), 'bilibili'),
+]
+
+# 短链接域名：路径中没有视频ID时，跟随跳转解析出原始URL后再提取媒体ID
+SHORT_LINK_DOMAINS = ('b23.tv',)
+# 解析短链接的超时时间（秒）和最多跟随的跳转次数
+SHORT_LINK_TIMEOUT = 5
+SHORT_LINK_MAX_REDIRECTS = 5
+
+
+def _match_media_id(parsed):
+    """按MEDIA_ID_PATTERNS从URL中提取媒体ID，无法识别时返回None"""
+    netloc = parsed.netloc.lower().split(':')[0]
+    for domain, pattern, prefix in MEDIA_ID_PATTERNS:
+        if netloc == domain or netloc.endswith('.' + domain):
+            match = pattern.search(parsed.path)
+            if match:
+                # 多P视频的每一P是不同的媒体
+                page = parse_qs(parsed.query).get('p', ['1'])[0]
+                return f'{prefix}:{match.group(1)}:p{page}'
+    return None
+
+
+@lru_cache(maxsize=1024)
+def _follow_redirects(url):
+    """跟随短链接的跳转（只读取Location头，不下载页面），返回最终URL。
+    出错时抛出异常，失败的结果不会被缓存"""
+    for _ in range(SHORT_LINK_MAX_REDIRECTS):
+        response = requests.head(url, allow_redirects=False, timeout=SHORT_LINK_TIMEOUT)
+        location = response.headers.get('Location')
+        if not response.is_redirect or not location:
+            return url
+        url = requests.compat.urljoin(url, location)
+        if urlparse(url).netloc.lower().split(':')[0] not in SHORT_LINK_DOMAINS:
+            return url
+    return url
+
+
+def resolve_short_link(url):
+    """解析短链接跳转后的URL，失败时返回None"""
+    try:
+        return _follow_redirects(url)
+    except requests.RequestException as e:
+        logger.warning(f"Error resolving short link {url}: {str(e)}")
+        return None
+
+
+def canonical_media_id(url):
+    """把URL规范化为媒体ID，指向同一视频的不同URL（分享链接、带追踪参数等）得到相同的ID。
+    b23.tv等短链接先解析跳转后的URL。无法识别的URL退化为去掉fragment后的URL哈希"""
+    parsed = urlparse(url)
+    media_id = _match_media_id(parsed)
+    if media_id:
+        return media_id
+    if parsed.netloc.lower().split(':')[0] in SHORT_LINK_DOMAINS:
+        resolved = resolve_short_link(url)
+        media_id = _match_media_id(urlparse(resolved)) if resolved else None
+        if media_id:
+            return media_id
+    clean_url = urlunparse(parsed._replace(fragment=''))
+    return 'url:' + hashlib.sha1(clean_url.encode()).hexdigest()
+
+
+def file_checksum(path):
+    """计算文件内容的sha256"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHECKSUM_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ArtifactStore:
+    """按(媒体ID, 产物类型)缓存处理产物。
+    使用中的产物持有引用计数，总大小超过配额时按最近使用时间淘汰未被引用的产物"""
+
+    def __init__(self, root=ARTIFACT_CACHE_PATH, quota_bytes=ARTIFACT_CACHE_QUOTA_MB * 1024 * 1024):
+        self.root = root
+        self.quota_bytes = quota_bytes
+        self._lock = threading.Lock()
+        os.makedirs(self.root, exist_ok=True)
+
+    def _media_dir(self, media_id):
+        """媒体ID对应的缓存目录"""
+        digest = hashlib.sha1(media_id.encode()).hexdigest()
+        return os.path.join(self.root, digest[:2], digest)
+
+    def acquire(self, media_id, kind):
+        """查找缓存，命中时增加引用计数并返回文件路径，未命中返回None"""
+        db = next(get_db())
+        try:
+            artifact = db.get(Artifact, (media_id, kind))
+            if artifact is None:
+                return None
+            if not os.path.exists(artifact.path):
+                # 文件被外部删除，索引失效
+                db.delete(artifact)
+                db.commit()
+                return None
+            db.query(Artifact).filter(
+                Artifact.media_id == media_id, Artifact.kind == kind
+            ).update({
+                Artifact.ref_count: Artifact.ref_count + 1,
+                Artifact.last_used_at: datetime.utcnow()
+            }, synchronize_session=False)
+            db.commit()
+            return artifact.path
+        except Exception as e:
+            db.rollback()
+            logger.error(f"Error looking up artifact {media_id}/{kind}: {str(e)}")
+            return None
+        finally:
+            db.close()
+
+    def put(self, media_id, kind, src_path):
+        """把文件移入缓存并持有一个引用，返回缓存中的路径。
+        保留原文件名，后续按文件名生成的视频ID等保持不变。
+        同一产物已有文件名不同的旧文件时：旧文件没有被引用则删除并换成新文件，
+        仍被其他处理链引用时不能删除，复用旧文件并丢弃新生成的文件"""
+        target_dir = self._media_dir(media_id)
+        os.makedirs(target_dir, exist_ok=True)
+        target = os.path.join(target_dir, os.path.basename(src_path))
+
+        db = next(get_db())
+        try:
+            artifact = db.get(Artifact, (media_id, kind))
+            previous = artifact.path if artifact is not None and artifact.path != target else None
+            if previous and not os.path.exists(previous):
+                previous = None
+            if previous and self._referenced(artifact):
+                os.remove(src_path)
+                target = previous
+            else:
+                checksum = file_checksum(src_path)
+                shutil.move(src_path, target)
+                if artifact is None:
+                    artifact = Artifact(media_id=media_id, kind=kind, ref_count=0)
+                    db.add(artifact)
+                elif previous:
+                    # 同一产物被重新生成且文件名不同，旧文件没有被引用，删除
+                    os.remove(previous)
+                artifact.path = target
+                artifact.size = os.path.getsize(target)
+                artifact.checksum = checksum
+            artifact.ref_count = (artifact.ref_count or 0) + 1
+            artifact.last_used_at = datetime.utcnow()
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+        self.evict()
+        return target
+
+    def _referenced(self, artifact):
+        """产物是否被处理链引用，长时间未释放的引用视为持有者已崩溃（与淘汰的判断一致）"""
+        stale = datetime.utcnow() - timedelta(seconds=ARTIFACT_PIN_TTL)
+        return bool(artifact.ref_count) and artifact.last_used_at is not None and artifact.last_used_at >= stale
+
+    def describe(self, media_id, kind):
+        """返回缓存产物的{path, size, checksum}，不存在时返回None"""
+        db = next(get_db())
+        try:
+            artifact = db.get(Artifact, (media_id, kind))
+            if artifact is None:
+                return None
+            return {'path': artifact.path, 'size': artifact.size, 'checksum': artifact.checksum}
+        finally:
+            db.close()
+
+    def invalidate(self, media_id, kind):
+        """删除损坏的产物，下次使用时重新生成"""
+        db = next(get_db())
+        try:
+            artifact = db.get(Artifact, (media_id, kind))
+            if artifact is None:
+                return
+            try:
+                os.remove(artifact.path)
+            except FileNotFoundError:
+                pass
+            db.delete(artifact)
+            db.commit()
+            logger.warning(f"Invalidated artifact {media_id}/{kind}")
+        except Exception as e:
+            db.rollback()
+            logger.error(f"Error invalidating artifact {media_id}/{kind}: {str(e)}")
+        finally:
+            db.close()
+
+    def release(self, media_id, kind):
+        """释放一个引用"""
+        db = next(get_db())
+        try:
+            db.query(Artifact).filter(
+                Artifact.media_id == media_id, Artifact.kind == kind, Artifact.ref_count > 0
+            ).update({Artifact.ref_count: Artifact.ref_count - 1}, synchronize_session=False)
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            logger.error(f"Error releasing artifact {media_id}/{kind}: {str(e)}")
+        finally:
+            db.close()
+
+    def evict(self):
+        """总大小超过配额时按最近使用时间淘汰未被引用的产物，返回释放的字节数"""
+        with self._lock:
+            db = next(get_db())
+            try:
+                total = db.query(func.coalesce(func.sum(Artifact.size), 0)).scalar()
+                if total <= self.quota_bytes:
+                    return 0
+                # 长时间未释放的引用视为持有者已崩溃
+                stale = datetime.utcnow() - timedelta(seconds=ARTIFACT_PIN_TTL)
+                candidates = db.query(Artifact).filter(
+                    or_(Artifact.ref_count == 0, Artifact.last_used_at < stale)
+                ).order_by(Artifact.last_used_at)
+
+                freed = 0
+                for artifact in candidates:
+                    if total - freed <= self.quota_bytes:
+                        break
+                    try:
+                        os.remove(artifact.path)
+                    except FileNotFoundError:
+                        pass
+                    try:
+                        # 目录为空时一并删除
+                        os.rmdir(os.path.dirname(artifact.path))
+                    except OSError:
+                        pass
+                    freed += artifact.size or 0
+                    db.delete(artifact)
+                db.commit()
+                if freed:
+                    logger.info(f"Evicted {freed} bytes from artifact cache")
+                if total - freed > self.quota_bytes:
+                    logger.warning(f"Artifact cache still over quota: {total - freed} bytes in use")
+                return freed
+            except Exception as e:
+                db.rollback()
+                logger.error(f"Error evicting artifacts: {str(e)}")
+                return 0
+            finally:
+                db.close()
+
+
+# 创建全局产物缓存实例
+artifact_store = ArtifactStore()
@@ -1,4 +1,5 @@
 import os
+import socket
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -18,16 +19,95 @@ LUX_COOKIES_PATH = os.getenv('LUX_COOKIES_PATH', './cookies')  # cookies文件
 FFMPEG_PATH = os.getenv('FFMPEG_PATH', '/usr/local/bin/ffmpeg')  # ffmpeg程序路径
 FFMPEG_OUTPUT_PATH = os.getenv('FFMPEG_OUTPUT_PATH', './processed')  # ffmpeg处理后的文件保存路径
 
+# 处理产物缓存配置：视频、音频、字幕按媒体ID缓存，重试或重复URL不再重新下载
+ARTIFACT_CACHE_PATH = os.getenv('ARTIFACT_CACHE_PATH', './artifacts')  # 缓存目录
+ARTIFACT_CACHE_QUOTA_MB = int(os.getenv('ARTIFACT_CACHE_QUOTA_MB', '10240'))  # 缓存占用的磁盘上限（MB），超出时按LRU淘汰
+ARTIFACT_PIN_TTL = int(os.getenv('ARTIFACT_PIN_TTL', '86400'))  # 引用超过该时间（秒）未释放视为进程已崩溃，可以被淘汰
+
 # 向量数据库配置
 CHROMA_DB_PATH = os.getenv('CHROMA_DB_PATH', './chroma_db')  # Chroma数据库路径
 EMBEDDING_MODEL = os.getenv('EMBEDDING_MODEL', 'all-MiniLM-L6-v2')  # 向量模型名称
+EMBEDDING_BATCH_SIZE = int(os.getenv('EMBEDDING_BATCH_SIZE', '64'))  # 每批计算向量的文本段数量
+EMBEDDING_WORKERS = int(os.getenv('EMBEDDING_WORKERS', '0'))  # 计算向量的进程数，0或1表示在当前进程中计算
+EMBEDDING_CACHE_PATH = os.getenv('EMBEDDING_CACHE_PATH', './embedding_cache.db')  # 向量缓存文件，为空时不缓存
+# 搜索服务配置
+SEARCH_QUERY_CACHE_SIZE = int(os.getenv('SEARCH_QUERY_CACHE_SIZE', '1024'))  # 缓存的查询向量数量
+SEARCH_RESULT_CACHE_SIZE = int(os.getenv('SEARCH_RESULT_CACHE_SIZE', '256'))  # 缓存的搜索结果数量，写入字幕时清空
+SEARCH_RESULT_CACHE_TTL = int(os.getenv('SEARCH_RESULT_CACHE_TTL', '60'))  # 搜索结果缓存的有效期（秒），兜底其他进程写入的字幕
+SEARCH_WARMUP = os.getenv('SEARCH_WARMUP', 'true').lower() == 'true'  # 服务启动时预先加载向量库和模型
+SEARCH_RESULTS_MAX = int(os.getenv('SEARCH_RESULTS_MAX', '50'))  # 每次搜索最多返回的结果数量
+SEARCH_BATCH_MAX = int(os.getenv('SEARCH_BATCH_MAX', '32'))  # 批量搜索每次最多的查询数量
+FULLTEXT_BACKFILL_CHUNK_SIZE = int(os.getenv('FULLTEXT_BACKFILL_CHUNK_SIZE', '1000'))  # 新建全文索引时每次回填的URL数量
+HYBRID_CANDIDATES = int(os.getenv('HYBRID_CANDIDATES', '50'))  # 混合搜索中关键词和向量检索各自召回的候选数量
+HYBRID_RRF_K = int(os.getenv('HYBRID_RRF_K', '60'))  # 倒数排名融合的平滑常数k
+HYBRID_SEARCH_WORKERS = int(os.getenv('HYBRID_SEARCH_WORKERS', '4'))  # 并发执行各路检索的线程数
+# 字幕切分：连续字幕合并为滑动窗口，每个窗口一个向量
+SUBTITLE_CHUNK_TOKENS = int(os.getenv('SUBTITLE_CHUNK_TOKENS', '200'))  # 每个窗口的最大token数（CJK字符或单词）
+SUBTITLE_CHUNK_OVERLAP = int(os.getenv('SUBTITLE_CHUNK_OVERLAP', '40'))  # 相邻窗口重叠的token数
+SUBTITLE_CHUNK_SECONDS = int(os.getenv('SUBTITLE_CHUNK_SECONDS', '60'))  # 每个窗口的最大时长（秒），0表示不限制
 
 # 任务处理配置
 MAX_RETRY_COUNT = int(os.getenv('MAX_RETRY_COUNT', '3'))  # 最大重试次数，-1表示无限重试
+QUEUE_SCAN_INTERVAL = int(os.getenv('QUEUE_SCAN_INTERVAL', '60'))  # 扫描新URL的间隔（秒）
+QUEUE_CLAIM_POLL_INTERVAL = int(os.getenv('QUEUE_CLAIM_POLL_INTERVAL', '30'))  # 队列为空时工作线程兜底领取任务的间隔（秒），平时依靠扫描线程的通知
+QUEUE_SCAN_BATCH_SIZE = int(os.getenv('QUEUE_SCAN_BATCH_SIZE', '1000'))  # 每批创建任务的URL数量
+QUEUE_FULL_SCAN_INTERVAL = int(os.getenv('QUEUE_FULL_SCAN_INTERVAL', '3600'))  # 从头全量扫描的间隔（秒），兜底
+# 任务租约：多个进程/节点共享数据库领取任务
+WORKER_ID = os.getenv('WORKER_ID', f'{socket.gethostname()}:{os.getpid()}')  # 本进程的租约持有者标识
+LEASE_TTL = int(os.getenv('LEASE_TTL', '300'))  # 租约有效期（秒），过期未续约的任务会被重新领取
+LEASE_HEARTBEAT_INTERVAL = int(os.getenv('LEASE_HEARTBEAT_INTERVAL', '60'))  # 续约间隔（秒）
+
+# 批量导入配置
+BATCH_CHUNK_SIZE = int(os.getenv('BATCH_CHUNK_SIZE', '1000'))  # 批量导入时每个事务处理的URL数量
+
+# 列表分页配置
+URL_PAGE_SIZE = int(os.getenv('URL_PAGE_SIZE', '10'))  # 默认每页数量
+URL_PAGE_SIZE_MAX = int(os.getenv('URL_PAGE_SIZE_MAX', '100'))  # 每页最大数量
+
+# 工作线程配置
+# 在服务进程内启动URL队列扫描和处理工作线程；关闭时需要另行运行工作进程，
+# 写入URL后的即时通知只对同一进程内的队列生效，其他进程按扫描间隔发现新URL
+RUN_WORKER = os.getenv('RUN_WORKER', 'false').lower() == 'true'
+WORKER_COUNT = int(os.getenv('WORKER_COUNT', '4'))  # 处理URL的工作线程数量
+# 各处理阶段的最大并发数：下载受网络限制，ffmpeg/向量化受CPU限制
+STAGE_CONCURRENCY = {
+    'download': int(os.getenv('STAGE_CONCURRENCY_DOWNLOAD', '2')),
+    'audio_extract': int(os.getenv('STAGE_CONCURRENCY_AUDIO_EXTRACT', str(os.cpu_count() or 2))),
+    'subtitle_extract': int(os.getenv('STAGE_CONCURRENCY_SUBTITLE_EXTRACT', str(os.cpu_count() or 2))),
+    'vectorize': int(os.getenv('STAGE_CONCURRENCY_VECTORIZE', '1')),
+}
+# 流水线模式：各处理阶段独立并行，阶段之间用有界队列衔接
+PIPELINE_MODE = os.getenv('PIPELINE_MODE', 'false').lower() == 'true'
+PIPELINE_QUEUE_SIZE = int(os.getenv('PIPELINE_QUEUE_SIZE', '2'))  # 阶段之间交接队列的容量
+WORKER_SHUTDOWN_TIMEOUT = int(os.getenv('WORKER_SHUTDOWN_TIMEOUT', '600'))  # 停止时等待在途任务完成的最长时间（秒）
 
-# 域名特定配置
+# 外部命令（lux/ffmpeg）各处理阶段的最长执行时间（秒），0表示不限制
+STAGE_TIMEOUTS = {
+    'download': int(os.getenv('STAGE_TIMEOUT_DOWNLOAD', '3600')),
+    'audio_extract': int(os.getenv('STAGE_TIMEOUT_AUDIO_EXTRACT', '1800')),
+    'subtitle_extract': int(os.getenv('STAGE_TIMEOUT_SUBTITLE_EXTRACT', '600')),
+}
+# 子进程资源限制，0表示不限制
+CHILD_NICE = int(os.getenv('CHILD_NICE', '0'))  # 子进程的nice增量
+CHILD_CPU_LIMIT = int(os.getenv('CHILD_CPU_LIMIT', '0'))  # CPU时间上限（秒）
+CHILD_MEMORY_LIMIT_MB = int(os.getenv('CHILD_MEMORY_LIMIT_MB', '0'))  # 虚拟内存上限（MB）
+TASK_STATE_FLUSH_INTERVAL = float(os.getenv('TASK_STATE_FLUSH_INTERVAL', '2'))  # 处理中任务的状态和进度批量写入任务表的间隔（秒）
+
+# 站点限流后的退避：首次退避DOMAIN_BACKOFF_BASE秒，连续限流时翻倍，最长DOMAIN_BACKOFF_MAX秒
+DOMAIN_BACKOFF_BASE = int(os.getenv('DOMAIN_BACKOFF_BASE', '30'))
+DOMAIN_BACKOFF_MAX = int(os.getenv('DOMAIN_BACKOFF_MAX', '900'))
+DOMAIN_THROTTLE_RETRIES = int(os.getenv('DOMAIN_THROTTLE_RETRIES', '2'))  # 被限流的下载在退避后重试的次数
+
+# 域名特定配置，子域名自动使用父域名的配置
 DOMAIN_CONFIGS = {
     'bilibili.com': {
+        'aliases': ['b23.tv'],  # 短链接等其他域名，共享同一处理链和限速额度
+        # 访问站点的限速：每秒开始的下载数、突发数量、同时下载数
+        'rate_limit': {
+            'rate': float(os.getenv('BILIBILI_RATE', '0.5')),
+            'burst': int(os.getenv('BILIBILI_BURST', '2')),
+            'max_concurrent': int(os.getenv('BILIBILI_MAX_CONCURRENT', '2')),
+        },
         'lux_args': [
             #'-c', LUX_COOKIES_PATH,  # cookies文件
             '-o', LUX_DOWNLOAD_PATH,  # 输出目录
@@ -35,6 +115,7 @@ DOMAIN_CONFIGS = {
         ],
         'ffmpeg_args': {
             'audio': [
+                '-y',  # 覆盖上次中断时留下的输出文件，不等待确认
                 '-i', '{input}',  # 输入文件
                 '-vn',  # 不处理视频
                 '-acodec', 'libmp3lame',  # 音频编码器
@@ -42,11 +123,31 @@ DOMAIN_CONFIGS = {
                 '{output}'  # 输出文件
             ],
             'subtitle': [
+                '-y',  # 覆盖上次中断时留下的输出文件，不等待确认
                 '-i', '{input}',  # 输入文件
                 '-map', '0:s:0',  # 选择第一个字幕流
                 '{output}'  # 输出文件
-            ]
+            ],
+            # combined模式：一次ffmpeg调用，输入只解复用一次，按输出逐个追加参数
+            'combined': {
+                'input': ['-y', '-i', '{input}'],  # -y覆盖上次中断时留下的输出文件
+                'outputs': {
+                    'audio': [
+                        '-map', '0:a:0',  # 选择第一个音频流
+                        '-vn',  # 不处理视频
+                        '-acodec', 'libmp3lame',  # 音频编码器
+                        '-q:a', '2',  # 音频质量
+                        '{output}'  # 输出文件
+                    ],
+                    'subtitle': [
+                        '-map', '0:s:0',  # 选择第一个字幕流
+                        '{output}'  # 输出文件
+                    ]
+                }
+            }
         },
+        # ffmpeg执行模式：combined一次调用产出处理链需要的全部输出，separate每个输出单独调用
+        'ffmpeg_mode': os.getenv('FFMPEG_MODE', 'combined'),
         'process_chain': ['lux', 'ffmpeg_audio', 'ffmpeg_subtitle']  # 处理链顺序
     }
 }
@@ -55,6 +156,15 @@ DOMAIN_CONFIGS = {
 ROLE = os.getenv('ROLE', 'master')  # 'master' 或 'slave'
 MASTER_HOST = os.getenv('MASTER_HOST', '127.0.0.1')
 MASTER_PORT = int(os.getenv('MASTER_PORT', '8080'))
+NODE_NAME = os.getenv('NODE_NAME', f'{socket.gethostname()}:{PORT}')  # 本节点名称，从节点应与主节点SLAVE_LIST中的host:port一致
+SYNC_BATCH_SIZE = int(os.getenv('SYNC_BATCH_SIZE', '1000'))  # 按变更序列号同步时每批的URL数量
+SYNC_INTERVAL = int(os.getenv('SYNC_INTERVAL', '30'))  # 从节点推送间隔（秒）
+SYNC_CHUNK_SIZE = int(os.getenv('SYNC_CHUNK_SIZE', '500'))  # 同步写入时每次IN查询的URL数量
+SYNC_GAP_LAG = int(os.getenv('SYNC_GAP_LAG', '60'))  # 变更序列号出现空洞时，空洞之后的变更至少经过多少秒才越过空洞继续同步
+SYNC_PULL_PAGE_SIZE_MAX = int(os.getenv('SYNC_PULL_PAGE_SIZE_MAX', '5000'))  # 增量拉取每页最大数量
+SYNC_PULL_YIELD_SIZE = int(os.getenv('SYNC_PULL_YIELD_SIZE', '500'))  # 流式拉取时每次从数据库读取的行数
+SYNC_WIRE_FORMAT = os.getenv('SYNC_WIRE_FORMAT', 'columns')  # 同步传输格式：json、columns或msgpack
+SYNC_WIRE_COMPRESSION = os.getenv('SYNC_WIRE_COMPRESSION', 'gzip')  # 同步压缩算法：none、gzip或zstd
 SLAVE_LIST = os.getenv('SLAVE_LIST', '')  # 逗号分隔的host:port列表
 if SLAVE_LIST:
     SLAVE_LIST = [
@@ -62,4 +172,7 @@ if SLAVE_LIST:
         for item in SLAVE_LIST.split(',') if ':' in item
     ]
 else:
-    SLAVE_LIST = [] 
\ No newline at end of file
+    SLAVE_LIST = []
+REPLICATION_INTERVAL = int(os.getenv('REPLICATION_INTERVAL', '5'))  # 主节点向从节点复制的兜底轮询间隔（秒）
+REPLICATION_TIMEOUT = int(os.getenv('REPLICATION_TIMEOUT', '10'))  # 单次复制请求超时（秒）
+REPLICATION_MAX_BACKOFF = int(os.getenv('REPLICATION_MAX_BACKOFF', '300'))  # 复制失败后最大退避时间（秒） 
\ No newline at end of file
@@ -0,0 +1,133 @@
+import threading
+import time
+import logging
+from server.config import DOMAIN_CONFIGS, DOMAIN_BACKOFF_BASE, DOMAIN_BACKOFF_MAX
+
+logger = logging.getLogger(__name__)
+
+
+def domain_key(netloc):
+    """把域名映射到DOMAIN_CONFIGS中的配置名：子域名（如m.bilibili.com）和aliases中的域名（如b23.tv）
+    共享同一处理链和限速额度，无对应配置时返回None"""
+    host = netloc.lower().split('@')[-1].split(':')[0]
+    for key, config in DOMAIN_CONFIGS.items():
+        for domain in [key] + config.get('aliases', []):
+            if host == domain or host.endswith('.' + domain):
+                return key
+    return None
+
+
+class DomainBudget:
+    """单个域名的令牌桶、并发数和退避状态"""
+
+    def __init__(self, name, rate, burst, max_concurrent):
+        self.name = name
+        self.rate = rate  # 每秒补充的令牌数，0表示不限速
+        self.burst = max(burst, 1)
+        self.max_concurrent = max(max_concurrent, 1)
+        self.tokens = float(self.burst)
+        self.refilled_at = time.monotonic()
+        self.active = 0
+        self.failures = 0  # 连续被限流的次数
+        self.backoff_until = 0.0
+
+    def refill(self, now):
+        if self.rate > 0:
+            self.tokens = min(float(self.burst), self.tokens + (now - self.refilled_at) * self.rate)
+        else:
+            self.tokens = float(self.burst)
+        self.refilled_at = now
+
+    def wait_time(self, now):
+        """距离可以开始下一个任务还需等待的秒数，0表示可以立即开始"""
+        if now < self.backoff_until:
+            return self.backoff_until - now
+        if self.tokens < 1:
+            return (1 - self.tokens) / self.rate
+        return 0.0
+
+    def to_dict(self):
+        now = time.monotonic()
+        return {
+            'domain': self.name,
+            'rate': self.rate,
+            'burst': self.burst,
+            'max_concurrent': self.max_concurrent,
+            'active': self.active,
+            'tokens': round(self.tokens, 2),
+            'failures': self.failures,
+            'backoff_remaining': round(max(self.backoff_until - now, 0.0), 1)
+        }
+
+
+class DomainScheduler:
+    """按域名限制访问站点的任务：令牌桶限制开始速率，同时运行的任务数有上限，
+    被站点限流（412/429）后指数退避，成功后恢复"""
+
+    def __init__(self):
+        self.budgets = {}
+        for key, config in DOMAIN_CONFIGS.items():
+            limit = config.get('rate_limit', {})
+            self.budgets[key] = DomainBudget(
+                key, limit.get('rate', 0), limit.get('burst', 1), limit.get('max_concurrent', 1)
+            )
+        self._cond = threading.Condition()
+
+    def acquire(self, key, cancel_event=None):
+        """占用域名的一个名额，额度不足时阻塞等待，取消时返回False"""
+        budget = self.budgets.get(key)
+        if budget is None:
+            return True
+        with self._cond:
+            while True:
+                if cancel_event is not None and cancel_event.is_set():
+                    return False
+                now = time.monotonic()
+                budget.refill(now)
+                wait = budget.wait_time(now)
+                if budget.active < budget.max_concurrent and wait == 0:
+                    budget.tokens -= 1
+                    budget.active += 1
+                    return True
+                # 并发已满时等待release通知，同时定期检查取消
+                self._cond.wait(min(wait, 1.0) if wait else 1.0)
+
+    def release(self, key):
+        """释放域名的名额"""
+        budget = self.budgets.get(key)
+        if budget is None:
+            return
+        with self._cond:
+            budget.active = max(budget.active - 1, 0)
+            self._cond.notify_all()
+
+    def report_success(self, key):
+        """请求成功，清除退避状态"""
+        budget = self.budgets.get(key)
+        if budget is None:
+            return
+        with self._cond:
+            budget.failures = 0
+
+    def report_throttled(self, key):
+        """被站点限流：指数退避，退避期间该域名不再开始新任务，返回退避秒数"""
+        budget = self.budgets.get(key)
+        if budget is None:
+            return 0
+        with self._cond:
+            budget.failures += 1
+            backoff = min(DOMAIN_BACKOFF_BASE * 2 ** (budget.failures - 1), DOMAIN_BACKOFF_MAX)
+            budget.backoff_until = max(budget.backoff_until, time.monotonic() + backoff)
+            budget.tokens = 0.0
+            self._cond.notify_all()
+        logger.warning(f"Throttled by {key}, backing off for {backoff}s")
+        return backoff
+
+    def status(self):
+        """各域名的限速状态"""
+        with self._cond:
+            return [budget.to_dict() for budget in self.budgets.values()]
+
+
+# 创建全局域名调度实例
+domain_scheduler = DomainScheduler()
@@ -0,0 +1,230 @@
+import os
+import time
+import hashlib
+import sqlite3
+import threading
+import logging
+import multiprocessing
+from collections import deque
+from itertools import islice
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from server.config import EMBEDDING_MODEL, EMBEDDING_BATCH_SIZE, EMBEDDING_WORKERS, EMBEDDING_CACHE_PATH
+
+logger = logging.getLogger(__name__)
+
+# chromadb默认的向量函数使用的模型，未安装sentence-transformers时退化为它
+DEFAULT_MODEL = 'all-MiniLM-L6-v2'
+
+# 进程池中每个子进程加载一次的模型
+_worker_encoder = None
+
+
+def load_encoder(model_name):
+    """加载向量模型，返回encode(texts) -> list[list[float]]。
+    优先使用sentence-transformers加载model_name，未安装时使用chromadb默认的向量函数"""
+    try:
+        from sentence_transformers import SentenceTransformer
+    except ImportError:
+        from chromadb.utils import embedding_functions
+        if model_name != DEFAULT_MODEL:
+            logger.warning(
+                f"sentence-transformers not installed, falling back to {DEFAULT_MODEL} instead of {model_name}"
+            )
+        function = embedding_functions.DefaultEmbeddingFunction()
+        return lambda texts: [[float(x) for x in vector] for vector in function(list(texts))]
+
+    model = SentenceTransformer(model_name)
+    return lambda texts: model.encode(list(texts), batch_size=len(texts), convert_to_numpy=True).tolist()
+
+
+def _init_worker(model_name):
+    global _worker_encoder
+    _worker_encoder = load_encoder(model_name)
+
+
+def _encode_in_worker(texts):
+    return _worker_encoder(texts)
+
+
+def text_hash(text):
+    """缓存键中的文本哈希"""
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+class EmbeddingCache:
+    """向量缓存：按(模型, 文本哈希)保存在sqlite文件中，重新索引未变化的字幕时不再重复计算"""
+
+    # 每次IN查询的键数量，低于sqlite的变量个数限制
+    LOOKUP_CHUNK_SIZE = 500
+
+    def __init__(self, path):
+        self.path = path
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS embeddings ('
+                'model TEXT NOT NULL, text_hash TEXT NOT NULL, vector BLOB NOT NULL, '
+                'PRIMARY KEY (model, text_hash))'
+            )
+            self._conn.commit()
+        return self._conn
+
+    def get_many(self, model, keys):
+        """按顺序返回各键对应的向量，未命中的位置为None"""
+        found = {}
+        try:
+            with self._lock:
+                conn = self._connect()
+                unique = list(set(keys))
+                for i in range(0, len(unique), self.LOOKUP_CHUNK_SIZE):
+                    chunk = unique[i:i + self.LOOKUP_CHUNK_SIZE]
+                    rows = conn.execute(
+                        f"SELECT text_hash, vector FROM embeddings WHERE model = ? AND text_hash IN "
+                        f"({','.join('?' * len(chunk))})",
+                        [model] + chunk
+                    ).fetchall()
+                    for key, blob in rows:
+                        found[key] = array('f', blob).tolist()
+        except sqlite3.Error as e:
+            logger.error(f"Error reading embedding cache: {str(e)}")
+        return [found.get(key) for key in keys]
+
+    def put_many(self, model, items):
+        """写入[(键, 向量)]"""
+        try:
+            with self._lock:
+                conn = self._connect()
+                conn.executemany(
+                    'INSERT OR REPLACE INTO embeddings (model, text_hash, vector) VALUES (?, ?, ?)',
+                    [(model, key, array('f', vector).tobytes()) for key, vector in items]
+                )
+                conn.commit()
+        except sqlite3.Error as e:
+            logger.error(f"Error writing embedding cache: {str(e)}")
+
+
+class EmbeddingEngine:
+    """向量化引擎：模型只加载一次，按EMBEDDING_BATCH_SIZE分批计算，
+    EMBEDDING_WORKERS大于1时在进程池中并行计算，结果写入向量缓存，并统计吞吐量"""
+
+    def __init__(self, model_name=EMBEDDING_MODEL, batch_size=EMBEDDING_BATCH_SIZE, workers=EMBEDDING_WORKERS,
+                 cache_path=EMBEDDING_CACHE_PATH):
+        self.model_name = model_name
+        self.batch_size = max(batch_size, 1)
+        self.workers = workers
+        self.cache = EmbeddingCache(cache_path) if cache_path else None
+        self._encoder = None
+        self._pool = None
+        self._lock = threading.Lock()
+        self.total_segments = 0
+        self.total_seconds = 0.0
+        self.cache_hits = 0
+
+    def _get_encoder(self):
+        with self._lock:
+            if self._encoder is None:
+                started = time.time()
+                self._encoder = load_encoder(self.model_name)
+                logger.info(f"Loaded embedding model {self.model_name} in {time.time() - started:.2f}s")
+            return self._encoder
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None:
+                # spawn方式启动，避免fork时复制工作线程持有的锁和数据库连接
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context('spawn'),
+                    initializer=_init_worker,
+                    initargs=(self.model_name,)
+                )
+                logger.info(f"Started embedding process pool with {self.workers} workers")
+            return self._pool
+
+    def warmup(self):
+        """预先加载模型（进程池模式下启动进程池），避免第一次请求等待"""
+        if self.workers > 1:
+            self._get_pool()
+        self._get_encoder()
+
+    def embed(self, texts):
+        """计算全部文本的向量"""
+        vectors = []
+        for _, batch in self.embed_batches(texts):
+            vectors.extend(batch)
+        return vectors
+
+    def embed_batches(self, texts):
+        """分批计算向量，按顺序生成(起始下标, 该批向量)，调用方可以逐批写入，内存占用与批大小相关。
+        已缓存的文本直接取缓存，只计算未命中的部分；进程池模式下最多同时计算2倍进程数的批次"""
+        texts = list(texts)
+        # 只统计计算向量（或等待进程池结果）的时间，不含调用方写入的时间
+        elapsed = 0.0
+        hits = 0
+        pool = self._get_pool() if self.workers > 1 and len(texts) > self.batch_size else None
+        window = self.workers * 2 if pool else 1
+
+        def prepare(start):
+            """查缓存，进程池模式下立即提交未命中的文本"""
+            batch = texts[start:start + self.batch_size]
+            keys = [text_hash(text) for text in batch]
+            vectors = self.cache.get_many(self.model_name, keys) if self.cache else [None] * len(batch)
+            misses = [i for i, vector in enumerate(vectors) if vector is None]
+            future = pool.submit(_encode_in_worker, [batch[i] for i in misses]) if pool and misses else None
+            return start, batch, keys, vectors, misses, future
+
+        remaining = iter(range(0, len(texts), self.batch_size))
+        pending = deque(prepare(start) for start in islice(remaining, window))
+        while pending:
+            start, batch, keys, vectors, misses, future = pending.popleft()
+            if misses:
+                encoded = time.time()
+                results = future.result() if future else self._get_encoder()([batch[i] for i in misses])
+                elapsed += time.time() - encoded
+                for i, vector in zip(misses, results):
+                    vectors[i] = vector
+                if self.cache:
+                    self.cache.put_many(self.model_name, [(keys[i], vectors[i]) for i in misses])
+            hits += len(batch) - len(misses)
+            # 取走一批后补充一批，保持进程池繁忙
+            next_start = next(remaining, None)
+            if next_start is not None:
+                pending.append(prepare(next_start))
+            yield start, vectors
+        self._record(len(texts), hits, elapsed)
+
+    def _record(self, count, hits, seconds):
+        """记录并输出吞吐量，缓存命中的段不计入计算时间"""
+        with self._lock:
+            self.total_segments += count - hits
+            self.total_seconds += seconds
+            self.cache_hits += hits
+        if count:
+            logger.info(
+                f"Embedded {count} segments ({hits} cached) in {seconds:.2f}s "
+                f"({(count - hits) / max(seconds, 1e-6):.1f} segments/s, total {self.throughput():.1f} segments/s)"
+            )
+
+    def throughput(self):
+        """累计吞吐量（段/秒）"""
+        return self.total_segments / self.total_seconds if self.total_seconds else 0.0
+
+    def close(self):
+        """关闭进程池"""
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown()
+                self._pool = None
+
+
+# 创建全局向量化引擎实例
+embedding_engine = EmbeddingEngine()
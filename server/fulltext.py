@@ -0,0 +1,167 @@
+import re
+import logging
+import jieba
+from sqlalchemy import event, inspect, text
+from server.database import engine
+from server.models import URL
+from server.config import FULLTEXT_BACKFILL_CHUNK_SIZE
+
+logger = logging.getLogger(__name__)
+
+# 全文索引表，rowid即urls.id；各列存放jieba分词后以空格分隔的文本
+FTS_TABLE = 'urls_fts'
+FTS_COLUMNS = ('title', 'notes', 'tags', 'domain')
+# BM25中各列的权重，与FTS_COLUMNS一一对应：标题最重要，其次标签
+FTS_WEIGHTS = (10.0, 2.0, 5.0, 1.0)
+# 只保留包含文字或数字的词，去掉标点和空白
+WORD = re.compile(r'\w')
+
+
+def segment(value, for_search=True):
+    """分词后以空格连接。写入索引时用搜索引擎模式，长词同时拆出短词，
+    查询时用精确模式，使'中华人民共和国'和'人民'都能命中"""
+    if value is None:
+        return ''
+    # 同步数据等来源的标题可能不是字符串（如数字），按字符串索引
+    value = str(value)
+    if not value:
+        return ''
+    words = jieba.cut_for_search(value) if for_search else jieba.cut(value)
+    return ' '.join(word.strip() for word in words if WORD.search(word))
+
+
+def _document(target):
+    """URL记录对应的索引文档"""
+    return {
+        'title': segment(target.title),
+        'notes': segment(target.notes),
+        'tags': segment(' '.join(str(tag) for tag in (target.tags or []))),
+        'domain': segment(target.domain),
+    }
+
+
+def build_match_query(query):
+    """把用户输入转换为FTS5的MATCH表达式：分词后每个词加引号，多个词之间为AND"""
+    words = [word for word in segment(query, for_search=False).split() if word]
+    return ' '.join('"{}"'.format(word.replace('"', '""')) for word in words)
+
+
+class FullTextIndex:
+    """URL标题、备注、标签、域名的全文索引（SQLite FTS5），
+    由URL的插入、更新、删除事件增量维护，查询按BM25排序。
+    导入模块时不建表，服务启动时调用ensure()建表并在需要时回填"""
+
+    def __init__(self, bind=engine):
+        self.bind = bind
+        self.supported = bind.dialect.name == 'sqlite'
+        self._ready = None  # 索引表是否存在，首次用到时检查并缓存
+
+    def ready(self, connection=None):
+        """索引表是否可用"""
+        if not self.supported:
+            return False
+        if self._ready is None:
+            if connection is None:
+                with self.bind.connect() as connection:
+                    self._ready = self._table_exists(connection)
+            else:
+                self._ready = self._table_exists(connection)
+        return self._ready
+
+    def _table_exists(self, connection):
+        return connection.execute(
+            text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"), {'name': FTS_TABLE}
+        ).first() is not None
+
+    def ensure(self):
+        """创建索引表（已存在时跳过）。索引的文档数与urls表的行数不一致时重建索引，
+        包括通过迁移新建的空表、以及未经ORM写入的URL"""
+        if not self.supported:
+            logger.info("Full-text index requires SQLite FTS5, disabled")
+            return False
+        try:
+            with self.bind.begin() as connection:
+                connection.execute(text(
+                    f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} "
+                    f"USING fts5({', '.join(FTS_COLUMNS)}, tokenize='unicode61')"
+                ))
+                if inspect(connection).has_table(URL.__tablename__):
+                    indexed = connection.execute(text(f"SELECT count(*) FROM {FTS_TABLE}")).scalar()
+                    total = connection.execute(text(f"SELECT count(*) FROM {URL.__tablename__}")).scalar()
+                    if indexed != total:
+                        logger.info(f"Full-text index has {indexed} of {total} URLs, rebuilding")
+                        connection.execute(text(f"DELETE FROM {FTS_TABLE}"))
+                        self._backfill(connection)
+            self._ready = True
+        except Exception as e:
+            # SQLite未编译FTS5等情况下退化为不提供全文搜索
+            self._ready = False
+            logger.error(f"Full-text index unavailable: {str(e)}")
+        return self._ready
+
+    def _backfill(self, connection):
+        """按id顺序分块把已有URL写入索引"""
+        table = URL.__table__
+        last_id = 0
+        total = 0
+        while True:
+            rows = connection.execute(
+                table.select().where(table.c.id > last_id).order_by(table.c.id).limit(FULLTEXT_BACKFILL_CHUNK_SIZE)
+            ).fetchall()
+            if not rows:
+                break
+            connection.execute(self._insert_sql(), [dict(_document(row), rowid=row.id) for row in rows])
+            last_id = rows[-1].id
+            total += len(rows)
+        logger.info(f"Backfilled full-text index with {total} URLs")
+
+    def _insert_sql(self):
+        return text(
+            f"INSERT INTO {FTS_TABLE} (rowid, {', '.join(FTS_COLUMNS)}) "
+            f"VALUES (:rowid, {', '.join(':' + column for column in FTS_COLUMNS)})"
+        )
+
+    def write(self, connection, target, replace=True):
+        """写入一个URL的索引文档，replace为True时先删除旧文档"""
+        if replace:
+            self.delete(connection, target)
+        connection.execute(self._insert_sql(), dict(_document(target), rowid=target.id))
+
+    def delete(self, connection, target):
+        connection.execute(text(f"DELETE FROM {FTS_TABLE} WHERE rowid = :rowid"), {'rowid': target.id})
+
+    def search(self, db, query, limit, offset=0):
+        """全文搜索，返回按相关度排序的[(url_id, score)]，score越小越相关"""
+        match = build_match_query(query)
+        if not match:
+            return []
+        rows = db.execute(text(
+            f"SELECT rowid, bm25({FTS_TABLE}, {', '.join(str(w) for w in FTS_WEIGHTS)}) AS score "
+            f"FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH :match ORDER BY score LIMIT :limit OFFSET :offset"
+        ), {'match': match, 'limit': limit, 'offset': offset}).fetchall()
+        return [(row.rowid, row.score) for row in rows]
+
+
+# 创建全局全文索引实例
+fulltext_index = FullTextIndex()
+
+
+@event.listens_for(URL, 'after_insert')
+def _fulltext_after_insert(mapper, connection, target):
+    if fulltext_index.ready(connection):
+        fulltext_index.write(connection, target, replace=False)
+
+
+@event.listens_for(URL, 'after_update')
+def _fulltext_after_update(mapper, connection, target):
+    if not fulltext_index.ready(connection):
+        return
+    state = inspect(target)
+    if any(getattr(state.attrs, column).history.has_changes() for column in FTS_COLUMNS):
+        fulltext_index.write(connection, target)
+
+
+@event.listens_for(URL, 'after_delete')
+def _fulltext_after_delete(mapper, connection, target):
+    if fulltext_index.ready(connection):
+        fulltext_index.delete(connection, target)
@@ -0,0 +1,120 @@
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from server.database import SessionLocal
+from server.models import URL
+from server.fulltext import fulltext_index
+from server.config import HYBRID_CANDIDATES, HYBRID_RRF_K, HYBRID_SEARCH_WORKERS
+
+logger = logging.getLogger(__name__)
+
+# 每个URL最多附带的字幕片段数量
+MAX_SEGMENTS_PER_URL = 3
+
+
+def reciprocal_rank_fusion(rankings, k=HYBRID_RRF_K):
+    """倒数排名融合：rankings为{来源: [键, ...]}（按相关度排序），
+    每个键的得分为各来源中1/(k + 排名)之和，返回按得分降序的[(键, 得分, {来源: 排名})]"""
+    scores = {}
+    ranks = {}
+    for source, keys in rankings.items():
+        for rank, key in enumerate(keys, 1):
+            scores[key] = scores.get(key, 0.0) + 1.0 / (k + rank)
+            ranks.setdefault(key, {})[source] = rank
+    fused = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+    return [(key, score, ranks[key]) for key, score in fused]
+
+
+def _elapsed_ms(started):
+    return round((time.time() - started) * 1000, 2)
+
+
+class HybridSearcher:
+    """混合搜索：关键词检索（URL全文索引）和向量检索（字幕向量库）并发执行，
+    字幕片段按元数据中的url归并到URL，两路排名用倒数排名融合合并为一个列表"""
+
+    def __init__(self, workers=HYBRID_SEARCH_WORKERS):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='hybrid-search')
+
+    def _keyword_leg(self, query, candidates):
+        """关键词检索，返回按相关度排序的url_id列表"""
+        if not fulltext_index.ready():
+            raise RuntimeError('Full-text search unavailable')
+        db = SessionLocal()
+        try:
+            return [url_id for url_id, _ in fulltext_index.search(db, query, candidates)]
+        finally:
+            db.close()
+
+    def _vector_leg(self, query, candidates):
+        """向量检索，按URL归并字幕片段：URL的排名取其最相关片段的位置，
+        返回(按相关度排序的url列表, {url: [片段, ...]})"""
+        from server.vector_store import vector_store
+        order = []
+        segments = {}
+        for hit in vector_store.search(query, candidates):
+            url = (hit.get('metadata') or {}).get('url')
+            if not url:
+                continue
+            if url not in segments:
+                order.append(url)
+                segments[url] = []
+            if len(segments[url]) < MAX_SEGMENTS_PER_URL:
+                segments[url].append(hit)
+        return order, segments
+
+    def _run_leg(self, name, function, *args):
+        """执行一路检索，返回(结果, 耗时毫秒, 错误信息)，某一路失败时不影响另一路"""
+        started = time.time()
+        try:
+            return function(*args), _elapsed_ms(started), None
+        except Exception as e:
+            logger.warning(f"Hybrid search {name} leg failed: {str(e)}")
+            return None, _elapsed_ms(started), str(e)
+
+    def search(self, db, query, limit=10, offset=0):
+        """返回(结果列表, 各阶段耗时, 各路错误)。结果项为
+        {'url', 'record'（URL记录，向量库中有但URL表中没有时为None）, 'score', 'ranks', 'segments'}"""
+        started = time.time()
+        candidates = max(HYBRID_CANDIDATES, offset + limit)
+        keyword_future = self.executor.submit(self._run_leg, 'keyword', self._keyword_leg, query, candidates)
+        vector_future = self.executor.submit(self._run_leg, 'vector', self._vector_leg, query, candidates)
+        url_ids, keyword_ms, keyword_error = keyword_future.result()
+        vector_hits, vector_ms, vector_error = vector_future.result()
+        timings = {'keyword_ms': keyword_ms, 'vector_ms': vector_ms}
+        errors = {name: error for name, error in (('keyword', keyword_error), ('vector', vector_error)) if error}
+
+        # 关键词命中的是URL id，向量命中的是url字符串，先把关键词结果换成url字符串再融合
+        stage = time.time()
+        url_ids = url_ids or []
+        vector_order, segments = vector_hits or ([], {})
+        rows = {row.id: row for row in db.query(URL).filter(URL.id.in_(url_ids)).all()} if url_ids else {}
+        keyword_order = [rows[url_id].url for url_id in url_ids if url_id in rows]
+        timings['join_ms'] = _elapsed_ms(stage)
+
+        stage = time.time()
+        fused = reciprocal_rank_fusion({'keyword': keyword_order, 'vector': vector_order})
+        page = fused[offset:offset + limit]
+        timings['fusion_ms'] = _elapsed_ms(stage)
+
+        # 只为当前页中仅由向量检索命中的url查询URL记录
+        stage = time.time()
+        records = {row.url: row for row in rows.values()}
+        missing = [url for url, _, _ in page if url not in records]
+        if missing:
+            records.update({row.url: row for row in db.query(URL).filter(URL.url.in_(missing)).all()})
+        timings['join_ms'] = round(timings['join_ms'] + _elapsed_ms(stage), 2)
+
+        results = [{
+            'url': url,
+            'record': records.get(url),
+            'score': round(score, 6),
+            'ranks': ranks,
+            'segments': segments.get(url, [])
+        } for url, score, ranks in page]
+        timings['total_ms'] = _elapsed_ms(started)
+        return results, timings, errors
+
+
+# 创建全局混合搜索实例
+hybrid_searcher = HybridSearcher()
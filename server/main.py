@@ -1,17 +1,31 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response
 from flask_cors import CORS
 
 from server.database import get_db, engine
-from server.models import URL, Base
+from server.models import URL, URLTag, Base
 from server.url_queue import url_queue
+from server.sync import apply_sync_urls, url_to_sync_dict, SyncEncoder, decode_sync_body, wire_settings
+from server.sync import supported_content_types, supported_encodings, JSON_CONTENT_TYPE
+from server.sync import changed_urls_since, get_peer_seq, set_peer_seq, compact_changes, current_seq, post_sync_urls
+from server.replication import replicator
 from server.worker import url_worker
-from server.config import ROLE, MASTER_HOST, MASTER_PORT, HOST, PORT
+from server.task_state import task_states
+from server.domain_scheduler import domain_scheduler
+from server.fulltext import fulltext_index
+from server.hybrid_search import hybrid_searcher
+from server.config import ROLE, MASTER_HOST, MASTER_PORT, HOST, PORT, BATCH_CHUNK_SIZE, URL_PAGE_SIZE, URL_PAGE_SIZE_MAX
+from server.config import SYNC_PULL_PAGE_SIZE_MAX, SYNC_PULL_YIELD_SIZE, SYNC_BATCH_SIZE, SYNC_INTERVAL, NODE_NAME
+from server.config import SEARCH_WARMUP, SEARCH_RESULTS_MAX, SEARCH_BATCH_MAX, RUN_WORKER
 
-from sqlalchemy.exc import SQLAlchemyError
-from sqlalchemy import desc
+from sqlalchemy.exc import SQLAlchemyError, IntegrityError
+from sqlalchemy import desc, asc, tuple_
+from urllib.parse import urlparse
 import logging
 import traceback
 import os
+import json
+import base64
+import zlib
 import jieba
 import jieba.analyse
 import threading
@@ -31,7 +45,45 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
-CORS(app)
+CORS(app, expose_headers=['X-Next-Cursor'])
+
+
+def _notify_urls_written():
+    """URL写入提交后通知任务队列和复制调度，无需等待下一次轮询"""
+    url_queue.notify()
+    replicator.notify()
+
+
+def _url_to_dict(url):
+    """将URL记录序列化为接口返回的字典"""
+    return {
+        'id': url.id,
+        'url': url.url,
+        'title': url.title,
+        'domain': url.domain,
+        'path': url.path,
+        'query_params': url.query_params,
+        'tags': url.tags or [],
+        'notes': url.notes or '',
+        'created_at': url.created_at.isoformat(),
+        'updated_at': url.updated_at.isoformat()
+    }
+
+
+def _encode_cursor(dt, row_id):
+    """将(时间, id)编码为不透明的游标字符串"""
+    raw = json.dumps([dt.isoformat(), row_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def _decode_cursor(token):
+    """解析游标字符串，返回(时间, id)，格式错误时抛出ValueError"""
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        dt, row_id = json.loads(raw)
+        return datetime.fromisoformat(dt), int(row_id)
+    except Exception:
+        raise ValueError(f"invalid cursor: {token}")
 
 
 @app.route('/', methods=['GET'])
@@ -97,19 +149,17 @@ def create_url():
         db.add(url)
         db.commit()
         db.refresh(url)
+        _notify_urls_written()
         
+        return jsonify(_url_to_dict(url)), 201
+    except IntegrityError:
+        # 违反uix_url唯一约束，说明URL已存在
+        db.rollback()
+        existing = db.query(URL).filter(URL.url == url.url).first()
         return jsonify({
-            'id': url.id,
-            'url': url.url,
-            'title': url.title,
-            'domain': url.domain,
-            'path': url.path,
-            'query_params': url.query_params,
-            'tags': url.tags,
-            'notes': url.notes,
-            'created_at': url.created_at.isoformat(),
-            'updated_at': url.updated_at.isoformat()
-        }), 201
+            'error': 'URL already exists',
+            'id': existing.id if existing else None
+        }), 409
     except SQLAlchemyError as e:
         db.rollback()
         error_msg = f"Database error: {str(e)}\n{traceback.format_exc()}"
@@ -122,23 +172,198 @@ def create_url():
     finally:
         db.close()
 
+def _read_batch_items():
+    """读取批量导入的请求体，支持JSON数组（或{"urls": [...]}）和NDJSON流"""
+    if request.mimetype in ('application/x-ndjson', 'application/ndjson'):
+        return _iter_ndjson(request.stream)
+    data = request.get_json(silent=True)
+    if isinstance(data, dict):
+        data = data.get('urls')
+    if not isinstance(data, list):
+        return None
+    return data
+
+
+def _iter_ndjson(stream):
+    """逐行解析NDJSON，无法解析的行返回None（记为invalid）"""
+    for line in stream:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError:
+            yield None
+
+
+def _build_batch_url(item):
+    """将批量导入条目规范化为URL对象，无效条目返回None"""
+    if isinstance(item, str):
+        item = {'url': item}
+    if not isinstance(item, dict) or not isinstance(item.get('url'), str):
+        return None
+    tags = item.get('tags') or []
+    if not isinstance(tags, list):
+        return None
+    # URL构造函数内部调用_parse_url完成规范化（去除query和fragment）
+    url = URL(
+        url=item['url'].strip(),
+        title=item.get('title') or '',
+        tags=[str(tag) for tag in tags],
+        notes=item.get('notes') or ''
+    )
+    if not url.domain or not urlparse(url.url).scheme:
+        return None
+    return url
+
+
+def _merge_batch_url(obj, candidate):
+    """将导入条目合并到已有记录，返回是否有字段发生变化"""
+    changed = False
+    if candidate.title and candidate.title != obj.title:
+        obj.title = candidate.title
+        changed = True
+    old_tags = obj.tags or []
+    new_tags = [tag for tag in candidate.tags if tag not in old_tags]
+    if new_tags:
+        obj.tags = old_tags + new_tags
+        changed = True
+    if candidate.notes and candidate.notes != obj.notes:
+        obj.notes = candidate.notes
+        changed = True
+    return changed
+
+
+def _upsert_batch_chunk(db, chunk, results):
+    """在一个事务中写入一批URL，chunk为[(序号, URL对象)]"""
+    existing = {
+        u.url: u for u in db.query(URL).filter(URL.url.in_({c.url for _, c in chunk}))
+    }
+    inserted = {}
+    statuses = []
+    for index, candidate in chunk:
+        obj = existing.get(candidate.url)
+        if obj is not None:
+            status = 'updated' if _merge_batch_url(obj, candidate) else 'duplicate'
+        elif candidate.url in inserted:
+            # 同一批次中重复出现的URL，合并到待插入的记录中
+            obj = inserted[candidate.url]
+            _merge_batch_url(obj, candidate)
+            status = 'duplicate'
+        else:
+            obj = candidate
+            db.add(obj)
+            inserted[obj.url] = obj
+            status = 'inserted'
+        statuses.append((index, obj, status))
+
+    try:
+        db.flush()
+        # 提交前读取id，避免提交后对象过期导致逐行重新查询
+        rows = [(index, obj.id, obj.url, status) for index, obj, status in statuses]
+        db.commit()
+    except SQLAlchemyError as e:
+        db.rollback()
+        logger.error(f"Batch chunk failed: {str(e)}\n{traceback.format_exc()}")
+        rows = [(index, None, c.url, 'error') for index, c in chunk]
+
+    for index, url_id, url, status in rows:
+        results.append({'index': index, 'url': url, 'status': status, 'id': url_id})
+
+
+@app.route('/extension/urls/batch', methods=['POST'])
+def create_urls_batch():
+    """批量导入URL（如浏览器历史、书签导出），按块在单个事务中upsert"""
+    items = _read_batch_items()
+    if items is None:
+        return jsonify({'error': 'urls array is required'}), 400
+
+    db = next(get_db())
+    try:
+        results = []
+        chunk = []
+        for index, item in enumerate(items):
+            candidate = _build_batch_url(item)
+            if candidate is None:
+                results.append({'index': index, 'url': None, 'status': 'invalid', 'id': None})
+                continue
+            chunk.append((index, candidate))
+            if len(chunk) >= BATCH_CHUNK_SIZE:
+                _upsert_batch_chunk(db, chunk, results)
+                chunk = []
+        if chunk:
+            _upsert_batch_chunk(db, chunk, results)
+
+        _notify_urls_written()
+        results.sort(key=lambda r: r['index'])
+        summary = {status: 0 for status in ('inserted', 'updated', 'duplicate', 'invalid', 'error')}
+        for r in results:
+            summary[r['status']] += 1
+        logger.info(f"Batch import finished: {summary}")
+        return jsonify({**summary, 'results': results})
+    except Exception as e:
+        error_msg = f"Unexpected error: {str(e)}\n{traceback.format_exc()}"
+        logger.error(error_msg)
+        return jsonify({'error': 'Internal server error'}), 500
+    finally:
+        db.close()
+
 @app.route('/extension/urls', methods=['GET'])
 def get_urls():
+    """分页获取URL列表
+
+    参数：
+        limit  每页数量（默认URL_PAGE_SIZE，最大URL_PAGE_SIZE_MAX）
+        cursor 上一页返回的X-Next-Cursor响应头
+        order  desc（默认，最新在前）或asc
+        domain 按域名过滤
+        tag    按标签过滤
+        since/until 按创建时间过滤（ISO8601，左闭右开）
+    响应体仍为URL数组，下一页游标放在X-Next-Cursor响应头中
+    """
+    try:
+        limit = min(max(int(request.args.get('limit', URL_PAGE_SIZE)), 1), URL_PAGE_SIZE_MAX)
+        order = request.args.get('order', 'desc')
+        if order not in ('asc', 'desc'):
+            raise ValueError(f"invalid order: {order}")
+        cursor = request.args.get('cursor')
+        cursor = _decode_cursor(cursor) if cursor else None
+        since = request.args.get('since')
+        since = datetime.fromisoformat(since) if since else None
+        until = request.args.get('until')
+        until = datetime.fromisoformat(until) if until else None
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
     try:
         db = next(get_db())
-        urls = db.query(URL).order_by(desc(URL.created_at)).limit(10).all()
-        return jsonify([{
-            'id': url.id,
-            'url': url.url,
-            'title': url.title,
-            'domain': url.domain,
-            'path': url.path,
-            'query_params': url.query_params,
-            'tags': url.tags if hasattr(url, 'tags') else [],
-            'notes': url.notes if hasattr(url, 'notes') else '',
-            'created_at': url.created_at.isoformat(),
-            'updated_at': url.updated_at.isoformat()
-        } for url in urls])
+        q = db.query(URL)
+        tag = request.args.get('tag')
+        if tag:
+            # 按标签过滤时从url_tags的(tag, created_at, url_id)索引上做游标扫描
+            q = q.join(URLTag, URLTag.url_id == URL.id).filter(URLTag.tag == tag)
+            sort_created, sort_id = URLTag.created_at, URLTag.url_id
+        else:
+            sort_created, sort_id = URL.created_at, URL.id
+        domain = request.args.get('domain')
+        if domain:
+            q = q.filter(URL.domain == domain)
+        if since:
+            q = q.filter(sort_created >= since)
+        if until:
+            q = q.filter(sort_created < until)
+
+        direction = desc if order == 'desc' else asc
+        if cursor:
+            key = tuple_(sort_created, sort_id)
+            q = q.filter(key < cursor if order == 'desc' else key > cursor)
+        urls = q.order_by(direction(sort_created), direction(sort_id)).limit(limit + 1).all()
+
+        response = jsonify([_url_to_dict(url) for url in urls[:limit]])
+        if len(urls) > limit:
+            last = urls[limit - 1]
+            response.headers['X-Next-Cursor'] = _encode_cursor(last.created_at, last.id)
+        return response
     except SQLAlchemyError as e:
         error_msg = f"Database error: {str(e)}\n{traceback.format_exc()}"
         logger.error(error_msg)
@@ -150,6 +375,43 @@ def get_urls():
     finally:
         db.close()
 
+@app.route('/extension/urls/search', methods=['GET'])
+def search_urls():
+    """全文搜索已保存的URL：q为查询文本，在标题、备注、标签、域名中按BM25排序，limit/offset分页"""
+    query = (request.args.get('q') or '').strip()
+    if not query:
+        return jsonify({'error': 'q required'}), 400
+    try:
+        limit = min(max(int(request.args.get('limit', URL_PAGE_SIZE)), 1), URL_PAGE_SIZE_MAX)
+        offset = max(int(request.args.get('offset', 0)), 0)
+    except ValueError:
+        return jsonify({'error': 'invalid limit or offset'}), 400
+    if not fulltext_index.ready():
+        return jsonify({'error': 'Full-text search unavailable'}), 503
+
+    try:
+        db = next(get_db())
+        started = time.time()
+        hits = fulltext_index.search(db, query, limit, offset)
+        urls = {url.id: url for url in db.query(URL).filter(URL.id.in_([url_id for url_id, _ in hits])).all()}
+        results = []
+        for url_id, score in hits:
+            if url_id in urls:
+                item = _url_to_dict(urls[url_id])
+                item['score'] = round(-score, 4)
+                results.append(item)
+        return jsonify({
+            'query': query,
+            'results': results,
+            'took_ms': round((time.time() - started) * 1000, 2)
+        })
+    except SQLAlchemyError as e:
+        error_msg = f"Database error: {str(e)}\n{traceback.format_exc()}"
+        logger.error(error_msg)
+        return jsonify({'error': str(e)}), 500
+    finally:
+        db.close()
+
 @app.route('/extension/urls/<int:url_id>', methods=['GET'])
 def get_url(url_id):
     try:
@@ -158,18 +420,7 @@ def get_url(url_id):
         if not url:
             return jsonify({'error': 'URL not found'}), 404
         
-        return jsonify({
-            'id': url.id,
-            'url': url.url,
-            'title': url.title,
-            'domain': url.domain,
-            'path': url.path,
-            'query_params': url.query_params,
-            'tags': url.tags if hasattr(url, 'tags') else [],
-            'notes': url.notes if hasattr(url, 'notes') else '',
-            'created_at': url.created_at.isoformat(),
-            'updated_at': url.updated_at.isoformat()
-        })
+        return jsonify(_url_to_dict(url))
     except SQLAlchemyError as e:
         error_msg = f"Database error: {str(e)}\n{traceback.format_exc()}"
         logger.error(error_msg)
@@ -181,6 +432,151 @@ def get_url(url_id):
     finally:
         db.close()
 
+@app.route('/tasks/status', methods=['GET'])
+def get_task_status():
+    """查询URL的处理状态，处理中的任务返回内存中的最新状态和进度"""
+    url = request.args.get('url')
+    if not url:
+        return jsonify({'error': 'url required'}), 400
+    try:
+        task = task_states.get(url)
+    except SQLAlchemyError as e:
+        logger.error(f"Database error: {str(e)}\n{traceback.format_exc()}")
+        return jsonify({'error': str(e)}), 500
+    if task is None:
+        return jsonify({'error': 'Task not found'}), 404
+    return jsonify(task)
+
+@app.route('/tasks/active', methods=['GET'])
+def get_active_tasks():
+    """本进程正在处理的任务"""
+    return jsonify({'tasks': task_states.active()})
+
+@app.route('/tasks/domains', methods=['GET'])
+def get_domain_budgets():
+    """各域名的限速和退避状态"""
+    return jsonify({'domains': domain_scheduler.status()})
+
+# --- 字幕搜索接口 ---
+
+def _get_vector_store():
+    """首次调用时加载向量库（依赖chromadb），之后复用同一个实例"""
+    from server.vector_store import vector_store
+    return vector_store
+
+def _warm_search():
+    """后台预先加载向量库和向量模型，第一次搜索无需等待"""
+    try:
+        _get_vector_store()
+        from server.embedding import embedding_engine
+        embedding_engine.warmup()
+        logger.info("Search service warmed up")
+    except Exception as e:
+        logger.warning(f"Search warmup failed: {str(e)}")
+
+def _search_paging(args):
+    """解析分页参数，返回(limit, offset)，格式错误时抛出ValueError"""
+    limit = min(max(int(args.get('limit', args.get('n', 5))), 1), SEARCH_RESULTS_MAX)
+    offset = min(max(int(args.get('offset', 0)), 0), SEARCH_RESULTS_MAX)
+    return limit, offset
+
+@app.route('/search', methods=['GET'])
+def search_subtitles():
+    """搜索字幕：q为查询文本，n（或limit）/offset分页，url、video_id、domain过滤"""
+    query = (request.args.get('q') or '').strip()
+    if not query:
+        return jsonify({'error': 'q required'}), 400
+    try:
+        n_results, offset = _search_paging(request.args)
+    except ValueError:
+        return jsonify({'error': 'invalid n'}), 400
+    try:
+        store = _get_vector_store()
+    except ImportError as e:
+        return jsonify({'error': f'Search unavailable: {str(e)}'}), 503
+    from server.vector_store import build_where, SEARCH_FILTER_FIELDS
+    where = build_where({
+        field: request.args.get(field) for field in SEARCH_FILTER_FIELDS if request.args.get(field)
+    })
+    started = time.time()
+    try:
+        results = store.search(query, n_results, where, offset)
+    except Exception as e:
+        logger.error(f"Search failed: {str(e)}\n{traceback.format_exc()}")
+        return jsonify({'error': f'Search failed: {str(e)}'}), 500
+    return jsonify({
+        'query': query,
+        'results': results,
+        'took_ms': round((time.time() - started) * 1000, 2)
+    })
+
+@app.route('/search/batch', methods=['POST'])
+def search_subtitles_batch():
+    """批量搜索字幕：{"queries": [...], "limit": 5, "offset": 0, "where": {"url": ...}}，
+    所有查询的向量一次计算、在向量库中一次查询，results与queries一一对应"""
+    data = request.get_json(silent=True) or {}
+    queries = data.get('queries')
+    if not isinstance(queries, list) or not queries or \
+            not all(isinstance(query, str) and query.strip() for query in queries):
+        return jsonify({'error': 'queries required'}), 400
+    if len(queries) > SEARCH_BATCH_MAX:
+        return jsonify({'error': f'at most {SEARCH_BATCH_MAX} queries per batch'}), 400
+    try:
+        limit, offset = _search_paging(data)
+    except (ValueError, TypeError):
+        return jsonify({'error': 'invalid limit or offset'}), 400
+    try:
+        store = _get_vector_store()
+    except ImportError as e:
+        return jsonify({'error': f'Search unavailable: {str(e)}'}), 503
+    from server.vector_store import build_where
+    filters = data.get('where') or {}
+    if not isinstance(filters, dict):
+        return jsonify({'error': 'where must be an object'}), 400
+    try:
+        where = build_where(filters)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    started = time.time()
+    try:
+        results = store.search_batch([query.strip() for query in queries], limit, where, offset)
+    except Exception as e:
+        logger.error(f"Batch search failed: {str(e)}\n{traceback.format_exc()}")
+        return jsonify({'error': f'Search failed: {str(e)}'}), 500
+    return jsonify({
+        'results': [{'query': query, 'results': hits} for query, hits in zip(queries, results)],
+        'took_ms': round((time.time() - started) * 1000, 2)
+    })
+
+@app.route('/search/hybrid', methods=['GET'])
+def search_hybrid():
+    """混合搜索：同时检索已保存URL（全文索引）和字幕（向量库），按URL倒数排名融合，
+    q为查询文本，limit/offset分页，timings给出各路检索的耗时，某一路不可用时在errors中说明"""
+    query = (request.args.get('q') or '').strip()
+    if not query:
+        return jsonify({'error': 'q required'}), 400
+    try:
+        limit, offset = _search_paging(request.args)
+    except ValueError:
+        return jsonify({'error': 'invalid limit or offset'}), 400
+
+    try:
+        db = next(get_db())
+        results, timings, errors = hybrid_searcher.search(db, query, limit, offset)
+        return jsonify({
+            'query': query,
+            'results': [dict(item, record=_url_to_dict(item['record']) if item['record'] else None)
+                        for item in results],
+            'timings': timings,
+            'errors': errors
+        })
+    except SQLAlchemyError as e:
+        error_msg = f"Database error: {str(e)}\n{traceback.format_exc()}"
+        logger.error(error_msg)
+        return jsonify({'error': str(e)}), 500
+    finally:
+        db.close()
+
 # 全局错误处理器
 @app.errorhandler(Exception)
 def handle_error(error):
@@ -192,153 +588,245 @@ def handle_error(error):
 
 @app.route('/sync/url/push', methods=['POST'])
 def sync_url_push():
-    """主节点：接收从节点推送的url数据（支持批量）"""
+    """主节点：接收从节点推送的url数据（支持批量），X-Sync-Peer头标识来源节点"""
     if ROLE != 'master':
         return jsonify({'error': 'Not master'}), 403
-    data = request.get_json()
-    if not data or 'urls' not in data:
-        return jsonify({'error': 'urls required'}), 400
-    urls = data['urls']
+    return _apply_sync_request(request.headers.get('X-Sync-Peer') or 'slave', on_commit=_notify_urls_written)
+
+@app.route('/sync/url/replicate', methods=['POST'])
+def sync_url_replicate():
+    """从节点：接收主节点复制过来的url数据"""
+    if ROLE != 'slave':
+        return jsonify({'error': 'Not slave'}), 403
+    return _apply_sync_request('master', on_commit=url_queue.notify)
+
+@app.route('/sync/status', methods=['GET'])
+def sync_status():
+    """同步状态：本节点的变更序列号，主节点附带各从节点的复制延迟"""
     db = next(get_db())
-    count = 0
-    for u in urls:
-        # 以url字段为唯一键，存在则更新，不存在则插入
-        obj = db.query(URL).filter(URL.url == u['url']).first()
-        if obj:
-            # 只更新比本地新的数据
-            if 'updated_at' in u and u['updated_at'] > obj.updated_at.isoformat():
-                for k, v in u.items():
-                    if hasattr(obj, k):
-                        setattr(obj, k, v)
-                obj.updated_at = datetime.fromisoformat(u['updated_at'])
-                count += 1
+    try:
+        status = {'role': ROLE, 'node': NODE_NAME, 'seq': current_seq(db)}
+        if ROLE == 'master':
+            status['slaves'] = replicator.status()
         else:
-            # 新增
-            u_copy = dict(u)
-            created_at_str = u_copy.pop('created_at', None)
-            updated_at_str = u_copy.pop('updated_at', None)
-            new_url = URL(**u_copy)
-            if 'created_at' in u:
-                new_url.created_at = datetime.fromisoformat(u['created_at'])
-            if 'updated_at' in u:
-                new_url.updated_at = datetime.fromisoformat(u['updated_at'])
-            db.add(new_url)
-            count += 1
+            status['acked_by_master'] = get_peer_seq(db, 'master')
+        return jsonify(status)
+    finally:
+        db.close()
+
+def _apply_sync_request(origin, on_commit=None):
+    """解码请求中的同步数据并写入，origin记录为变更来源，写入成功提交后调用on_commit"""
+    content_type = request.mimetype or JSON_CONTENT_TYPE
+    encoding = request.headers.get('Content-Encoding')
+    if content_type not in supported_content_types() or \
+            encoding not in supported_encodings() + [None, 'identity']:
+        return jsonify({
+            'error': 'Unsupported sync format',
+            'accept': supported_content_types(),
+            'accept_encoding': supported_encodings()
+        }), 415
     try:
+        urls, _ = decode_sync_body(request.get_data(), content_type, encoding)
+    except (ValueError, KeyError, TypeError, zlib.error):
+        urls = None
+    if not isinstance(urls, list):
+        return jsonify({'error': 'urls required'}), 400
+    db = next(get_db())
+    # 记录变更来源，向该节点复制时跳过这些变更
+    db.info['sync_origin'] = origin
+    try:
+        count, invalid = apply_sync_urls(db, urls)
         db.commit()
-    except Exception as err:
-        print('push error: ', err, urls)
-    db.close()
-    return jsonify({'status': 'ok', 'updated': count})
+        if on_commit:
+            on_commit()
+    except SQLAlchemyError as e:
+        db.rollback()
+        error_msg = f"Sync push failed: {str(e)}\n{traceback.format_exc()}"
+        logger.error(error_msg)
+        return jsonify({'error': str(e)}), 500
+    finally:
+        db.close()
+    return jsonify({'status': 'ok', 'updated': count, 'invalid': invalid})
 
 @app.route('/sync/url/pull', methods=['GET'])
 def sync_url_pull():
-    """主节点：提供增量url数据，参数since=ISO8601时间字符串"""
+    """主节点：提供增量url数据，按(updated_at, id)升序返回
+
+    参数：
+        since_seq 按变更序列号增量拉取，返回结尾的last_seq作为下一次的since_seq，
+                  more为true时表示还有数据；同时携带peer时记录该节点已确认的序列号
+        since  ISO8601时间字符串，只返回之后更新的数据
+        cursor 上一页返回的next_cursor，优先于since
+        limit  每页数量（最大SYNC_PULL_PAGE_SIZE_MAX），不传则返回全部
+        format=ndjson（或Accept: application/x-ndjson）时逐行流式返回，
+               最后一行为{"next_cursor": ...}；不能与since_seq同时使用
+    非NDJSON模式按Accept协商列式JSON/msgpack格式，按Accept-Encoding协商gzip/zstd压缩
+    所有模式都通过yield_per流式读取，内存占用与落后的数据量无关
+    """
     if ROLE != 'master':
         return jsonify({'error': 'Not master'}), 403
-    since = request.args.get('since')
+    try:
+        since = request.args.get('since')
+        since = datetime.fromisoformat(since) if since else None
+        cursor = request.args.get('cursor')
+        cursor = _decode_cursor(cursor) if cursor else None
+        limit = request.args.get('limit')
+        limit = min(max(int(limit), 1), SYNC_PULL_PAGE_SIZE_MAX) if limit else None
+        since_seq = request.args.get('since_seq')
+        since_seq = int(since_seq) if since_seq is not None else None
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    ndjson = request.args.get('format') == 'ndjson' or \
+        request.accept_mimetypes.best == 'application/x-ndjson'
+    # JSON排在首位，未显式声明其他格式的旧客户端仍得到JSON
+    content_type = request.accept_mimetypes.best_match(
+        [JSON_CONTENT_TYPE] + [t for t in supported_content_types() if t != JSON_CONTENT_TYPE],
+        default=JSON_CONTENT_TYPE
+    )
+    encoder = SyncEncoder(content_type, request.accept_encodings.best_match(supported_encodings()))
+
+    if since_seq is not None:
+        if ndjson:
+            return jsonify({'error': 'since_seq does not support format=ndjson'}), 400
+        return _sync_pull_changes(since_seq, limit or SYNC_BATCH_SIZE, encoder)
+
     db = next(get_db())
     q = db.query(URL)
-    if since:
+    if cursor:
+        q = q.filter(tuple_(URL.updated_at, URL.id) > cursor)
+    elif since:
+        q = q.filter(URL.updated_at > since)
+    q = q.order_by(URL.updated_at, URL.id)
+    if limit:
+        q = q.limit(limit)
+
+    def generate():
         try:
-            since_dt = datetime.fromisoformat(since)
-            q = q.filter(URL.updated_at > since_dt)
-        except Exception:
+            count = 0
+            last = None
+            if not ndjson:
+                yield encoder.begin()
+            for u in q.yield_per(SYNC_PULL_YIELD_SIZE):
+                record = url_to_sync_dict(u)
+                if ndjson:
+                    yield json.dumps(record, ensure_ascii=False) + '\n'
+                else:
+                    yield encoder.row(record)
+                count += 1
+                last = (u.updated_at, u.id)
+            # 本页已满时返回续传游标，否则说明已追平
+            next_cursor = _encode_cursor(*last) if limit and count == limit else None
+            if ndjson:
+                yield json.dumps({'next_cursor': next_cursor}) + '\n'
+            else:
+                yield encoder.end(next_cursor)
+        finally:
             db.close()
-            return jsonify({'error': 'invalid since'}), 400
-    urls = q.all()
-    result = []
-    for u in urls:
-        result.append({
-            'url': u.url,
-            'title': u.title,
-            'domain': u.domain,
-            'path': u.path,
-            'query_params': u.query_params,
-            'tags': u.tags,
-            'notes': u.notes,
-            'created_at': u.created_at.isoformat() if u.created_at else None,
-            'updated_at': u.updated_at.isoformat() if u.updated_at else None
-        })
-    db.close()
-    return jsonify({'urls': result})
+
+    if ndjson:
+        return Response(generate(), mimetype='application/x-ndjson')
+    return _sync_response(generate(), encoder)
+
+def _sync_response(body_iter, encoder):
+    """构造同步数据响应"""
+    response = Response(body_iter, content_type=encoder.content_type)
+    if encoder.encoding:
+        response.headers['Content-Encoding'] = encoder.encoding
+    response.headers['Vary'] = 'Accept, Accept-Encoding'
+    return response
+
+def _sync_pull_changes(since_seq, limit, encoder):
+    """按变更序列号返回一批URL，并记录拉取方已确认的序列号"""
+    peer = request.args.get('peer')
+    db = next(get_db())
+    try:
+        rows, next_seq = changed_urls_since(db, since_seq, limit, exclude_origin=peer)
+        if peer:
+            # 对端请求since_seq之后的数据，说明since_seq及之前的变更已应用
+            set_peer_seq(db, peer, since_seq)
+            db.commit()
+        body = encoder.encode(
+            [url_to_sync_dict(u) for _, u in rows],
+            last_seq=next_seq,
+            more=len(rows) >= limit
+        )
+    finally:
+        db.close()
+    return _sync_response(body, encoder)
 
 # --- 从节点定时同步任务 ---
-def slave_sync_loop():
-    last_sync = None
+def _push_to_master(push_data):
+    """以配置的压缩格式推送数据到主节点"""
+    return post_sync_urls(
+        requests, f'http://{MASTER_HOST}:{MASTER_PORT}/sync/url/push', push_data, peer=NODE_NAME
+    )
+
+def _push_changes_to_master():
+    """按变更序列号把本地变更推送到主节点，主节点确认成功后才推进已确认序列号"""
+    db = next(get_db())
     try:
-        with open('./last_sync', 'r') as fr:
-            line = fr.read()
-            logger.info('[debug] last sync: %s', line)
-        last_sync = datetime.fromisoformat(line)
-    except:
-        last_sync = None
-    print('ready to sync for ', last_sync)
+        while True:
+            acked_seq = get_peer_seq(db, 'master')
+            # 从主节点复制来的变更不回传
+            rows, next_seq = changed_urls_since(db, acked_seq, SYNC_BATCH_SIZE, exclude_origin='master')
+            if rows:
+                result = _push_to_master([url_to_sync_dict(u) for _, u in rows])
+                logger.info(f'pushed {len(rows)} urls to master (seq {acked_seq} -> {next_seq}): {result}')
+            if next_seq > acked_seq:
+                set_peer_seq(db, 'master', next_seq)
+                compact_changes(db)
+                db.commit()
+            if len(rows) < SYNC_BATCH_SIZE:
+                return
+    finally:
+        db.close()
 
+def slave_sync_loop():
+    logger.info(f'slave sync started as {NODE_NAME}')
     while True:
         try:
-            db = next(get_db())
-            q = db.query(URL)
-            if last_sync:
-                try:
-                    since_dt = datetime.fromisoformat(last_sync)
-                    q = q.filter(URL.updated_at > since_dt)
-                except Exception:
-                    pass
-            urls = q.all()
-            last_sync = datetime.utcnow().isoformat()
-
-            push_data = []
-            for u in urls:
-                push_data.append({
-                    'url': u.url,
-                    'title': u.title,
-                    'domain': u.domain,
-                    'path': u.path,
-                    'query_params': u.query_params,
-                    'tags': u.tags,
-                    'notes': u.notes,
-                    'created_at': u.created_at.isoformat() if u.created_at else None,
-                    'updated_at': u.updated_at.isoformat() if u.updated_at else None
-                })
-            if push_data:
-                try:
-                    requests.post(f'http://{MASTER_HOST}:{MASTER_PORT}/sync/url/push', json={'urls': push_data}, timeout=5)
-                except Exception as e:
-                    logger.error(f'push data to master failed: {str(e)}')
-                    pass
-            db.close()
-            with open('./last_sync', 'w') as fw:
-                fw.write(str(last_sync))
+            _push_changes_to_master()
         except Exception as e:
             logger.error(f'sync failed: {str(e)}')
-        logger.info(f'sync done at {last_sync}')
-        time.sleep(30)  # 每30秒同步一次
+        time.sleep(SYNC_INTERVAL)
 
 if __name__ == '__main__':
     # 初始化数据库
     try:
         Base.metadata.create_all(bind=engine)
+        # 全文索引：建表，并在索引与urls表不一致时（如迁移新建的空表）回填
+        fulltext_index.ensure()
         logger.info("Database initialized successfully")
     except Exception as e:
         error_msg = f"Failed to initialize database: {str(e)}\n{traceback.format_exc()}"
         logger.error(error_msg)
         raise
 
-    # 启动URL队列处理器
-    #url_queue.start()
-    #logger.info("URL queue processor started")
-
-    # 启动URL处理工作线程
-    #url_worker.start()
-    #logger.info("URL worker started")
+    # 启动URL队列处理器和处理工作线程，写入URL后的通知可以立即唤醒它们
+    if RUN_WORKER:
+        url_queue.start()
+        url_worker.start()
 
     # 启动从节点同步任务
     if ROLE == 'slave':
         t = threading.Thread(target=slave_sync_loop, daemon=True)
         t.start() 
 
+    # 预热搜索服务
+    if SEARCH_WARMUP:
+        threading.Thread(target=_warm_search, daemon=True).start()
+
+    # 启动主节点向从节点的复制调度
+    if ROLE == 'master':
+        replicator.start()
+
     # 启动服务器
     print("starting server on %s:%d" % (HOST, PORT))
-    app.run(host=HOST, debug=False, port=PORT)
+    try:
+        app.run(host=HOST, debug=False, port=PORT)
+    finally:
+        # 服务退出时等待在途任务完成，并写入剩余的任务状态
+        if RUN_WORKER:
+            url_worker.stop()
+            url_queue.stop()
 
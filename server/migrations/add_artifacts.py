@@ -0,0 +1,34 @@
+"""add artifacts
+
+Revision ID: add_artifacts
+Revises: add_task_progress
+Create Date: 2026-10-18
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'add_artifacts'
+down_revision = 'add_task_progress'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    # 处理产物缓存索引
+    op.create_table(
+        'artifacts',
+        sa.Column('media_id', sa.String(), primary_key=True),
+        sa.Column('kind', sa.String(), primary_key=True),
+        sa.Column('path', sa.String(), nullable=False),
+        sa.Column('size', sa.BigInteger(), nullable=False, server_default='0'),
+        sa.Column('checksum', sa.String(), nullable=True),
+        sa.Column('ref_count', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('last_used_at', sa.DateTime(), nullable=True),
+    )
+    op.create_index('ix_artifacts_last_used_at', 'artifacts', ['last_used_at'])
+
+def downgrade():
+    op.drop_index('ix_artifacts_last_used_at', table_name='artifacts')
+    op.drop_table('artifacts')
@@ -0,0 +1,46 @@
+"""add change log and sync peers
+
+Revision ID: add_change_log
+Revises: add_urls_updated_at_index
+Create Date: 2026-10-18
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'add_change_log'
+down_revision = 'add_urls_updated_at_index'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    # URL变更日志，id为单调递增的序列号
+    op.create_table(
+        'changes',
+        sa.Column('id', sa.Integer(), primary_key=True, autoincrement=True),
+        sa.Column('url_id', sa.Integer(), nullable=False),
+        sa.Column('origin', sa.String(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sqlite_autoincrement=True,
+    )
+    op.create_index('ix_changes_url_id', 'changes', ['url_id'])
+
+    # 各同步对端已确认的序列号
+    op.create_table(
+        'sync_peers',
+        sa.Column('peer', sa.String(), primary_key=True),
+        sa.Column('acked_seq', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+    )
+
+    # 为已有URL按更新时间顺序生成一条变更，对端从0开始即可完整同步
+    op.execute(
+        "INSERT INTO changes (url_id, created_at) "
+        "SELECT id, CURRENT_TIMESTAMP FROM urls ORDER BY updated_at, id"
+    )
+
+def downgrade():
+    op.drop_table('sync_peers')
+    op.drop_index('ix_changes_url_id', table_name='changes')
+    op.drop_table('changes')
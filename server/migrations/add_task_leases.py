@@ -0,0 +1,28 @@
+"""add task leases
+
+Revision ID: add_task_leases
+Revises: add_change_log
+Create Date: 2026-10-18
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'add_task_leases'
+down_revision = 'add_change_log'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    # 任务租约字段
+    op.add_column('tasks', sa.Column('lease_owner', sa.String(), nullable=True))
+    op.add_column('tasks', sa.Column('lease_expires_at', sa.DateTime(), nullable=True))
+    op.add_column('tasks', sa.Column('heartbeat_at', sa.DateTime(), nullable=True))
+    op.create_index('ix_tasks_status_lease_expires_at', 'tasks', ['status', 'lease_expires_at'])
+
+def downgrade():
+    op.drop_index('ix_tasks_status_lease_expires_at', table_name='tasks')
+    op.drop_column('tasks', 'heartbeat_at')
+    op.drop_column('tasks', 'lease_expires_at')
+    op.drop_column('tasks', 'lease_owner')
@@ -0,0 +1,22 @@
+"""add task progress
+
+Revision ID: add_task_progress
+Revises: add_task_leases
+Create Date: 2026-10-18
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'add_task_progress'
+down_revision = 'add_task_leases'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    # 处理阶段的实时进度
+    op.add_column('tasks', sa.Column('progress', sa.JSON(), nullable=True))
+
+def downgrade():
+    op.drop_column('tasks', 'progress')
@@ -0,0 +1,48 @@
+"""add url list indexes and url_tags
+
+Revision ID: add_url_list_indexes
+Revises: add_retry_count
+Create Date: 2026-10-18
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from datetime import datetime
+
+# revision identifiers, used by Alembic.
+revision = 'add_url_list_indexes'
+down_revision = 'add_retry_count'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    # 列表分页使用的复合索引
+    op.create_index('ix_urls_created_at_id', 'urls', ['created_at', 'id'])
+    op.create_index('ix_urls_domain_created_at_id', 'urls', ['domain', 'created_at', 'id'])
+
+    # 标签索引表
+    op.create_table(
+        'url_tags',
+        sa.Column('url_id', sa.Integer(), sa.ForeignKey('urls.id', ondelete='CASCADE'), primary_key=True),
+        sa.Column('tag', sa.String(), primary_key=True),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+    )
+    op.create_index('ix_url_tags_tag_created_at_url_id', 'url_tags', ['tag', 'created_at', 'url_id'])
+
+    # 回填已有URL的标签
+    bind = op.get_bind()
+    urls = sa.table('urls', sa.column('id'), sa.column('tags', sa.JSON()), sa.column('created_at', sa.DateTime()))
+    url_tags = sa.table('url_tags', sa.column('url_id'), sa.column('tag'), sa.column('created_at', sa.DateTime()))
+    rows = []
+    for url_id, tags, created_at in bind.execute(sa.select(urls.c.id, urls.c.tags, urls.c.created_at)):
+        for tag in set(tags or []):
+            if tag:
+                rows.append({'url_id': url_id, 'tag': str(tag), 'created_at': created_at or datetime.utcnow()})
+    if rows:
+        op.bulk_insert(url_tags, rows)
+
+def downgrade():
+    op.drop_index('ix_url_tags_tag_created_at_url_id', table_name='url_tags')
+    op.drop_table('url_tags')
+    op.drop_index('ix_urls_domain_created_at_id', table_name='urls')
+    op.drop_index('ix_urls_created_at_id', table_name='urls')
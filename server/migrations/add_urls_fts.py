@@ -0,0 +1,30 @@
+"""add urls full-text index
+
+Revision ID: add_urls_fts
+Revises: add_artifacts
+Create Date: 2026-10-18
+
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = 'add_urls_fts'
+down_revision = 'add_artifacts'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    # URL全文索引（SQLite FTS5），rowid即urls.id，内容为jieba分词后的文本。
+    # 这里只建空表，分词依赖jieba，已有数据由服务启动时的fulltext_index.ensure()
+    # 发现索引文档数与urls表行数不一致后回填
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    op.execute(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS urls_fts "
+        "USING fts5(title, notes, tags, domain, tokenize='unicode61')"
+    )
+
+def downgrade():
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    op.execute("DROP TABLE IF EXISTS urls_fts")
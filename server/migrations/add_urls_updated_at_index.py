@@ -0,0 +1,21 @@
+"""add urls updated_at index
+
+Revision ID: add_urls_updated_at_index
+Revises: add_url_list_indexes
+Create Date: 2026-10-18
+
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = 'add_urls_updated_at_index'
+down_revision = 'add_url_list_indexes'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    # 增量同步按(updated_at, id)顺序扫描
+    op.create_index('ix_urls_updated_at_id', 'urls', ['updated_at', 'id'])
+
+def downgrade():
+    op.drop_index('ix_urls_updated_at_id', table_name='urls')
@@ -1,5 +1,6 @@
-from sqlalchemy import Column, Integer, String, JSON, Text, DateTime, ARRAY, UniqueConstraint, Boolean, Enum
+from sqlalchemy import Column, Integer, BigInteger, String, JSON, Text, DateTime, ARRAY, UniqueConstraint, Boolean, Enum, Index, ForeignKey, event, inspect
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import object_session
 from datetime import datetime
 from urllib.parse import urlparse, parse_qs, urlunparse
 import enum
@@ -23,6 +24,11 @@ class URL(Base):
     __tablename__ = 'urls'
     __table_args__ = (
         UniqueConstraint('url', name='uix_url'),
+        # 列表接口按(created_at, id)做游标分页
+        Index('ix_urls_created_at_id', 'created_at', 'id'),
+        Index('ix_urls_domain_created_at_id', 'domain', 'created_at', 'id'),
+        # 增量同步按(updated_at, id)顺序扫描
+        Index('ix_urls_updated_at_id', 'updated_at', 'id'),
     )
 
     id = Column(Integer, primary_key=True)
@@ -47,32 +53,115 @@ class URL(Base):
 
     def _parse_url(self, original_url):
         """Parse the URL and set domain, path, and query parameters."""
-        parsed = urlparse(original_url)
-        
-        # Set domain
-        self.domain = parsed.netloc
-        
-        # Set path
-        self.path = parsed.path or '/'
-        
-        # Parse and set query parameters
-        self.query_params = parse_qs(parsed.query) if parsed.query else {}
-        
-        # Store URL without query parameters
-        clean_url = urlunparse((
-            parsed.scheme,
-            parsed.netloc,
-            parsed.path,
-            '',  # params
-            '',  # query
-            ''   # fragment
-        ))
-        self.url = clean_url
+        self.url, self.domain, self.path, self.query_params = split_url(original_url)
+
+
+def split_url(original_url):
+    """Split a URL into (url without query, domain, path, query parameters)."""
+    parsed = urlparse(original_url)
+
+    # Store URL without query parameters
+    clean_url = urlunparse((
+        parsed.scheme,
+        parsed.netloc,
+        parsed.path,
+        '',  # params
+        '',  # query
+        ''   # fragment
+    ))
+    query_params = parse_qs(parsed.query) if parsed.query else {}
+    return clean_url, parsed.netloc, parsed.path or '/', query_params
+
+
+class URLTag(Base):
+    """URL标签索引表，冗余created_at以便按标签过滤时也能走游标分页索引"""
+    __tablename__ = 'url_tags'
+    __table_args__ = (
+        Index('ix_url_tags_tag_created_at_url_id', 'tag', 'created_at', 'url_id'),
+    )
+
+    url_id = Column(Integer, ForeignKey('urls.id', ondelete='CASCADE'), primary_key=True)
+    tag = Column(String, primary_key=True)
+    created_at = Column(DateTime, nullable=False)
+
+
+def _write_url_tags(connection, target, replace=True):
+    """写入某个URL在url_tags中的标签行，replace为True时先删除旧行"""
+    table = URLTag.__table__
+    if replace:
+        connection.execute(table.delete().where(table.c.url_id == target.id))
+    tags = {str(tag) for tag in (target.tags or []) if tag}
+    if tags:
+        connection.execute(table.insert(), [
+            {'url_id': target.id, 'tag': tag, 'created_at': target.created_at or datetime.utcnow()}
+            for tag in tags
+        ])
+
+
+@event.listens_for(URL, 'after_insert')
+def _url_tags_after_insert(mapper, connection, target):
+    _write_url_tags(connection, target, replace=False)
+
+
+@event.listens_for(URL, 'after_update')
+def _url_tags_after_update(mapper, connection, target):
+    state = inspect(target)
+    if state.attrs.tags.history.has_changes() or state.attrs.created_at.history.has_changes():
+        _write_url_tags(connection, target)
+
+
+class Change(Base):
+    """URL变更日志，id即单调递增的变更序列号，每次插入或更新URL时追加一行"""
+    __tablename__ = 'changes'
+    __table_args__ = (
+        Index('ix_changes_url_id', 'url_id'),
+        {'sqlite_autoincrement': True},  # 保证序列号不会被复用
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    url_id = Column(Integer, nullable=False)
+    origin = Column(String, nullable=True)  # 通过同步写入时记录来源节点，本地写入为空
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+
+class SyncPeer(Base):
+    """同步对端已确认的变更序列号"""
+    __tablename__ = 'sync_peers'
+
+    peer = Column(String, primary_key=True)
+    acked_seq = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+def _append_change(connection, target):
+    """追加一条变更记录，来源节点取自session.info['sync_origin']"""
+    session = object_session(target)
+    origin = session.info.get('sync_origin') if session is not None else None
+    connection.execute(Change.__table__.insert().values(
+        url_id=target.id,
+        origin=origin,
+        created_at=datetime.utcnow()
+    ))
+
+
+@event.listens_for(URL, 'after_insert')
+def _changes_after_insert(mapper, connection, target):
+    _append_change(connection, target)
+
+
+@event.listens_for(URL, 'after_update')
+def _changes_after_update(mapper, connection, target):
+    state = inspect(target)
+    if any(attr.history.has_changes() for attr in state.attrs):
+        _append_change(connection, target)
+
 
 class Task(Base):
     __tablename__ = 'tasks'
     __table_args__ = (
         UniqueConstraint('url', name='uix_task_url'),
+        # 领取任务和回收过期租约按(status, lease_expires_at)扫描
+        Index('ix_tasks_status_lease_expires_at', 'status', 'lease_expires_at'),
     )
 
     id = Column(Integer, primary_key=True)
@@ -86,6 +175,10 @@ class Task(Base):
     completed_at = Column(DateTime, nullable=True)
     retry_count = Column(Integer, default=0)  # 失败重试次数
     current_stage = Column(Enum(ProcessingStage), default=ProcessingStage.INIT)  # 当前处理阶段
+    lease_owner = Column(String, nullable=True)  # 持有租约的工作进程
+    lease_expires_at = Column(DateTime, nullable=True)  # 租约到期时间，到期未续约视为进程已崩溃
+    heartbeat_at = Column(DateTime, nullable=True)  # 最近一次续约时间
+    progress = Column(JSON, nullable=True)  # 当前阶段的实时进度，如已下载字节数、百分比、速度
 
     def __init__(self, url, **kwargs):
         super().__init__(**kwargs)
@@ -102,4 +195,21 @@ class Task(Base):
 
     def can_retry(self, max_retries):
         """检查是否可以重试"""
-        return max_retries == -1 or self.retry_count < max_retries 
\ No newline at end of file
+        return max_retries == -1 or self.retry_count < max_retries 
+
+class Artifact(Base):
+    """处理产物缓存索引：每个(媒体ID, 产物类型)对应缓存目录中的一个文件"""
+    __tablename__ = 'artifacts'
+    __table_args__ = (
+        # 按最近使用时间淘汰
+        Index('ix_artifacts_last_used_at', 'last_used_at'),
+    )
+
+    media_id = Column(String, primary_key=True)  # 规范化的媒体ID，如bilibili:BV1xx411c7mD:p1
+    kind = Column(String, primary_key=True)  # 产物类型：video、audio、subtitle
+    path = Column(String, nullable=False)
+    size = Column(BigInteger, nullable=False, default=0)
+    checksum = Column(String, nullable=True)  # 文件内容的sha256
+    ref_count = Column(Integer, nullable=False, default=0)  # 正在使用该产物的处理链数量，大于0时不会被淘汰
+    created_at = Column(DateTime, default=datetime.utcnow)
+    last_used_at = Column(DateTime, default=datetime.utcnow)
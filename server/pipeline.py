@@ -0,0 +1,73 @@
+import queue
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+# 通知阶段线程退出的哨兵
+_STOP = object()
+
+
+class StagePipeline:
+    """按处理链分阶段并行执行：每个阶段有自己的线程和有界输入队列，
+    URL A转码时URL B可以同时下载，整体吞吐接近最慢的那个阶段"""
+
+    def __init__(self, name, chain, run_stage, finish, concurrency=None, queue_size=2):
+        """
+        run_stage(processor, job) -> bool 执行一个阶段
+        finish(job, success) 处理链结束（成功或在某个阶段失败）时调用
+        concurrency 每个阶段的线程数，与chain一一对应
+        """
+        self.name = name
+        self.chain = list(chain)
+        self.run_stage = run_stage
+        self.finish = finish
+        self.concurrency = [max(n, 1) for n in (concurrency or [1] * len(self.chain))]
+        # 队列有界：下游阶段处理不过来时上游阻塞，避免中间产物无限堆积
+        self.queues = [queue.Queue(maxsize=max(queue_size, 1)) for _ in self.chain]
+        self.threads = [[] for _ in self.chain]
+
+    def start(self):
+        """启动各阶段的工作线程"""
+        for index, processor in enumerate(self.chain):
+            for i in range(self.concurrency[index]):
+                thread = threading.Thread(
+                    target=self._stage_loop, args=(index,), name=f"{self.name}-{processor}-{i}"
+                )
+                thread.daemon = True
+                thread.start()
+                self.threads[index].append(thread)
+        logger.info(f"Pipeline {self.name} started: {dict(zip(self.chain, self.concurrency))}")
+
+    def submit(self, job):
+        """放入第一个阶段，队列已满时阻塞"""
+        self.queues[0].put(job)
+
+    def stop(self):
+        """按阶段顺序依次停止：先让上游处理完已接收的任务并交给下游，再停止下游"""
+        for index, threads in enumerate(self.threads):
+            for _ in threads:
+                self.queues[index].put(_STOP)
+            for thread in threads:
+                thread.join()
+        logger.info(f"Pipeline {self.name} stopped")
+
+    def _stage_loop(self, index):
+        processor = self.chain[index]
+        while True:
+            job = self.queues[index].get()
+            if job is _STOP:
+                return
+            try:
+                success = self.run_stage(processor, job)
+            except Exception as e:
+                logger.error(f"Error in pipeline stage {processor}: {str(e)}")
+                success = False
+
+            if success and index + 1 < len(self.chain):
+                self.queues[index + 1].put(job)
+                continue
+            try:
+                self.finish(job, success)
+            except Exception as e:
+                logger.error(f"Error finishing pipeline job: {str(e)}")
@@ -0,0 +1,215 @@
+import os
+import re
+import signal
+import subprocess
+import threading
+import queue
+import time
+import logging
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+try:
+    import resource
+except ImportError:  # Windows没有resource模块，资源限制不生效
+    resource = None
+
+# 读取子进程输出的块大小
+READ_CHUNK_SIZE = 4096
+# 终止子进程时SIGTERM之后等待的时间（秒），超时再SIGKILL
+KILL_GRACE_SECONDS = 5
+
+SIZE_UNITS = {
+    'B': 1, 'KB': 1000, 'MB': 1000 ** 2, 'GB': 1000 ** 3, 'TB': 1000 ** 4,
+    'KIB': 1024, 'MIB': 1024 ** 2, 'GIB': 1024 ** 3, 'TIB': 1024 ** 4,
+}
+
+
+def parse_size(text):
+    """把'12.5 MiB'、'1024kB'之类的大小转换为字节数"""
+    match = re.match(r'\s*([\d.]+)\s*([KMGT]?i?B)', text, re.IGNORECASE)
+    if not match:
+        return None
+    return int(float(match.group(1)) * SIZE_UNITS.get(match.group(2).upper(), 1))
+
+
+def parse_timestamp(text):
+    """把'01:02:03.45'转换为秒数"""
+    hours, minutes, seconds = text.split(':')
+    return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+
+class LuxProgressParser:
+    """解析lux的进度条，如' 12.34 MiB / 56.78 MiB [====>----]  21.73% 2.34 MiB/s 18s'"""
+
+    PATTERN = re.compile(
+        r'([\d.]+\s*[KMGT]?i?B)\s*/\s*([\d.]+\s*[KMGT]?i?B).*?([\d.]+)%(?:\s+([\d.]+\s*[KMGT]?i?B/s))?',
+        re.IGNORECASE
+    )
+
+    def __call__(self, line):
+        match = self.PATTERN.search(line)
+        if not match:
+            return None
+        progress = {
+            'bytes': parse_size(match.group(1)),
+            'total_bytes': parse_size(match.group(2)),
+            'percent': float(match.group(3)),
+        }
+        if match.group(4):
+            progress['speed'] = parse_size(match.group(4))  # 字节/秒
+        return progress
+
+
+class FFmpegProgressParser:
+    """解析ffmpeg的输出：先从'Duration: ...'取得总时长，再根据'time=... speed=...'计算进度"""
+
+    DURATION = re.compile(r'Duration:\s*(\d+:\d+:[\d.]+)')
+    PROGRESS = re.compile(r'size=\s*(\S+).*?time=\s*(\d+:\d+:[\d.]+).*?speed=\s*([\d.]+)x')
+
+    def __init__(self):
+        self.duration = None
+
+    def __call__(self, line):
+        if self.duration is None:
+            match = self.DURATION.search(line)
+            if match:
+                self.duration = parse_timestamp(match.group(1))
+                return None
+        match = self.PROGRESS.search(line)
+        if not match:
+            return None
+        position = parse_timestamp(match.group(2))
+        progress = {
+            'bytes': parse_size(match.group(1).replace('kB', 'KiB')),  # ffmpeg的kB是1024字节
+            'seconds': position,
+            'speed': float(match.group(3)),  # 相对实时的倍速
+        }
+        if self.duration:
+            progress['percent'] = round(min(position / self.duration * 100, 100.0), 2)
+        return progress
+
+
+class CommandResult:
+    """命令执行结果，output只保留最后若干行输出"""
+
+    def __init__(self, returncode, output, timed_out=False, cancelled=False):
+        self.returncode = returncode
+        self.output = output
+        self.timed_out = timed_out
+        self.cancelled = cancelled
+
+    @property
+    def success(self):
+        return self.returncode == 0 and not self.timed_out and not self.cancelled
+
+
+def _limit_process(pid, nice=None, cpu_seconds=None, memory_bytes=None):
+    """子进程启动后设置其nice值和资源上限（之后启动的孙进程会继承）。
+    不用preexec_fn，它在多线程进程中fork之后执行Python代码，可能死锁"""
+    try:
+        if nice and hasattr(os, 'setpriority'):
+            os.setpriority(os.PRIO_PROCESS, pid, os.getpriority(os.PRIO_PROCESS, 0) + nice)
+        if hasattr(resource, 'prlimit'):
+            if cpu_seconds:
+                resource.prlimit(pid, resource.RLIMIT_CPU, (cpu_seconds, cpu_seconds))
+            if memory_bytes:
+                resource.prlimit(pid, resource.RLIMIT_AS, (memory_bytes, memory_bytes))
+    except (OSError, ValueError) as e:
+        # 子进程已经退出，或者没有权限
+        logger.warning(f"Error limiting process {pid}: {str(e)}")
+
+
+def _read_lines(stream, lines):
+    """读取子进程输出，按\\r或\\n切分成行（进度条用\\r刷新同一行）"""
+    buffer = b''
+    while True:
+        chunk = os.read(stream.fileno(), READ_CHUNK_SIZE)
+        if not chunk:
+            break
+        buffer += chunk
+        parts = re.split(rb'[\r\n]', buffer)
+        buffer = parts.pop()
+        for part in parts:
+            if part.strip():
+                lines.put(part.decode('utf-8', errors='replace'))
+    if buffer.strip():
+        lines.put(buffer.decode('utf-8', errors='replace'))
+    lines.put(None)
+
+
+def _kill(process):
+    """终止子进程及其进程组：先SIGTERM，超时后SIGKILL"""
+    try:
+        if os.name == 'posix':
+            os.killpg(process.pid, signal.SIGTERM)
+        else:
+            process.terminate()
+        process.wait(KILL_GRACE_SECONDS)
+    except subprocess.TimeoutExpired:
+        if os.name == 'posix':
+            os.killpg(process.pid, signal.SIGKILL)
+        else:
+            process.kill()
+        process.wait()
+    except ProcessLookupError:
+        pass
+
+
+def run_command(cmd, timeout=None, parser=None, on_progress=None, cancel_event=None,
+                nice=None, cpu_seconds=None, memory_bytes=None, tail_lines=200):
+    """流式执行命令：逐行读取输出并解析进度，超时或取消时终止子进程。
+    输出只保留最后tail_lines行，避免冗长的ffmpeg输出全部堆在内存里"""
+    kwargs = {}
+    if os.name == 'posix':
+        # 独立进程组，终止时连同lux启动的ffmpeg等子进程一起结束
+        kwargs['start_new_session'] = True
+    # 不继承标准输入，ffmpeg等命令需要交互确认时直接失败而不是一直等待
+    process = subprocess.Popen(
+        cmd, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, **kwargs
+    )
+    if nice or cpu_seconds or memory_bytes:
+        _limit_process(process.pid, nice, cpu_seconds, memory_bytes)
+
+    lines = queue.Queue()
+    reader = threading.Thread(target=_read_lines, args=(process.stdout, lines), daemon=True)
+    reader.start()
+
+    tail = deque(maxlen=tail_lines)
+    deadline = time.time() + timeout if timeout else None
+    timed_out = cancelled = finished = False
+    try:
+        while True:
+            try:
+                line = lines.get(timeout=0.5)
+            except queue.Empty:
+                line = ''
+            if line is None:
+                finished = True
+                break
+            if line:
+                tail.append(line)
+                if parser and on_progress:
+                    progress = parser(line)
+                    if progress:
+                        on_progress(progress)
+            if cancel_event is not None and cancel_event.is_set():
+                cancelled = True
+                break
+            if deadline and time.time() > deadline:
+                timed_out = True
+                break
+    finally:
+        # 超时、取消或解析进度时抛出异常，都要终止进程组，否则wait()会一直等到子进程自行退出
+        if not finished:
+            _kill(process)
+        returncode = process.wait()
+        reader.join(KILL_GRACE_SECONDS)
+        process.stdout.close()
+
+    if timed_out:
+        tail.append(f"Command timed out after {timeout}s")
+    if cancelled:
+        tail.append("Command cancelled")
+    return CommandResult(returncode, '\n'.join(tail), timed_out, cancelled)
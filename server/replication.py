@@ -0,0 +1,159 @@
+import threading
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import requests
+from requests.adapters import HTTPAdapter
+from server.database import get_db
+from server.models import Change
+from server.sync import changed_urls_since, current_seq, get_peer_seq, set_peer_seq, compact_changes
+from server.sync import url_to_sync_dict, post_sync_urls
+from server.config import SLAVE_LIST, SYNC_BATCH_SIZE, REPLICATION_INTERVAL, REPLICATION_TIMEOUT, REPLICATION_MAX_BACKOFF
+
+logger = logging.getLogger(__name__)
+
+
+class PeerState:
+    """单个从节点的复制状态"""
+
+    def __init__(self, host, port):
+        self.name = f'{host}:{port}'
+        self.url = f'http://{host}:{port}/sync/url/replicate'
+        # 每个从节点一个长连接会话
+        self.session = requests.Session()
+        self.session.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=1))
+        self.in_flight = False  # 同一从节点同时只有一个批次在途
+        self.failures = 0
+        self.next_attempt = 0
+        self.acked_seq = 0
+        self.lag_seq = 0
+        self.lag_seconds = 0.0
+        self.last_success = None
+        self.last_error = None
+
+    def to_dict(self):
+        return {
+            'peer': self.name,
+            'acked_seq': self.acked_seq,
+            'lag_seq': self.lag_seq,
+            'lag_seconds': round(self.lag_seconds, 3),
+            'failures': self.failures,
+            'in_flight': self.in_flight,
+            'last_success': self.last_success.isoformat() if self.last_success else None,
+            'last_error': self.last_error
+        }
+
+
+class Replicator:
+    """主节点：把变更日志并发推送到SLAVE_LIST中的每个从节点"""
+
+    def __init__(self):
+        self.peers = [PeerState(item['host'], item['port']) for item in SLAVE_LIST]
+        self.is_running = False
+        self.thread = None
+        self.executor = None
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+
+    def start(self):
+        """启动复制调度线程"""
+        if not self.is_running and self.peers:
+            self.is_running = True
+            self.executor = ThreadPoolExecutor(max_workers=len(self.peers), thread_name_prefix='replicator')
+            self.thread = threading.Thread(target=self._schedule)
+            self.thread.daemon = True
+            self.thread.start()
+            logger.info(f"Replicator started for {len(self.peers)} slaves")
+
+    def stop(self):
+        """停止复制调度线程，等待在途批次完成"""
+        self.is_running = False
+        self._wake.set()
+        if self.thread:
+            self.thread.join()
+        if self.executor:
+            self.executor.shutdown(wait=True)
+        logger.info("Replicator stopped")
+
+    def notify(self):
+        """有新的本地写入时唤醒调度线程"""
+        self._wake.set()
+
+    def status(self):
+        """各从节点的复制状态与延迟"""
+        with self._lock:
+            return [peer.to_dict() for peer in self.peers]
+
+    def _schedule(self):
+        while self.is_running:
+            self._wake.wait(REPLICATION_INTERVAL)
+            self._wake.clear()
+            now = time.time()
+            for peer in self.peers:
+                with self._lock:
+                    if peer.in_flight or now < peer.next_attempt:
+                        continue
+                    peer.in_flight = True
+                self.executor.submit(self._replicate_peer, peer)
+            self._compact()
+
+    def _compact(self):
+        db = next(get_db())
+        try:
+            if compact_changes(db):
+                db.commit()
+        except Exception as e:
+            db.rollback()
+            logger.error(f"Error compacting change log: {str(e)}")
+        finally:
+            db.close()
+
+    def _replicate_peer(self, peer):
+        """把从节点落后的变更按批推送过去，每批成功后才推进已确认序列号"""
+        db = next(get_db())
+        try:
+            while self.is_running:
+                acked_seq = get_peer_seq(db, peer.name)
+                # 由该从节点推送上来的变更不再回传给它
+                rows, next_seq = changed_urls_since(db, acked_seq, SYNC_BATCH_SIZE, exclude_origin=peer.name)
+                if rows:
+                    post_sync_urls(
+                        peer.session, peer.url, [url_to_sync_dict(u) for _, u in rows],
+                        peer='master', timeout=REPLICATION_TIMEOUT
+                    )
+                if next_seq > acked_seq:
+                    set_peer_seq(db, peer.name, next_seq)
+                    db.commit()
+                self._update_lag(db, peer, next_seq)
+                with self._lock:
+                    peer.failures = 0
+                    peer.last_success = datetime.utcnow()
+                    peer.last_error = None
+                if len(rows) < SYNC_BATCH_SIZE:
+                    break
+        except Exception as e:
+            db.rollback()
+            with self._lock:
+                peer.failures += 1
+                backoff = min(REPLICATION_INTERVAL * 2 ** peer.failures, REPLICATION_MAX_BACKOFF)
+                peer.next_attempt = time.time() + backoff
+                peer.last_error = str(e)
+            self._update_lag(db, peer, get_peer_seq(db, peer.name))
+            logger.error(f"Replication to {peer.name} failed (retry in {backoff}s): {str(e)}")
+        finally:
+            db.close()
+            with self._lock:
+                peer.in_flight = False
+
+    def _update_lag(self, db, peer, acked_seq):
+        """延迟指标：落后的变更数量，以及最早未确认变更距今的秒数"""
+        oldest = db.query(Change.created_at).filter(Change.id > acked_seq).order_by(Change.id).first()
+        with self._lock:
+            peer.acked_seq = acked_seq
+            peer.lag_seq = current_seq(db) - acked_seq
+            peer.lag_seconds = (datetime.utcnow() - oldest[0]).total_seconds() if oldest and oldest[0] else 0.0
+
+
+# 创建全局复制调度实例
+replicator = Replicator()
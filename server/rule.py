@@ -1,26 +1,127 @@
-import subprocess
 import logging
 import os
+import re
 import tempfile
 import shutil
+import threading
+from contextlib import contextmanager
 from pathlib import Path
 from datetime import datetime
 from server.config import LUX_PATH, FFMPEG_PATH, LUX_DOWNLOAD_PATH, FFMPEG_OUTPUT_PATH, DOMAIN_CONFIGS, MAX_RETRY_COUNT
-from server.database import get_db
-from server.models import Task, TaskStatus, ProcessingStage
+from server.config import STAGE_CONCURRENCY, PIPELINE_QUEUE_SIZE
+from server.config import STAGE_TIMEOUTS, CHILD_NICE, CHILD_CPU_LIMIT, CHILD_MEMORY_LIMIT_MB, DOMAIN_THROTTLE_RETRIES
+from server.models import TaskStatus, ProcessingStage
+from server.task_state import task_states
+from server.domain_scheduler import domain_scheduler, domain_key
+from server.pipeline import StagePipeline
+from server.process_runner import run_command, LuxProgressParser, FFmpegProgressParser
+from server.artifact_store import artifact_store, canonical_media_id, file_checksum
 
 logger = logging.getLogger(__name__)
 
+class ChainJob:
+    """一个URL在处理链中的执行状态，在各处理阶段之间传递"""
+
+    def __init__(self, url, config_key, start_stage=ProcessingStage.INIT, on_done=None):
+        self.url = url
+        self.config_key = config_key
+        self.start_stage = start_stage
+        self.on_done = on_done
+        self.media_id = canonical_media_id(url)
+        self.artifacts = []  # 本处理链持有引用的缓存产物类型，结束时释放
+        self.completed = set()  # 重试时从上次结果恢复、不再执行的处理器
+        self.temp_dir = None
+        self.input_file = None
+        self.subtitle_file = None
+        self.result_data = {}
+
+# 处理阶段的先后顺序
+STAGE_ORDER = [
+    ProcessingStage.INIT,
+    ProcessingStage.DOWNLOAD,
+    ProcessingStage.AUDIO_EXTRACT,
+    ProcessingStage.SUBTITLE_EXTRACT,
+    ProcessingStage.VECTORIZE,
+]
+
+# 处理链中各处理器对应的处理阶段
+PROCESSOR_STAGES = {
+    'lux': ProcessingStage.DOWNLOAD,
+    'ffmpeg_audio': ProcessingStage.AUDIO_EXTRACT,
+    'ffmpeg_subtitle': ProcessingStage.SUBTITLE_EXTRACT,
+    'ffmpeg_combined': ProcessingStage.AUDIO_EXTRACT,
+    'vectorize': ProcessingStage.VECTORIZE,
+}
+
+# ffmpeg处理器对应的输出类型（同时也是需要的输入流类型）
+FFMPEG_OUTPUTS = {
+    'ffmpeg_audio': 'audio',
+    'ffmpeg_subtitle': 'subtitle',
+}
+
+# 各处理器产出的缓存产物类型，阶段完成时记录其路径和校验和
+PROCESSOR_OUTPUTS = {
+    'lux': ['video'],
+    'ffmpeg_audio': ['audio'],
+    'ffmpeg_subtitle': ['subtitle'],
+    'ffmpeg_combined': ['audio', 'subtitle'],
+    'vectorize': [],
+}
+
+# ffmpeg输出文件名前缀和扩展名
+FFMPEG_OUTPUT_FILES = {
+    'audio': ('audio', 'mp3'),
+    'subtitle': ('subtitle', 'srt'),
+}
+
+# 命令输出中表示被站点限流的内容，状态码只在HTTP状态的上下文中匹配，
+# 避免把下载进度中的"412.34 MiB"之类误判为限流
+THROTTLE_PATTERN = re.compile(
+    r'HTTP(?:/[\d.]+)?\s+(?:error\s+)?(412|429)\b|status(?:\s+code)?\s*[:=]?\s*(412|429)\b'
+    r'|returned\s+(412|429)\b|Precondition Failed|Too Many Requests',
+    re.IGNORECASE
+)
+
+# 读取输入文件流信息的超时时间（秒）
+PROBE_TIMEOUT = 60
+
+# 解析ffmpeg -i输出中的流信息，如"Stream #0:2(chi): Subtitle: mov_text"
+STREAM_PATTERN = re.compile(r'Stream #\d+:\d+.*?: (Video|Audio|Subtitle):')
+
 class URLProcessor:
     def __init__(self):
-        self.processors = {
-            'bilibili.com': self._process_bilibili,
-            'www.bilibili.com': self._process_bilibili,
+        # 各处理器的执行函数，签名为(job, config) -> bool
+        self.stage_runners = {
+            'lux': self._run_lux,
+            'ffmpeg_audio': self._run_ffmpeg_audio,
+            'ffmpeg_subtitle': self._run_ffmpeg_subtitle,
+            'ffmpeg_combined': self._run_ffmpeg_combined,
+            'vectorize': self._run_vectorize,
+        }
+        # 流水线模式下每个处理链配置一个StagePipeline
+        self.pipelines = {}
+        self._pipelines_lock = threading.Lock()
+        # 各处理阶段的并发限制，多个工作线程共享
+        self.stage_slots = {
+            ProcessingStage(stage): threading.BoundedSemaphore(max(limit, 1))
+            for stage, limit in STAGE_CONCURRENCY.items()
         }
+        # 置位后终止所有正在执行的外部命令
+        self.cancel_event = threading.Event()
         # 确保输出目录存在
         os.makedirs(LUX_DOWNLOAD_PATH, exist_ok=True)
         os.makedirs(FFMPEG_OUTPUT_PATH, exist_ok=True)
 
+    @contextmanager
+    def _stage_slot(self, stage):
+        """占用一个处理阶段的并发名额，名额用完时阻塞等待"""
+        slot = self.stage_slots.get(stage)
+        if slot is None:
+            yield
+            return
+        with slot:
+            yield
+
     def _create_temp_dir(self, url):
         """为URL创建临时目录"""
         # 使用URL的哈希值作为临时目录名
@@ -35,245 +136,509 @@ class URLProcessor:
         mp4_files = list(Path(temp_dir).glob('*.mp4'))
         return len(mp4_files) > 0, mp4_files[0] if mp4_files else None
 
-    def _update_task_status(self, url, status, error_message=None, result_data=None, stage=None):
-        """更新任务状态"""
-        try:
-            db = next(get_db())
-            task = db.query(Task).filter(Task.url == url).first()
-            if task:
-                task.status = status
-                if error_message:
-                    task.error_message = error_message
-                if result_data:
-                    task.result_data = result_data
-                if stage:
-                    task.current_stage = stage
-                if status == TaskStatus.PROCESSING:
-                    task.started_at = datetime.utcnow()
-                elif status in [TaskStatus.SUCCESS, TaskStatus.FAILED]:
-                    task.completed_at = datetime.utcnow()
-                db.commit()
-        except Exception as e:
-            logger.error(f"Error updating task status: {str(e)}")
-        finally:
-            db.close()
+    def _effective_chain(self, config):
+        """实际执行的处理链：combined模式下把所有ffmpeg处理器合并为一次ffmpeg_combined调用"""
+        chain = list(config['process_chain'])
+        if config.get('ffmpeg_mode') != 'combined' or 'combined' not in config.get('ffmpeg_args', {}):
+            return chain
+        ffmpeg_steps = [processor for processor in chain if processor in FFMPEG_OUTPUTS]
+        if len(ffmpeg_steps) < 2:
+            return chain
+        index = chain.index(ffmpeg_steps[0])
+        chain = [processor for processor in chain if processor not in FFMPEG_OUTPUTS]
+        chain.insert(index, 'ffmpeg_combined')
+        return chain
 
-    def _get_task_stage(self, url):
-        """获取任务的当前处理阶段"""
-        try:
-            db = next(get_db())
-            task = db.query(Task).filter(Task.url == url).first()
-            return task.current_stage if task else ProcessingStage.INIT
-        except Exception as e:
-            logger.error(f"Error getting task stage: {str(e)}")
-            return ProcessingStage.INIT
-        finally:
-            db.close()
+    def _prepare(self, url, on_done=None):
+        """处理前的准备：标记任务为处理中，恢复上次已完成的阶段，返回(ChainJob, None)，无对应处理器时返回(None, 错误信息)"""
+        # 获取当前处理阶段和上次的结果
+        current_stage, result_data = task_states.load(url)
+
+        # 更新任务状态为处理中
+        task_states.update(url, TaskStatus.PROCESSING, stage=current_stage)
+
+        # 从URL中提取域名
+        domain = url.split('/')[2]
+
+        # 查找对应的处理链，子域名和别名域名使用同一配置
+        config_key = domain_key(domain)
+        if not config_key:
+            return None, f"No processor found for domain: {domain}"
+        job = ChainJob(url, config_key, current_stage, on_done)
+        self._restore_job(job, result_data)
+        return job, None
+
+    def _restore_job(self, job, result_data):
+        """重试时恢复处理链：按顺序校验失败阶段之前各阶段持久化的产物，
+        校验通过的阶段不再执行，从第一个校验失败的阶段（最晚为上次失败的阶段）继续"""
+        stages = result_data.get('stages') or {}
+        failed_index = STAGE_ORDER.index(job.start_stage)
+        for processor in self._effective_chain(DOMAIN_CONFIGS[job.config_key]):
+            stage = PROCESSOR_STAGES.get(processor)
+            if stage is None or STAGE_ORDER.index(stage) >= failed_index:
+                break
+            record = stages.get(processor)
+            if record is None or not self._verify_outputs(job, record.get('outputs', {})):
+                break
+            job.completed.add(processor)
+            job.result_data.update(record.get('result', {}))
+            job.result_data.setdefault('stages', {})[processor] = record
+
+        if job.completed:
+            job.input_file = job.result_data.get('video_file')
+            job.subtitle_file = job.result_data.get('subtitle_file')
+            logger.info(f"Resuming {job.url} after completed stages: {sorted(job.completed)}")
+
+    def _verify_outputs(self, job, outputs):
+        """校验阶段产物仍在缓存中且大小、校验和与完成时记录的一致，通过时持有产物的引用"""
+        for kind, info in outputs.items():
+            path = self._cached_artifact(job, kind)
+            if path != info.get('path'):
+                logger.warning(f"Artifact {kind} for {job.url} is gone, re-running stage")
+                return False
+            if os.path.getsize(path) != info.get('size') or file_checksum(path) != info.get('checksum'):
+                logger.warning(f"Artifact {kind} for {job.url} is corrupted, re-running stage")
+                artifact_store.invalidate(job.media_id, kind)
+                return False
+        return True
+
+    def _record_stage(self, job, processor, before):
+        """阶段完成后把产物路径、大小、校验和以及该阶段写入的结果持久化到Task.result_data"""
+        outputs = {}
+        for kind in PROCESSOR_OUTPUTS.get(processor, []):
+            path = job.result_data.get(f'{kind}_file')
+            if not path:
+                continue
+            info = artifact_store.describe(job.media_id, kind)
+            if not info or info['path'] != path:
+                info = {'path': path, 'size': os.path.getsize(path), 'checksum': file_checksum(path)}
+            outputs[kind] = info
+        result = {
+            key: value for key, value in job.result_data.items()
+            if key != 'stages' and before.get(key) != value
+        }
+        job.result_data.setdefault('stages', {})[processor] = {
+            'outputs': outputs,
+            'result': result,
+            'completed_at': datetime.utcnow().isoformat()
+        }
+        task_states.update(job.url, TaskStatus.PROCESSING, result_data=dict(job.result_data))
 
     def process_url(self, url):
-        """处理URL的主入口"""
+        """处理URL的主入口，按处理链顺序逐个阶段执行"""
         try:
-            # 获取当前处理阶段
-            current_stage = self._get_task_stage(url)
-            
-            # 更新任务状态为处理中
-            self._update_task_status(url, TaskStatus.PROCESSING, stage=current_stage)
-            
-            # 从URL中提取域名
-            domain = url.split('/')[2]
-            
-            # 查找对应的处理器
-            processor = self.processors.get(domain)
-            if processor:
-                result = processor(url, current_stage)
-                if result:
-                    self._update_task_status(url, TaskStatus.SUCCESS)
-                else:
-                    self._update_task_status(url, TaskStatus.FAILED, "Processing failed")
-                return result
-            else:
-                error_msg = f"No processor found for domain: {domain}"
-                logger.warning(error_msg)
-                self._update_task_status(url, TaskStatus.FAILED, error_msg)
+            job, error = self._prepare(url)
+            if not job:
+                logger.warning(error)
+                task_states.update(url, TaskStatus.FAILED, error)
                 return False
+
+            result = False
+            try:
+                config = DOMAIN_CONFIGS[job.config_key]
+                for processor in self._effective_chain(config):
+                    if not self.run_stage(processor, job):
+                        return False
+                result = True
+            finally:
+                self._finish_job(job, result)
+            return result
         except Exception as e:
             error_msg = f"Error processing URL {url}: {str(e)}"
             logger.error(error_msg)
-            self._update_task_status(url, TaskStatus.FAILED, error_msg)
+            task_states.update(url, TaskStatus.FAILED, error_msg)
             return False
 
-    def _run_command(self, cmd, description):
-        """执行命令并返回结果"""
+    def submit_url(self, url, on_done):
+        """流水线模式入口：把URL放入对应处理链的流水线，处理完成后回调on_done(success)。
+        第一阶段的队列已满时阻塞，形成背压"""
+        try:
+            job, error = self._prepare(url, on_done)
+            if not job:
+                logger.warning(error)
+                task_states.update(url, TaskStatus.FAILED, error)
+                on_done(False)
+                return
+            self._get_pipeline(job.config_key).submit(job)
+        except Exception as e:
+            error_msg = f"Error processing URL {url}: {str(e)}"
+            logger.error(error_msg)
+            task_states.update(url, TaskStatus.FAILED, error_msg)
+            on_done(False)
+
+    def _get_pipeline(self, config_key):
+        """获取（必要时创建并启动）处理链对应的流水线"""
+        with self._pipelines_lock:
+            pipeline = self.pipelines.get(config_key)
+            if pipeline is None:
+                chain = self._effective_chain(DOMAIN_CONFIGS[config_key])
+                concurrency = [
+                    STAGE_CONCURRENCY.get(PROCESSOR_STAGES[processor].value, 1) for processor in chain
+                ]
+                pipeline = StagePipeline(
+                    config_key, chain, self.run_stage, self._finish_job,
+                    concurrency=concurrency, queue_size=PIPELINE_QUEUE_SIZE
+                )
+                pipeline.start()
+                self.pipelines[config_key] = pipeline
+            return pipeline
+
+    def stop_pipelines(self):
+        """停止所有流水线，等待已进入流水线的URL处理完成"""
+        with self._pipelines_lock:
+            pipelines = list(self.pipelines.values())
+            self.pipelines = {}
+        for pipeline in pipelines:
+            pipeline.stop()
+
+    def run_stage(self, processor, job):
+        """执行处理链中的一个阶段，返回是否成功（已跳过的阶段视为成功）"""
+        stage = PROCESSOR_STAGES.get(processor)
+        # 上次已完成且产物校验通过的阶段直接跳过
+        if processor in job.completed:
+            return True
+        runner = self.stage_runners.get(processor)
+        if runner is None:
+            logger.error(f"Unknown processor in chain: {processor}")
+            return False
+        config = DOMAIN_CONFIGS[job.config_key]
+        try:
+            before = dict(job.result_data)
+            with self._stage_slot(stage):
+                if not runner(job, config):
+                    return False
+            self._record_stage(job, processor, before)
+            return True
+        except Exception as e:
+            logger.error(f"Error in {processor} for {job.url}: {str(e)}")
+            return False
+
+    def _finish_job(self, job, success):
+        """处理链结束：清理临时目录，更新任务状态和结果数据"""
+        try:
+            # 清理临时目录
+            if job.temp_dir and os.path.exists(job.temp_dir):
+                shutil.rmtree(job.temp_dir)
+        except Exception as e:
+            logger.error(f"Error cleaning temp dir {job.temp_dir}: {str(e)}")
+        for kind in job.artifacts:
+            artifact_store.release(job.media_id, kind)
+        if success:
+            # 更新任务状态和结果数据
+            task_states.update(job.url, TaskStatus.SUCCESS, result_data=job.result_data)
+        else:
+            task_states.update(job.url, TaskStatus.FAILED, "Processing failed")
+        if job.on_done:
+            job.on_done(success)
+
+    def _run_command(self, cmd, description, url=None, stage=None, parser=None):
+        """流式执行命令：按阶段限制执行时间，解析进度并定期写入任务表，返回(是否成功, 输出末尾)"""
         try:
             logger.info(f"Executing {description}: {' '.join(cmd)}")
-            result = subprocess.run(cmd, capture_output=True, text=True)
-            
-            if result.returncode == 0:
+            timeout = STAGE_TIMEOUTS.get(stage.value) if stage else None
+            result = run_command(
+                cmd,
+                timeout=timeout or None,
+                parser=parser,
+                on_progress=self._progress_reporter(url, stage) if url and parser else None,
+                cancel_event=self.cancel_event,
+                nice=CHILD_NICE,
+                cpu_seconds=CHILD_CPU_LIMIT,
+                memory_bytes=CHILD_MEMORY_LIMIT_MB * 1024 * 1024
+            )
+
+            if result.success:
                 logger.info(f"Successfully completed {description}")
-                logger.debug(f"Command output: {result.stdout}")
-                return True, result.stdout
+                logger.debug(f"Command output: {result.output}")
+                return True, result.output
             else:
                 logger.error(f"Failed to complete {description}")
-                logger.error(f"Error output: {result.stderr}")
-                return False, result.stderr
+                logger.error(f"Error output: {result.output}")
+                return False, result.output
         except Exception as e:
             logger.error(f"Error executing {description}: {str(e)}")
             return False, str(e)
 
-    def _process_bilibili(self, url, start_stage=ProcessingStage.INIT):
-        """处理bilibili.com的URL"""
-        try:
-            # 获取bilibili的特定配置
-            config = DOMAIN_CONFIGS['bilibili.com']
-            input_file = None
-            temp_dir = None
-            result_data = {}
-            
-            # 执行处理链
-            for processor in config['process_chain']:
-                # 检查是否需要跳过当前处理阶段
-                if processor == 'lux' and start_stage != ProcessingStage.INIT:
-                    continue
-                elif processor == 'ffmpeg_audio' and start_stage not in [ProcessingStage.INIT, ProcessingStage.DOWNLOAD]:
-                    continue
-                elif processor == 'ffmpeg_subtitle' and start_stage not in [ProcessingStage.INIT, ProcessingStage.DOWNLOAD, ProcessingStage.AUDIO_EXTRACT]:
-                    continue
-                elif processor == 'vectorize' and start_stage not in [ProcessingStage.INIT, ProcessingStage.DOWNLOAD, ProcessingStage.AUDIO_EXTRACT, ProcessingStage.SUBTITLE_EXTRACT]:
-                    continue
-
-                if processor == 'lux':
-                    # 更新处理阶段
-                    self._update_task_status(url, TaskStatus.PROCESSING, stage=ProcessingStage.DOWNLOAD)
-                    
-                    # 创建临时目录
-                    temp_dir = self._create_temp_dir(url)
-                    
-                    # 修改lux参数以使用临时目录
-                    lux_args = config['lux_args'].copy()
-                    for i, arg in enumerate(lux_args):
-                        if arg == '-o':
-                            lux_args[i + 1] = temp_dir
-                    
-                    # 执行Lux下载
-                    cmd = [LUX_PATH] + lux_args + [url]
-                    success, output = self._run_command(cmd, "Lux download")
-                    if not success:
-                        return False
-                    
-                    # 检查下载是否成功
-                    download_success, downloaded_file = self._check_download_success(temp_dir)
-                    if not download_success:
-                        logger.error("No MP4 files found in temporary directory")
-                        return False
-                    
-                    input_file = str(downloaded_file)
-                    result_data['video_file'] = input_file
-                    
-                elif processor == 'ffmpeg_audio':
-                    # 更新处理阶段
-                    self._update_task_status(url, TaskStatus.PROCESSING, stage=ProcessingStage.AUDIO_EXTRACT)
-                    
-                    if not input_file:
-                        logger.error("No input file for audio extraction")
-                        return False
-                        
-                    # 准备输出文件路径
-                    input_filename = os.path.basename(input_file)
-                    output_file = os.path.join(FFMPEG_OUTPUT_PATH, f"audio_{os.path.splitext(input_filename)[0]}.mp3")
-                    
-                    # 构建ffmpeg命令
-                    ffmpeg_cmd = [FFMPEG_PATH]
-                    for arg in config['ffmpeg_args']['audio']:
-                        if arg == '{input}':
-                            ffmpeg_cmd.append(input_file)
-                        elif arg == '{output}':
-                            ffmpeg_cmd.append(output_file)
-                        else:
-                            ffmpeg_cmd.append(arg)
-                    
-                    # 执行ffmpeg处理
-                    success, output = self._run_command(ffmpeg_cmd, "FFmpeg audio extraction")
-                    if not success:
-                        return False
-                    
-                    result_data['audio_file'] = output_file
-                    
-                elif processor == 'ffmpeg_subtitle':
-                    # 更新处理阶段
-                    self._update_task_status(url, TaskStatus.PROCESSING, stage=ProcessingStage.SUBTITLE_EXTRACT)
-                    
-                    if not input_file:
-                        logger.error("No input file for subtitle extraction")
-                        return False
-                        
-                    # 准备输出文件路径
-                    input_filename = os.path.basename(input_file)
-                    output_file = os.path.join(FFMPEG_OUTPUT_PATH, f"subtitle_{os.path.splitext(input_filename)[0]}.srt")
-                    
-                    # 构建ffmpeg命令
-                    ffmpeg_cmd = [FFMPEG_PATH]
-                    for arg in config['ffmpeg_args']['subtitle']:
-                        if arg == '{input}':
-                            ffmpeg_cmd.append(input_file)
-                        elif arg == '{output}':
-                            ffmpeg_cmd.append(output_file)
-                        else:
-                            ffmpeg_cmd.append(arg)
-                    
-                    # 执行ffmpeg处理
-                    success, output = self._run_command(ffmpeg_cmd, "FFmpeg subtitle extraction")
-                    if not success:
-                        return False
-                    
-                    # 保存字幕文件路径供后续处理使用
-                    subtitle_file = output_file
-                    result_data['subtitle_file'] = subtitle_file
-                    
-                elif processor == 'vectorize':
-                    # 更新处理阶段
-                    self._update_task_status(url, TaskStatus.PROCESSING, stage=ProcessingStage.VECTORIZE)
-                    
-                    from server.vector_store import vector_store
-                    if not subtitle_file or not os.path.exists(subtitle_file):
-                        logger.error("No subtitle file for vectorization")
-                        return False
-                        
-                    # 读取字幕文件
-                    with open(subtitle_file, 'r', encoding='utf-8') as f:
-                        subtitle_text = f.read()
-                    
-                    # 提取视频ID（从文件名中）
-                    video_id = os.path.splitext(os.path.basename(input_file))[0]
-                    
-                    # 添加到向量数据库
-                    metadata = {
-                        'video_id': video_id,
-                        'url': url,
-                        'source_file': input_file,
-                        'subtitle_file': subtitle_file
-                    }
-                    
-                    success = vector_store.add_subtitle(video_id, subtitle_text, metadata)
-                    if not success:
-                        logger.error("Failed to add subtitle to vector store")
-                        return False
-                    
-                    result_data['video_id'] = video_id
+    def _progress_reporter(self, url, stage):
+        """返回进度回调，进度先记在内存中，随任务状态批量写入Task.progress"""
+        def report(progress):
+            task_states.update(url, progress=dict(progress, stage=stage.value, updated_at=datetime.utcnow().isoformat()))
+        return report
+
+    def cancel_running(self):
+        """终止正在执行的外部命令，对应的阶段按失败处理"""
+        logger.warning("Cancelling running commands")
+        self.cancel_event.set()
+
+    def _cached_artifact(self, job, kind):
+        """查找缓存的产物，命中时返回文件路径并持有引用"""
+        path = artifact_store.acquire(job.media_id, kind)
+        if path:
+            job.artifacts.append(kind)
+            logger.info(f"Using cached {kind} for {job.url}: {path}")
+        return path
+
+    def _store_artifact(self, job, kind, path):
+        """把生成的产物移入缓存并持有引用，返回缓存中的路径"""
+        stored = artifact_store.put(job.media_id, kind, path)
+        job.artifacts.append(kind)
+        return stored
+
+    def _run_lux(self, job, config):
+        """使用lux下载视频"""
+        url = job.url
+        # 更新处理阶段
+        task_states.update(url, TaskStatus.PROCESSING, stage=ProcessingStage.DOWNLOAD)
+
+        # 同一视频已经下载过时直接使用缓存
+        cached = self._cached_artifact(job, 'video')
+        if cached:
+            job.input_file = cached
+            job.result_data['video_file'] = cached
+            return True
+        
+        # 创建临时目录
+        job.temp_dir = temp_dir = self._create_temp_dir(url)
+        
+        # 修改lux参数以使用临时目录
+        lux_args = config['lux_args'].copy()
+        for i, arg in enumerate(lux_args):
+            if arg == '-o':
+                lux_args[i + 1] = temp_dir
+        
+        # 执行Lux下载
+        cmd = [LUX_PATH] + lux_args + [url]
+        if not self._run_domain_command(job, cmd, "Lux download", LuxProgressParser):
+            return False
+        
+        # 检查下载是否成功
+        download_success, downloaded_file = self._check_download_success(temp_dir)
+        if not download_success:
+            logger.error("No MP4 files found in temporary directory")
+            return False
+        
+        job.input_file = self._store_artifact(job, 'video', str(downloaded_file))
+        job.result_data['video_file'] = job.input_file
+        return True
+
+    def _run_domain_command(self, job, cmd, description, parser_class):
+        """在域名的限速额度内执行访问站点的命令，被限流时退避后重试"""
+        for attempt in range(DOMAIN_THROTTLE_RETRIES + 1):
+            if not domain_scheduler.acquire(job.config_key, self.cancel_event):
+                return False
+            try:
+                success, output = self._run_command(
+                    cmd, description, job.url, ProcessingStage.DOWNLOAD, parser_class()
+                )
+            finally:
+                domain_scheduler.release(job.config_key)
+            if success:
+                domain_scheduler.report_success(job.config_key)
+                return True
+            if not THROTTLE_PATTERN.search(output):
+                return False
+            domain_scheduler.report_throttled(job.config_key)
+        return False
+
+    def _build_ffmpeg_cmd(self, args, input_file, output_file):
+        """根据配置的参数模板构建ffmpeg命令"""
+        ffmpeg_cmd = [FFMPEG_PATH]
+        for arg in args:
+            if arg == '{input}':
+                ffmpeg_cmd.append(input_file)
+            elif arg == '{output}':
+                ffmpeg_cmd.append(output_file)
+            else:
+                ffmpeg_cmd.append(arg)
+        return ffmpeg_cmd
+
+    def _ffmpeg_output_path(self, kind, input_file):
+        """ffmpeg输出文件路径"""
+        prefix, ext = FFMPEG_OUTPUT_FILES[kind]
+        input_name = os.path.splitext(os.path.basename(input_file))[0]
+        return os.path.join(FFMPEG_OUTPUT_PATH, f"{prefix}_{input_name}.{ext}")
+
+    def _remove_staged(self, paths):
+        """删除失败（超时、取消、出错）的ffmpeg留下的不完整输出"""
+        for path in paths:
+            try:
+                if os.path.exists(path):
+                    os.remove(path)
+            except OSError as e:
+                logger.warning(f"Error removing partial output {path}: {str(e)}")
+
+    def _probe_streams(self, input_file):
+        """读取输入文件包含的流类型（video/audio/subtitle），只解析文件头"""
+        # 没有指定输出时ffmpeg总是以非0退出，只解析输出中的流信息；
+        # 与其他命令一样受取消事件和资源限制约束，停止服务时可以中断
+        result = run_command(
+            [FFMPEG_PATH, '-hide_banner', '-i', input_file],
+            timeout=PROBE_TIMEOUT,
+            cancel_event=self.cancel_event,
+            nice=CHILD_NICE,
+            cpu_seconds=CHILD_CPU_LIMIT,
+            memory_bytes=CHILD_MEMORY_LIMIT_MB * 1024 * 1024
+        )
+        if result.timed_out or result.cancelled:
+            logger.error(f"Probing streams of {input_file} did not finish: {result.output}")
+            return set()
+        return {match.lower() for match in STREAM_PATTERN.findall(result.output)}
+
+    def _run_ffmpeg_combined(self, job, config):
+        """一次ffmpeg调用产出处理链需要的全部输出，输入文件只解复用一次。
+        已缓存的输出不再生成；输入中缺少某类流（如没有字幕）时跳过该输出并记录在missing_outputs中"""
+        # 更新处理阶段
+        task_states.update(job.url, TaskStatus.PROCESSING, stage=ProcessingStage.AUDIO_EXTRACT)
+
+        requested = [FFMPEG_OUTPUTS[p] for p in config['process_chain'] if p in FFMPEG_OUTPUTS]
+        outputs = {}
+        for kind in requested:
+            cached = self._cached_artifact(job, kind)
+            if cached:
+                outputs[kind] = cached
+        pending = [kind for kind in requested if kind not in outputs]
+
+        missing = []
+        if pending:
+            if not job.input_file:
+                logger.error("No input file for ffmpeg extraction")
+                return False
+
+            streams = self._probe_streams(job.input_file)
+            available = [kind for kind in pending if kind in streams]
+            missing = [kind for kind in pending if kind not in streams]
+            if not available and not outputs:
+                logger.error(f"No {'/'.join(requested)} streams found in {job.input_file}")
+                return False
+
+            if available:
+                # 构建ffmpeg命令：输入参数 + 每个输出各自的参数
+                combined = config['ffmpeg_args']['combined']
+                ffmpeg_cmd = self._build_ffmpeg_cmd(combined['input'], job.input_file, None)
+                staged = {}
+                for kind in available:
+                    staged[kind] = self._ffmpeg_output_path(kind, job.input_file)
+                    ffmpeg_cmd += self._build_ffmpeg_cmd(combined['outputs'][kind], job.input_file, staged[kind])[1:]
+
+                # 执行ffmpeg处理
+                success, output = self._run_command(
+                    ffmpeg_cmd, f"FFmpeg {'+'.join(available)} extraction",
+                    job.url, ProcessingStage.AUDIO_EXTRACT, FFmpegProgressParser()
+                )
+                if not success:
+                    self._remove_staged(staged.values())
+                    return False
+                for kind in available:
+                    outputs[kind] = self._store_artifact(job, kind, staged[kind])
+
+        for kind in requested:
+            job.result_data[f'{kind}_file'] = outputs.get(kind)
+        if missing:
+            logger.warning(f"No {'/'.join(missing)} streams in {job.input_file}, skipped")
+            job.result_data['missing_outputs'] = missing
+        job.subtitle_file = outputs.get('subtitle')
+        return True
+
+    def _run_ffmpeg_audio(self, job, config):
+        """使用ffmpeg提取音频"""
+        # 更新处理阶段
+        task_states.update(job.url, TaskStatus.PROCESSING, stage=ProcessingStage.AUDIO_EXTRACT)
+
+        cached = self._cached_artifact(job, 'audio')
+        if cached:
+            job.result_data['audio_file'] = cached
+            return True
+        
+        if not job.input_file:
+            logger.error("No input file for audio extraction")
+            return False
             
-            # 清理临时目录
-            if temp_dir and os.path.exists(temp_dir):
-                shutil.rmtree(temp_dir)
+        # 准备输出文件路径
+        output_file = self._ffmpeg_output_path('audio', job.input_file)
+        
+        # 执行ffmpeg处理
+        ffmpeg_cmd = self._build_ffmpeg_cmd(config['ffmpeg_args']['audio'], job.input_file, output_file)
+        success, output = self._run_command(
+            ffmpeg_cmd, "FFmpeg audio extraction", job.url, ProcessingStage.AUDIO_EXTRACT, FFmpegProgressParser()
+        )
+        if not success:
+            self._remove_staged([output_file])
+            return False
+        
+        job.result_data['audio_file'] = self._store_artifact(job, 'audio', output_file)
+        return True
+
+    def _run_ffmpeg_subtitle(self, job, config):
+        """使用ffmpeg提取字幕"""
+        # 更新处理阶段
+        task_states.update(job.url, TaskStatus.PROCESSING, stage=ProcessingStage.SUBTITLE_EXTRACT)
+
+        cached = self._cached_artifact(job, 'subtitle')
+        if cached:
+            job.subtitle_file = cached
+            job.result_data['subtitle_file'] = cached
+            return True
+        
+        if not job.input_file:
+            logger.error("No input file for subtitle extraction")
+            return False
             
-            # 更新任务状态和结果数据
-            self._update_task_status(url, TaskStatus.SUCCESS, result_data=result_data)
+        # 准备输出文件路径
+        output_file = self._ffmpeg_output_path('subtitle', job.input_file)
+        
+        # 执行ffmpeg处理
+        ffmpeg_cmd = self._build_ffmpeg_cmd(config['ffmpeg_args']['subtitle'], job.input_file, output_file)
+        success, output = self._run_command(
+            ffmpeg_cmd, "FFmpeg subtitle extraction", job.url, ProcessingStage.SUBTITLE_EXTRACT, FFmpegProgressParser()
+        )
+        if not success:
+            self._remove_staged([output_file])
+            return False
+        
+        # 保存字幕文件路径供后续处理使用
+        job.subtitle_file = self._store_artifact(job, 'subtitle', output_file)
+        job.result_data['subtitle_file'] = job.subtitle_file
+        return True
+
+    def _run_vectorize(self, job, config):
+        """将字幕写入向量数据库"""
+        # 更新处理阶段
+        task_states.update(job.url, TaskStatus.PROCESSING, stage=ProcessingStage.VECTORIZE)
+        
+        subtitle_file = job.subtitle_file
+        if 'subtitle' in job.result_data.get('missing_outputs', []):
+            # 视频本身没有字幕流，不算失败
+            logger.warning(f"No subtitle stream for {job.url}, skipping vectorization")
             return True
-                
-        except Exception as e:
-            logger.error(f"Error in bilibili processor: {str(e)}")
-            # 确保在发生错误时也清理临时目录
-            if temp_dir and os.path.exists(temp_dir):
-                shutil.rmtree(temp_dir)
+
+        from server.vector_store import vector_store
+        if not subtitle_file or not os.path.exists(subtitle_file):
+            logger.error("No subtitle file for vectorization")
+            return False
+            
+        # 读取字幕文件
+        with open(subtitle_file, 'r', encoding='utf-8') as f:
+            subtitle_text = f.read()
+        
+        # 提取视频ID（从文件名中）
+        video_id = os.path.splitext(os.path.basename(job.input_file))[0]
+        
+        # 添加到向量数据库
+        metadata = {
+            'video_id': video_id,
+            'url': job.url,
+            'domain': job.url.split('/')[2],
+            'source_file': job.input_file,
+            'subtitle_file': subtitle_file
+        }
+        
+        success = vector_store.add_subtitle(video_id, subtitle_text, metadata)
+        if not success:
+            logger.error("Failed to add subtitle to vector store")
             return False
+        
+        job.result_data['video_id'] = video_id
+        return True
 
 # 创建全局处理器实例
-url_processor = URLProcessor() 
\ No newline at end of file
+url_processor = URLProcessor()
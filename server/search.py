@@ -1,10 +1,25 @@
 import argparse
 import json
-from server.vector_store import vector_store
+import os
+import requests
 
-def search_subtitles(query, n_results=5):
+def search_remote(server, query, n_results=5):
+    """通过搜索服务查询，复用服务端已加载的向量库和模型"""
+    response = requests.get(
+        f"{server.rstrip('/')}/search",
+        params={'q': query, 'n': n_results},
+        timeout=30
+    )
+    response.raise_for_status()
+    return response.json()['results']
+
+def search_subtitles(query, n_results=5, server=None):
     """搜索字幕"""
-    results = vector_store.search(query, n_results)
+    if server:
+        results = search_remote(server, query, n_results)
+    else:
+        from server.vector_store import vector_store
+        results = vector_store.search(query, n_results)
     
     # 打印结果
     print(f"\n搜索结果: '{query}'")
@@ -18,14 +33,61 @@ def search_subtitles(query, n_results=5):
             print(f"相似度: {1 - result['distance']:.4f}")
         print("-" * 30)
 
+def search_hybrid_remote(server, query, n_results=5):
+    """通过搜索服务进行混合搜索，返回(结果, 各阶段耗时)"""
+    response = requests.get(
+        f"{server.rstrip('/')}/search/hybrid",
+        params={'q': query, 'limit': n_results},
+        timeout=30
+    )
+    response.raise_for_status()
+    data = response.json()
+    return data['results'], data['timings']
+
+def search_hybrid(query, n_results=5, server=None):
+    """混合搜索已保存的URL和字幕"""
+    if server:
+        results, timings = search_hybrid_remote(server, query, n_results)
+    else:
+        from server.database import SessionLocal
+        from server.hybrid_search import hybrid_searcher
+        db = SessionLocal()
+        try:
+            items, timings, _ = hybrid_searcher.search(db, query, n_results)
+            results = [dict(item, record={'title': item['record'].title} if item['record'] else None)
+                       for item in items]
+        finally:
+            db.close()
+
+    print(f"\n混合搜索结果: '{query}'")
+    print(f"耗时: {json.dumps(timings)}")
+    print("-" * 50)
+
+    for i, result in enumerate(results, 1):
+        print(f"\n结果 {i}: {result['url']}")
+        if result['record']:
+            print(f"标题: {result['record']['title']}")
+        print(f"得分: {result['score']:.4f} 排名: {json.dumps(result['ranks'])}")
+        for segment in result['segments']:
+            print(f"字幕: {segment['text']}")
+        print("-" * 30)
+
 def main():
     parser = argparse.ArgumentParser(description='字幕搜索工具')
     parser.add_argument('query', help='搜索查询')
     parser.add_argument('-n', '--num-results', type=int, default=5,
                       help='返回结果数量 (默认: 5)')
+    parser.add_argument('-s', '--server', default=os.getenv('SEARCH_SERVER'),
+                      help='搜索服务地址，如 http://127.0.0.1:8080 (默认: 环境变量SEARCH_SERVER，未设置时在本进程中加载向量库)')
+    
+    parser.add_argument('--hybrid', action='store_true',
+                      help='同时搜索已保存的URL和字幕，按URL融合排名')
     
     args = parser.parse_args()
-    search_subtitles(args.query, args.num_results)
+    if args.hybrid:
+        search_hybrid(args.query, args.num_results, args.server)
+    else:
+        search_subtitles(args.query, args.num_results, args.server)
 
 if __name__ == '__main__':
-    main() 
\ No newline at end of file
+    main()
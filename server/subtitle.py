@@ -0,0 +1,150 @@
+import re
+from server.config import SUBTITLE_CHUNK_TOKENS, SUBTITLE_CHUNK_OVERLAP, SUBTITLE_CHUNK_SECONDS
+
+# SRT/WebVTT时间轴，如"00:01:02,345 --> 00:01:04,000"
+SRT_TIMING = re.compile(
+    r'(?:(\d+):)?(\d{1,2}):(\d{2})[,.](\d{1,3})\s*-->\s*(?:(\d+):)?(\d{1,2}):(\d{2})[,.](\d{1,3})'
+)
+# ASS时间，如"0:01:02.34"
+ASS_TIME = re.compile(r'(\d+):(\d{2}):(\d{2})[.](\d{1,3})')
+# 字幕中的样式标签：<i>...</i>、{\an8}等
+MARKUP = re.compile(r'<[^>]+>|\{[^}]*\}')
+# 无时间轴的纯文本按句末标点切分
+SENTENCE_END = re.compile(r'(?<=[。！？!?.；;])\s*|\n+')
+# CJK字符范围：假名、汉字、兼容汉字、韩文
+CJK_RANGES = '\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uac00-\ud7af'
+# 计算token数：一个CJK字符或一个其他语言的单词算一个token
+TOKEN = re.compile(f'[{CJK_RANGES}]|[^\\s{CJK_RANGES}]+')
+
+
+class Cue:
+    """一条字幕，start/end为秒数，无时间轴时为None"""
+
+    def __init__(self, start, end, text):
+        self.start = start
+        self.end = end
+        self.text = text
+        self.tokens = count_tokens(text)
+
+
+def count_tokens(text):
+    """估算文本的token数"""
+    return len(TOKEN.findall(text))
+
+
+def _seconds(hours, minutes, seconds, fraction):
+    return int(hours or 0) * 3600 + int(minutes) * 60 + int(seconds) + int(fraction) / 10 ** len(fraction)
+
+
+def _clean(text):
+    """去掉样式标签，合并换行和多余空白"""
+    text = MARKUP.sub('', text.replace('\\N', ' ').replace('\\n', ' '))
+    return ' '.join(text.split())
+
+
+def parse_srt(text):
+    """解析SRT/WebVTT：每个空行分隔的块包含序号（可选）、时间轴和若干行文本"""
+    cues = []
+    for block in re.split(r'\n\s*\n', text.replace('\r\n', '\n').replace('\r', '\n')):
+        lines = block.strip().split('\n')
+        for i, line in enumerate(lines):
+            match = SRT_TIMING.search(line)
+            if match:
+                content = _clean(' '.join(lines[i + 1:]))
+                if content:
+                    groups = match.groups()
+                    cues.append(Cue(_seconds(*groups[:4]), _seconds(*groups[4:]), content))
+                break
+    return cues
+
+
+def parse_ass(text):
+    """解析ASS/SSA的[Events]段，按Format行确定Start、End、Text字段的位置"""
+    cues = []
+    fields = None
+    for line in text.splitlines():
+        line = line.strip()
+        if line.lower().startswith('format:') and fields is None:
+            names = [name.strip().lower() for name in line[7:].split(',')]
+            if 'text' in names:
+                fields = names
+        elif line.lower().startswith('dialogue:') and fields:
+            values = line[9:].split(',', len(fields) - 1)
+            if len(values) < len(fields):
+                continue
+            row = dict(zip(fields, values))
+            start, end = ASS_TIME.match(row.get('start', '').strip()), ASS_TIME.match(row.get('end', '').strip())
+            content = _clean(row['text'])
+            if start and end and content:
+                cues.append(Cue(_seconds(*start.groups()), _seconds(*end.groups()), content))
+    cues.sort(key=lambda cue: cue.start)
+    return cues
+
+
+def parse_subtitle(text):
+    """按内容识别字幕格式并解析为字幕列表，无法识别时按句子切分为无时间轴的字幕"""
+    if '[Events]' in text or re.search(r'^Dialogue:', text, re.MULTILINE):
+        cues = parse_ass(text)
+    else:
+        cues = parse_srt(text)
+    if cues:
+        return cues
+    return [Cue(None, None, part.strip()) for part in SENTENCE_END.split(text) if part and part.strip()]
+
+
+def chunk_cues(cues, max_tokens=SUBTITLE_CHUNK_TOKENS, overlap_tokens=SUBTITLE_CHUNK_OVERLAP,
+               max_seconds=SUBTITLE_CHUNK_SECONDS):
+    """把连续的字幕合并成滑动时间窗口：每个窗口不超过max_tokens个token且不超过max_seconds秒，
+    相邻窗口重叠约overlap_tokens个token，返回[{'text', 'start', 'end'}]"""
+    # 滚动字幕常把同一句重复多次，去掉与上一条相同的字幕
+    deduped = []
+    for cue in cues:
+        if deduped and deduped[-1].text == cue.text:
+            if cue.end is not None:
+                deduped[-1].end = cue.end
+            continue
+        deduped.append(cue)
+
+    chunks = []
+    start = 0
+    while start < len(deduped):
+        end = start
+        tokens = 0
+        while end < len(deduped):
+            cue = deduped[end]
+            too_long = (
+                max_seconds and cue.end is not None and deduped[start].start is not None
+                and cue.end - deduped[start].start > max_seconds
+            )
+            # 至少包含一条字幕，单条超长的字幕单独成块
+            if end > start and (tokens + cue.tokens > max_tokens or too_long):
+                break
+            tokens += cue.tokens
+            end += 1
+        window = deduped[start:end]
+        chunks.append({
+            'text': ' '.join(cue.text for cue in window),
+            'start': window[0].start,
+            'end': window[-1].end,
+        })
+        if end >= len(deduped):
+            break
+        # 下一个窗口从末尾约overlap_tokens个token处开始，保证向前推进
+        next_start = end
+        overlap = 0
+        while next_start - 1 > start and overlap + deduped[next_start - 1].tokens <= overlap_tokens:
+            next_start -= 1
+            overlap += deduped[next_start].tokens
+        start = next_start
+    return chunks
+
+
+def chunk_subtitle(text, **kwargs):
+    """解析字幕文本并切分为带起止时间的窗口"""
+    return chunk_cues(parse_subtitle(text), **kwargs)
+
+
+def format_timestamp(seconds):
+    """把秒数格式化为HH:MM:SS"""
+    seconds = int(seconds)
+    return f'{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}'
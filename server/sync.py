@@ -0,0 +1,351 @@
+import logging
+import json
+import zlib
+from datetime import datetime, timezone, timedelta
+from urllib.parse import urlencode
+from sqlalchemy import func, or_, exists
+from sqlalchemy.orm import aliased
+from server.models import URL, Change, SyncPeer, split_url
+from server.config import SYNC_CHUNK_SIZE, SYNC_WIRE_FORMAT, SYNC_WIRE_COMPRESSION, SYNC_GAP_LAG
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+# 同步数据的传输格式
+JSON_CONTENT_TYPE = 'application/json'
+COLUMNS_CONTENT_TYPE = 'application/vnd.urlsaver.columns+json'
+MSGPACK_CONTENT_TYPE = 'application/vnd.urlsaver.columns+msgpack'
+
+# 列式格式传输的字段，domain/path/query_params由接收方从url重新解析，
+# query_params在传输时拼回url的query部分
+WIRE_COLUMNS = ('url', 'title', 'tags', 'notes', 'created_at', 'updated_at')
+
+# 同步时直接覆盖的字段，domain/path由url解析得到
+SYNC_FIELDS = ('title', 'tags', 'notes', 'description', 'favicon', 'thumbnail', 'query_params')
+# 同步数据中的文本字段，必须是字符串或None
+SYNC_TEXT_FIELDS = ('title', 'notes', 'description', 'favicon', 'thumbnail')
+
+
+def parse_sync_time(value):
+    """解析同步数据中的时间字段，统一为UTC的naive datetime"""
+    if not value:
+        return None
+    dt = value if isinstance(value, datetime) else datetime.fromisoformat(value)
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
+    return dt
+
+
+def url_to_sync_dict(u):
+    """将URL记录序列化为同步数据"""
+    return {
+        'url': u.url,
+        'title': u.title,
+        'domain': u.domain,
+        'path': u.path,
+        'query_params': u.query_params,
+        'tags': u.tags,
+        'notes': u.notes,
+        'created_at': u.created_at.isoformat() if u.created_at else None,
+        'updated_at': u.updated_at.isoformat() if u.updated_at else None
+    }
+
+
+def _check_sync_record(u):
+    """检查对端传来的字段类型，不合法时抛出TypeError，避免写入后在序列化或同步时出错"""
+    if not isinstance(u['url'], str):
+        raise TypeError('url must be a string')
+    for field in SYNC_TEXT_FIELDS:
+        if u.get(field) is not None and not isinstance(u[field], str):
+            raise TypeError(f'{field} must be a string')
+    tags = u.get('tags')
+    if tags is not None and not (isinstance(tags, list) and all(isinstance(tag, str) for tag in tags)):
+        raise TypeError('tags must be a list of strings')
+    query_params = u.get('query_params')
+    if query_params is not None and not (
+        isinstance(query_params, dict) and all(
+            isinstance(name, str) and isinstance(values, list) and all(isinstance(v, str) for v in values)
+            for name, values in query_params.items()
+        )
+    ):
+        raise TypeError('query_params must map strings to lists of strings')
+
+
+def apply_sync_urls(db, urls):
+    """批量应用同步数据：以规范化后的url为唯一键，按块IN查询已有记录，
+    已存在且对方updated_at更新时覆盖，不存在时插入。字段类型不合法的条目计为无效，不写入。
+    不提交事务，返回(写入行数, 无效条目数)"""
+    # 同一批次中同一url只保留updated_at最新的一条
+    latest = {}
+    invalid = 0
+    for u in urls:
+        try:
+            _check_sync_record(u)
+            # 与URL构造函数一致地规范化url（去掉query和fragment），query参数单独保存
+            key, _, _, query_params = split_url(u['url'])
+            updated_at = parse_sync_time(u.get('updated_at'))
+            created_at = parse_sync_time(u.get('created_at'))
+        except (KeyError, TypeError, ValueError):
+            invalid += 1
+            continue
+        if query_params and not u.get('query_params'):
+            u = dict(u, query_params=query_params)
+        current = latest.get(key)
+        if current is None or (updated_at and (current[1] is None or updated_at > current[1])):
+            latest[key] = (u, updated_at, created_at)
+
+    count = 0
+    keys = list(latest)
+    for start in range(0, len(keys), SYNC_CHUNK_SIZE):
+        chunk = keys[start:start + SYNC_CHUNK_SIZE]
+        existing = {obj.url: obj for obj in db.query(URL).filter(URL.url.in_(chunk))}
+        for key in chunk:
+            u, updated_at, created_at = latest[key]
+            obj = existing.get(key)
+            if obj is not None:
+                # 只更新比本地新的数据
+                if updated_at and (obj.updated_at is None or updated_at > obj.updated_at):
+                    for field in SYNC_FIELDS:
+                        if field in u:
+                            setattr(obj, field, u[field])
+                    obj.updated_at = updated_at
+                    count += 1
+            else:
+                obj = URL(url=key, tags=u.get('tags'), notes=u.get('notes'))
+                for field in SYNC_FIELDS:
+                    if u.get(field) is not None:
+                        setattr(obj, field, u[field])
+                if created_at:
+                    obj.created_at = created_at
+                if updated_at:
+                    obj.updated_at = updated_at
+                db.add(obj)
+                count += 1
+        db.flush()
+    return count, invalid
+
+
+def current_seq(db):
+    """当前最大的变更序列号"""
+    return db.query(func.max(Change.id)).scalar() or 0
+
+
+def safe_seq(db, seq):
+    """seq之后可以安全读取到的最大变更序列号。
+    并发写入时（如PostgreSQL），较小的序列号可能晚于较大的序列号提交，读取时表现为序列号空洞；
+    直接推进到最大序列号会永久跳过这些变更。因此遇到空洞时停在空洞之前，
+    直到空洞之后的变更已写入超过SYNC_GAP_LAG秒（空洞来自回滚的事务或已压缩的旧变更）才越过它。
+    SQLite的写入是串行的，不会出现未提交的空洞"""
+    head = current_seq(db)
+    following = aliased(Change)
+    cutoff = datetime.utcnow() - timedelta(seconds=SYNC_GAP_LAG)
+    # 第一个前一个序列号缺失、且写入时间还在SYNC_GAP_LAG之内的变更
+    blocked = db.query(func.min(Change.id)).filter(
+        Change.id > seq + 1,
+        Change.created_at > cutoff,
+        ~exists().where(following.id == Change.id - 1)
+    ).scalar()
+    if blocked is None:
+        return head
+    return db.query(func.max(Change.id)).filter(Change.id > seq, Change.id < blocked).scalar() or seq
+
+
+def changed_urls_since(db, seq, limit, exclude_origin=None):
+    """按变更序列号增量读取URL，同一url在范围内只返回最新状态一次。
+    exclude_origin用于跳过由该对端同步过来的变更，避免回传。
+    只读取到safe_seq为止，不会越过可能尚未提交的变更。
+    返回([(序列号, URL)], 下一次应从哪个序列号之后继续)"""
+    head = safe_seq(db, seq)
+    q = db.query(func.max(Change.id).label('seq'), Change.url_id).filter(
+        Change.id > seq, Change.id <= head
+    )
+    if exclude_origin:
+        q = q.filter(or_(Change.origin.is_(None), Change.origin != exclude_origin))
+    latest = q.group_by(Change.url_id).order_by(func.max(Change.id)).limit(limit).subquery()
+    rows = db.query(latest.c.seq, URL).join(URL, URL.id == latest.c.url_id).order_by(latest.c.seq).all()
+    # 未取满一批说明已追平，直接推进到head（包括被exclude_origin跳过的变更）
+    next_seq = rows[-1][0] if len(rows) >= limit else head
+    return rows, max(next_seq, seq)
+
+
+def get_peer_seq(db, peer):
+    """对端已确认的变更序列号"""
+    obj = db.get(SyncPeer, peer)
+    return obj.acked_seq if obj else 0
+
+
+def set_peer_seq(db, peer, seq):
+    """记录对端已确认的变更序列号（只前进不后退），不提交事务"""
+    obj = db.get(SyncPeer, peer)
+    if obj is None:
+        db.add(SyncPeer(peer=peer, acked_seq=seq))
+    elif seq > obj.acked_seq:
+        obj.acked_seq = seq
+
+
+def compact_changes(db):
+    """删除所有对端都已确认、且已被同一url更新的变更覆盖的旧记录，
+    每个url至少保留最新一条，新加入的对端仍能从0开始完整同步。不提交事务"""
+    min_acked = db.query(func.min(SyncPeer.acked_seq)).scalar()
+    if not min_acked:
+        return 0
+    latest = db.query(func.max(Change.id)).group_by(Change.url_id)
+    return db.query(Change).filter(
+        Change.id <= min_acked, Change.id.notin_(latest)
+    ).delete(synchronize_session=False)
+
+
+def supported_content_types():
+    """当前环境支持的同步传输格式，按优先级排列"""
+    types = [COLUMNS_CONTENT_TYPE, JSON_CONTENT_TYPE]
+    if msgpack is not None:
+        types.insert(0, MSGPACK_CONTENT_TYPE)
+    return types
+
+
+def supported_encodings():
+    """当前环境支持的压缩算法，按优先级排列"""
+    return ['zstd', 'gzip'] if zstandard is not None else ['gzip']
+
+
+def wire_settings():
+    """根据配置返回(传输格式, 压缩算法)，依赖未安装时降级"""
+    content_type = {
+        'json': JSON_CONTENT_TYPE,
+        'columns': COLUMNS_CONTENT_TYPE,
+        'msgpack': MSGPACK_CONTENT_TYPE,
+    }.get(SYNC_WIRE_FORMAT, COLUMNS_CONTENT_TYPE)
+    if content_type not in supported_content_types():
+        logger.warning("msgpack is not installed, falling back to columnar JSON")
+        content_type = COLUMNS_CONTENT_TYPE
+    encoding = SYNC_WIRE_COMPRESSION if SYNC_WIRE_COMPRESSION in ('gzip', 'zstd') else None
+    if encoding and encoding not in supported_encodings():
+        logger.warning("zstandard is not installed, falling back to gzip")
+        encoding = 'gzip'
+    return content_type, encoding
+
+
+def post_sync_urls(http, url, records, peer=None, timeout=10):
+    """以配置的压缩格式POST同步数据，对端不支持时回退为JSON，返回对端响应的JSON。
+    http可以是requests模块或requests.Session（复用长连接）"""
+    content_type, encoding = wire_settings()
+    while True:
+        encoder = SyncEncoder(content_type, encoding)
+        headers = {'Content-Type': encoder.content_type}
+        if peer:
+            headers['X-Sync-Peer'] = peer
+        if encoder.encoding:
+            headers['Content-Encoding'] = encoder.encoding
+        resp = http.post(url, data=encoder.encode(records), headers=headers, timeout=timeout)
+        if resp.status_code in (400, 415) and (content_type, encoding) != (JSON_CONTENT_TYPE, None):
+            logger.warning(f'{url} does not support {content_type}/{encoding}, falling back to JSON')
+            content_type, encoding = JSON_CONTENT_TYPE, None
+            continue
+        resp.raise_for_status()
+        return resp.json()
+
+
+def _to_wire_row(record):
+    """将同步数据转换为列式格式的一行，query_params折叠回url"""
+    url = record['url']
+    if record.get('query_params'):
+        url = f"{url}?{urlencode(record['query_params'], doseq=True)}"
+    return [url] + [record.get(column) for column in WIRE_COLUMNS[1:]]
+
+
+def _from_wire_row(columns, row):
+    """将列式格式的一行还原为同步数据，重新解析派生字段"""
+    record = dict(zip(columns, row))
+    record['url'], record['domain'], record['path'], record['query_params'] = split_url(record['url'])
+    return record
+
+
+class SyncEncoder:
+    """同步数据的流式编码器：begin() + row()* + end()依次产出字节块"""
+
+    def __init__(self, content_type=JSON_CONTENT_TYPE, encoding=None):
+        self.content_type = content_type
+        self.encoding = encoding
+        self._count = 0
+        if encoding == 'gzip':
+            self._compressor = zlib.compressobj(wbits=31)
+        elif encoding == 'zstd':
+            self._compressor = zstandard.ZstdCompressor().compressobj()
+        else:
+            self._compressor = None
+
+    def _out(self, data, flush=False):
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        if self._compressor is None:
+            return data
+        data = self._compressor.compress(data)
+        if flush:
+            data += self._compressor.flush()
+        return data
+
+    def begin(self):
+        if self.content_type == MSGPACK_CONTENT_TYPE:
+            return self._out(msgpack.packb({'columns': list(WIRE_COLUMNS)}))
+        if self.content_type == COLUMNS_CONTENT_TYPE:
+            return self._out('{"columns": %s, "rows": [' % json.dumps(list(WIRE_COLUMNS)))
+        return self._out('{"urls": [')
+
+    def row(self, record):
+        sep = ',' if self._count else ''
+        self._count += 1
+        if self.content_type == MSGPACK_CONTENT_TYPE:
+            return self._out(msgpack.packb(_to_wire_row(record)))
+        if self.content_type == COLUMNS_CONTENT_TYPE:
+            return self._out(sep + json.dumps(_to_wire_row(record), ensure_ascii=False))
+        return self._out(sep + json.dumps(record, ensure_ascii=False))
+
+    def end(self, next_cursor=None, **trailer):
+        trailer = {'next_cursor': next_cursor, **trailer}
+        if self.content_type == MSGPACK_CONTENT_TYPE:
+            return self._out(msgpack.packb(trailer), flush=True)
+        return self._out('], %s' % json.dumps(trailer)[1:], flush=True)
+
+    def encode(self, records, next_cursor=None, **trailer):
+        """一次性编码全部数据"""
+        return self.begin() + b''.join(self.row(r) for r in records) + self.end(next_cursor, **trailer)
+
+
+def decode_sync_body(body, content_type=JSON_CONTENT_TYPE, encoding=None):
+    """解码同步数据，返回(同步数据列表, 结尾字段字典)，格式不支持时抛出ValueError"""
+    if encoding == 'gzip':
+        body = zlib.decompress(body, wbits=31)
+    elif encoding == 'zstd' and zstandard is not None:
+        body = zstandard.ZstdDecompressor().decompressobj().decompress(body)
+    elif encoding not in (None, '', 'identity'):
+        raise ValueError(f"unsupported encoding: {encoding}")
+
+    if content_type == MSGPACK_CONTENT_TYPE and msgpack is not None:
+        unpacker = msgpack.Unpacker(raw=False)
+        unpacker.feed(body)
+        columns, records, trailer = None, [], {}
+        for obj in unpacker:
+            if isinstance(obj, dict) and 'columns' in obj:
+                columns = obj['columns']
+            elif isinstance(obj, dict):
+                trailer = obj
+            else:
+                records.append(_from_wire_row(columns, obj))
+        return records, trailer
+    if content_type == COLUMNS_CONTENT_TYPE:
+        data = json.loads(body)
+        columns = data.pop('columns')
+        return [_from_wire_row(columns, row) for row in data.pop('rows')], data
+    if content_type in (JSON_CONTENT_TYPE, None, ''):
+        data = json.loads(body)
+        return data.pop('urls'), data
+    raise ValueError(f"unsupported content type: {content_type}")
@@ -0,0 +1,222 @@
+import threading
+import logging
+from datetime import datetime
+from server.config import TASK_STATE_FLUSH_INTERVAL, WORKER_ID
+from server.database import get_db
+from server.models import Task, TaskStatus, ProcessingStage
+
+logger = logging.getLogger(__name__)
+
+# 终态：写入后立即落库
+TERMINAL_STATUSES = (TaskStatus.SUCCESS, TaskStatus.FAILED)
+
+
+def _task_to_dict(task):
+    """将任务记录序列化为接口返回的字典"""
+    return {
+        'url': task.url,
+        'status': task.status.value if task.status else None,
+        'current_stage': task.current_stage.value if task.current_stage else None,
+        'error_message': task.error_message,
+        'result_data': task.result_data,
+        'progress': task.progress,
+        'retry_count': task.retry_count,
+        'started_at': task.started_at.isoformat() if task.started_at else None,
+        'completed_at': task.completed_at.isoformat() if task.completed_at else None,
+    }
+
+
+class TaskEntry:
+    """处理中任务在内存中的状态，pending为尚未写入数据库的字段"""
+
+    def __init__(self, task_id, url, status, stage, result_data):
+        self.task_id = task_id
+        self.url = url
+        self.status = status
+        self.stage = stage
+        self.result_data = result_data
+        self.error_message = None
+        self.progress = None
+        self.pending = {}
+
+    def to_dict(self):
+        return {
+            'url': self.url,
+            'status': self.status.value if self.status else None,
+            'current_stage': self.stage.value if self.stage else None,
+            'error_message': self.error_message,
+            'result_data': self.result_data,
+            'progress': self.progress,
+        }
+
+
+class TaskStateManager:
+    """在内存中维护处理中任务的状态：状态变化先合并到内存，
+    由后台线程按TASK_STATE_FLUSH_INTERVAL批量写入数据库，进入终态时立即写入。
+    只写入本进程持有租约的任务，终态与释放租约在同一事务中落库。
+    接口读取时用内存中的最新状态覆盖数据库中的记录"""
+
+    def __init__(self, flush_interval=TASK_STATE_FLUSH_INTERVAL, owner=WORKER_ID):
+        self.flush_interval = flush_interval
+        self.owner = owner
+        self.entries = {}
+        self._lock = threading.Lock()
+        # 同一时间只有一个批次在写数据库，保证同一任务的更新按顺序落库
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+        self.thread = None
+
+    def start(self):
+        """启动后台批量写入线程"""
+        if self.thread is None or not self.thread.is_alive():
+            self._stop.clear()
+            self.thread = threading.Thread(target=self._flush_loop, name='task-state-flush')
+            self.thread.daemon = True
+            self.thread.start()
+            logger.info(f"Task state manager started, flushing every {self.flush_interval}s")
+
+    def stop(self):
+        """停止后台线程并写入剩余的状态"""
+        self._stop.set()
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+        self.flush()
+        logger.info("Task state manager stopped")
+
+    def load(self, url):
+        """开始处理任务时读取一次数据库，返回(当前处理阶段, 已持久化的结果数据)"""
+        db = next(get_db())
+        try:
+            task = db.query(Task).filter(Task.url == url).first()
+            if not task:
+                return ProcessingStage.INIT, {}
+            stage = task.current_stage or ProcessingStage.INIT
+            result_data = dict(task.result_data or {})
+            with self._lock:
+                self.entries[url] = TaskEntry(task.id, url, task.status, stage, result_data)
+            return stage, dict(result_data)
+        except Exception as e:
+            logger.error(f"Error getting task stage: {str(e)}")
+            return ProcessingStage.INIT, {}
+        finally:
+            db.close()
+
+    def update(self, url, status=None, error_message=None, result_data=None, stage=None, progress=None):
+        """更新任务状态：合并到内存，进入终态时立即写入数据库"""
+        now = datetime.utcnow()
+        with self._lock:
+            entry = self.entries.get(url)
+            if entry is None:
+                entry = self.entries[url] = TaskEntry(None, url, None, None, {})
+            pending = entry.pending
+            if status:
+                if status == TaskStatus.PROCESSING and entry.status != TaskStatus.PROCESSING:
+                    pending['started_at'] = now
+                elif status in TERMINAL_STATUSES:
+                    pending['completed_at'] = now
+                    # 进度只对处理中的任务有意义
+                    entry.progress = pending['progress'] = None
+                entry.status = pending['status'] = status
+            if error_message:
+                entry.error_message = pending['error_message'] = error_message
+            if result_data:
+                entry.result_data = pending['result_data'] = dict(result_data)
+            if stage:
+                entry.stage = pending['current_stage'] = stage
+                # 进入新阶段时清空上一阶段的进度
+                entry.progress = pending['progress'] = None
+            if progress is not None:
+                entry.progress = pending['progress'] = progress
+            terminal = status in TERMINAL_STATUSES
+        if terminal:
+            self.flush([url])
+
+    def get(self, url):
+        """读取任务状态：数据库中的记录叠加内存中尚未落库的最新状态，任务不存在时返回None"""
+        db = next(get_db())
+        try:
+            task = db.query(Task).filter(Task.url == url).first()
+            data = _task_to_dict(task) if task else None
+        finally:
+            db.close()
+        with self._lock:
+            entry = self.entries.get(url)
+            if entry is not None and entry.status is not None:
+                data = dict(data or {}, **entry.to_dict())
+        return data
+
+    def active(self):
+        """内存中所有处理中任务的状态"""
+        with self._lock:
+            return [entry.to_dict() for entry in self.entries.values()]
+
+    def flush(self, urls=None):
+        """把尚未落库的状态在一个事务中批量写入数据库，urls为None时写入全部。
+        只更新租约仍由本进程持有的任务，写入终态时同时释放租约；
+        租约已被回收（如本进程卡顿导致租约过期）的任务不再写入，从内存中丢弃。
+        写入终态的任务随后从内存中移除"""
+        with self._flush_lock:
+            with self._lock:
+                batch = []
+                for url in (urls if urls is not None else list(self.entries)):
+                    entry = self.entries.get(url)
+                    if entry is None or not entry.pending:
+                        continue
+                    batch.append((entry, entry.pending))
+                    entry.pending = {}
+            if not batch:
+                self._evict_terminal(urls)
+                return 0
+
+            lost = []
+            db = next(get_db())
+            try:
+                for entry, values in batch:
+                    query = db.query(Task).filter(Task.lease_owner == self.owner)
+                    if entry.task_id is not None:
+                        query = query.filter(Task.id == entry.task_id)
+                    else:
+                        query = query.filter(Task.url == entry.url)
+                    changes = {getattr(Task, key): value for key, value in values.items()}
+                    if values.get('status') in TERMINAL_STATUSES:
+                        changes[Task.lease_owner] = None
+                        changes[Task.lease_expires_at] = None
+                    if query.update(changes, synchronize_session=False) == 0:
+                        lost.append(entry)
+                db.commit()
+            except Exception as e:
+                db.rollback()
+                logger.error(f"Error flushing task states: {str(e)}")
+                # 写入失败时放回内存，不覆盖期间产生的更新
+                with self._lock:
+                    for entry, values in batch:
+                        entry.pending = dict(values, **entry.pending)
+                return 0
+            finally:
+                db.close()
+
+            if lost:
+                with self._lock:
+                    for entry in lost:
+                        logger.warning(f"Lease on {entry.url} is no longer held by {self.owner}, dropping its state")
+                        if self.entries.get(entry.url) is entry:
+                            del self.entries[entry.url]
+            self._evict_terminal(urls)
+            return len(batch) - len(lost)
+
+    def _evict_terminal(self, urls):
+        """移除已落库且处于终态的任务"""
+        with self._lock:
+            for url in (urls if urls is not None else list(self.entries)):
+                entry = self.entries.get(url)
+                if entry is not None and not entry.pending and entry.status in TERMINAL_STATUSES:
+                    del self.entries[url]
+
+    def _flush_loop(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+
+# 创建全局任务状态实例
+task_states = TaskStateManager()
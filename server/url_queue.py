@@ -1,19 +1,35 @@
-import queue
 import threading
 import time
+from datetime import timedelta
+from sqlalchemy import func, insert
+from sqlalchemy.exc import SQLAlchemyError
 from server.database import get_db
-from server.models import URL, Task, TaskStatus
-from server.config import MAX_RETRY_COUNT
+from server.models import URL, Task, TaskStatus, ProcessingStage
+from server.config import MAX_RETRY_COUNT, QUEUE_SCAN_INTERVAL, QUEUE_SCAN_BATCH_SIZE, QUEUE_FULL_SCAN_INTERVAL
+from server.config import QUEUE_CLAIM_POLL_INTERVAL
+from server.config import WORKER_ID, LEASE_TTL, LEASE_HEARTBEAT_INTERVAL
 import logging
 from datetime import datetime
 
 logger = logging.getLogger(__name__)
 
+# 每次领取任务时读取的候选数量，被其他进程抢先领取时依次尝试下一个
+CLAIM_CANDIDATES = 8
+
 class URLQueue:
-    def __init__(self):
-        self.url_queue = queue.Queue()
+    """以tasks表为持久化队列：扫描线程负责建任务、回收过期租约，
+    工作线程通过租约原子领取任务，多个进程/节点可共享同一数据库"""
+
+    def __init__(self, owner=WORKER_ID):
+        self.owner = owner
         self.is_running = False
         self.thread = None
+        self.heartbeat_thread = None
+        self.high_water_mark = 0  # 已扫描过的最大URL id
+        self.last_full_scan = 0
+        self._wake = threading.Event()
+        self._work_available = threading.Event()
+        self._next_poll = 0  # 队列为空时，下一次不等通知直接领取的时间
 
     def start(self):
         """启动URL队列处理线程"""
@@ -27,77 +43,195 @@ class URLQueue:
     def stop(self):
         """停止URL队列处理线程"""
         self.is_running = False
+        self._wake.set()
         if self.thread:
             self.thread.join()
             logger.info("URL queue processor stopped")
 
+    def start_heartbeat(self):
+        """启动租约续约线程，领取任务的进程需要启动"""
+        if self.heartbeat_thread is None:
+            self.heartbeat_thread = threading.Thread(target=self._heartbeat_loop)
+            self.heartbeat_thread.daemon = True
+            self.heartbeat_thread.start()
+            logger.info(f"Lease heartbeat started for {self.owner}")
+
+    def notify(self):
+        """有新URL写入时调用，立即唤醒扫描线程"""
+        self._wake.set()
+
     def _process_urls(self):
         """持续从数据库读取URL并放入队列的处理函数"""
         while self.is_running:
             try:
-                db = next(get_db())
-                # 获取所有未处理的URL
-                urls = db.query(URL).all()
-                
-                for url in urls:
-                    # 检查URL是否已经在任务表中且处理成功
-                    existing_task = db.query(Task).filter(
-                        Task.url == url.url,
-                        Task.status == TaskStatus.SUCCESS
-                    ).first()
-                    
-                    if not existing_task:
-                        # 检查是否有失败的任务
-                        failed_task = db.query(Task).filter(
-                            Task.url == url.url,
-                            Task.status == TaskStatus.FAILED
-                        ).first()
-                        
-                        if failed_task:
-                            # 检查是否可以重试
-                            if failed_task.can_retry(MAX_RETRY_COUNT):
-                                # 重置任务状态
-                                failed_task.status = TaskStatus.PENDING
-                                failed_task.increment_retry()
-                                db.commit()
-                                
-                                # 添加到队列
-                                self.url_queue.put(url.url)
-                                logger.info(f"Re-added failed URL to queue: {url.url} (retry {failed_task.retry_count})")
-                            else:
-                                logger.warning(f"URL {url.url} exceeded max retry count ({MAX_RETRY_COUNT})")
-                            continue
-                        
-                        # 检查是否有正在处理的任务
-                        processing_task = db.query(Task).filter(
-                            Task.url == url.url,
-                            Task.status.in_([TaskStatus.PENDING, TaskStatus.PROCESSING])
-                        ).first()
-                        
-                        if not processing_task:
-                            # 创建新的任务
-                            task = Task(url=url.url)
-                            db.add(task)
-                            db.commit()
-                            
-                            # 添加到队列
-                            self.url_queue.put(url.url)
-                            logger.info(f"Added URL to queue: {url.url}")
-                
-                # 每60秒检查一次新URL
-                time.sleep(60)
+                self._wake.clear()
+                self._scan()
+                # 等待新URL写入的通知，定时扫描只作为兜底
+                self._wake.wait(QUEUE_SCAN_INTERVAL)
             except Exception as e:
                 logger.error(f"Error processing URLs: {str(e)}")
                 time.sleep(5)  # 发生错误时等待5秒后重试
-            finally:
-                db.close()
 
-    def get_url(self):
-        """从队列中获取一个URL"""
+    def _scan(self):
+        """执行一次扫描：为新URL批量创建任务，回收过期租约，批量重置可重试的失败任务"""
+        db = next(get_db())
         try:
-            return self.url_queue.get_nowait()
-        except queue.Empty:
+            if time.time() - self.last_full_scan >= QUEUE_FULL_SCAN_INTERVAL:
+                # 定期从头扫描兜底
+                self.high_water_mark = 0
+                self.last_full_scan = time.time()
+            while self._create_tasks(db) >= QUEUE_SCAN_BATCH_SIZE:
+                pass
+            self._expire_leases(db)
+            self._retry_failed(db)
+            if db.query(Task.id).filter(Task.status == TaskStatus.PENDING).first():
+                self._work_available.set()
+        finally:
+            db.close()
+
+    def _create_tasks(self, db):
+        """从高水位之后找出还没有任务的URL（反连接），批量创建任务，返回本批URL数量"""
+        head = db.query(func.max(URL.id)).scalar() or 0
+        rows = db.query(URL.id, URL.url).outerjoin(Task, Task.url == URL.url).filter(
+            URL.id > self.high_water_mark,
+            URL.id <= head,
+            Task.id.is_(None)
+        ).order_by(URL.id).limit(QUEUE_SCAN_BATCH_SIZE).all()
+
+        if rows:
+            now = datetime.utcnow()
+            try:
+                db.execute(insert(Task), [{
+                    'url': url,
+                    'status': TaskStatus.PENDING,
+                    'result_data': {},
+                    'retry_count': 0,
+                    'current_stage': ProcessingStage.INIT,
+                    'created_at': now,
+                    'updated_at': now
+                } for _, url in rows])
+                db.commit()
+            except SQLAlchemyError as e:
+                # 可能与其他进程并发建了同一URL的任务，下次扫描重试
+                db.rollback()
+                logger.error(f"Error creating tasks: {str(e)}")
+                return 0
+            logger.info(f"Added {len(rows)} URLs to queue")
+
+        # 未取满一批说明已扫描到head
+        self.high_water_mark = rows[-1][0] if len(rows) >= QUEUE_SCAN_BATCH_SIZE else max(head, self.high_water_mark)
+        return len(rows)
+
+    def _retry_failed(self, db):
+        """批量把未超过重试次数的失败任务重置为待处理"""
+        q = db.query(Task.id, Task.url).filter(Task.status == TaskStatus.FAILED)
+        if MAX_RETRY_COUNT != -1:
+            q = q.filter(Task.retry_count < MAX_RETRY_COUNT)
+        rows = q.all()
+        if not rows:
+            return
+        db.query(Task).filter(
+            Task.id.in_([task_id for task_id, _ in rows]),
+            Task.status == TaskStatus.FAILED
+        ).update({
+            Task.status: TaskStatus.PENDING,
+            Task.retry_count: Task.retry_count + 1
+        }, synchronize_session=False)
+        db.commit()
+        logger.info(f"Re-added {len(rows)} failed URLs to queue")
+
+    def _expire_leases(self, db):
+        """租约过期的处理中任务视为进程崩溃，标记为失败，由重试逻辑决定是否重新处理。
+        租约在终态落库时才释放，没有租约的处理中任务不在这里回收"""
+        now = datetime.utcnow()
+        count = db.query(Task).filter(
+            Task.status == TaskStatus.PROCESSING,
+            Task.lease_expires_at < now
+        ).update({
+            Task.status: TaskStatus.FAILED,
+            Task.error_message: 'Lease expired',
+            Task.lease_owner: None,
+            Task.lease_expires_at: None,
+            Task.completed_at: now
+        }, synchronize_session=False)
+        db.commit()
+        if count:
+            logger.warning(f"Reclaimed {count} tasks with expired leases")
+
+    def claim(self):
+        """原子领取一个待处理任务：按id顺序取候选，用带状态条件的UPDATE抢占，
+        只有影响行数为1时才算领取成功，返回URL，没有可领取的任务时返回None"""
+        db = next(get_db())
+        try:
+            candidates = db.query(Task.id, Task.url).filter(
+                Task.status == TaskStatus.PENDING
+            ).order_by(Task.id).limit(CLAIM_CANDIDATES).all()
+            for task_id, url in candidates:
+                now = datetime.utcnow()
+                claimed = db.query(Task).filter(
+                    Task.id == task_id,
+                    Task.status == TaskStatus.PENDING
+                ).update({
+                    Task.status: TaskStatus.PROCESSING,
+                    Task.lease_owner: self.owner,
+                    Task.lease_expires_at: now + timedelta(seconds=LEASE_TTL),
+                    Task.heartbeat_at: now,
+                    Task.started_at: now
+                }, synchronize_session=False)
+                db.commit()
+                if claimed == 1:
+                    return url
             return None
+        finally:
+            db.close()
+
+    def heartbeat(self):
+        """为本进程持有的所有处理中任务续约"""
+        db = next(get_db())
+        try:
+            now = datetime.utcnow()
+            count = db.query(Task).filter(
+                Task.lease_owner == self.owner,
+                Task.status == TaskStatus.PROCESSING
+            ).update({
+                Task.lease_expires_at: now + timedelta(seconds=LEASE_TTL),
+                Task.heartbeat_at: now
+            }, synchronize_session=False)
+            db.commit()
+            return count
+        finally:
+            db.close()
+
+    def _heartbeat_loop(self):
+        while True:
+            time.sleep(LEASE_HEARTBEAT_INTERVAL)
+            try:
+                self.heartbeat()
+            except Exception as e:
+                logger.error(f"Error renewing leases: {str(e)}")
+
+    def _should_claim(self):
+        """是否需要查询数据库领取任务：收到有任务的通知，或距上次领取落空已超过兜底间隔"""
+        return self._work_available.is_set() or time.time() >= self._next_poll
+
+    def get_url(self, timeout=None):
+        """领取一个任务的URL，没有可领取的任务时最多阻塞timeout秒，超时返回None。
+        上次领取落空后不再查询数据库，空闲的工作线程只等待扫描线程的通知，
+        其他进程产生的任务依靠每QUEUE_CLAIM_POLL_INTERVAL秒一次的兜底领取发现"""
+        if not self._should_claim():
+            if timeout:
+                self._work_available.wait(timeout)
+            if not self._should_claim():
+                return None
+        # 先清除通知再领取，领取期间到达的通知不会丢失
+        self._work_available.clear()
+        url = self.claim()
+        if url:
+            # 可能还有待领取的任务，让其他空闲的工作线程继续领取
+            self._work_available.set()
+        else:
+            self._next_poll = time.time() + QUEUE_CLAIM_POLL_INTERVAL
+        return url
 
 # 创建全局URL队列实例
-url_queue = URLQueue() 
\ No newline at end of file
+url_queue = URLQueue()
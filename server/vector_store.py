@@ -1,11 +1,79 @@
 import chromadb
 from chromadb.config import Settings
+import json
 import logging
-from server.config import CHROMA_DB_PATH, EMBEDDING_MODEL
+import threading
+import time
+from collections import OrderedDict
+from server.config import CHROMA_DB_PATH, SEARCH_QUERY_CACHE_SIZE, SEARCH_RESULT_CACHE_SIZE, SEARCH_RESULT_CACHE_TTL
+from server.embedding import embedding_engine
+from server.subtitle import chunk_subtitle, format_timestamp
 import os
 
 logger = logging.getLogger(__name__)
 
+# 搜索时允许过滤的元数据字段
+SEARCH_FILTER_FIELDS = ('url', 'video_id', 'domain')
+# 按确定性ID查找已有分段时每批探测的ID数量
+ID_PROBE_BATCH_SIZE = 256
+
+
+def build_where(filters):
+    """把{字段: 值或值列表}转换为集合查询的where条件，没有过滤条件时返回None，
+    字段不在SEARCH_FILTER_FIELDS中时抛出ValueError"""
+    unknown = set(filters) - set(SEARCH_FILTER_FIELDS)
+    if unknown:
+        raise ValueError(f"unsupported filter: {', '.join(sorted(unknown))}")
+    clauses = []
+    for field in SEARCH_FILTER_FIELDS:
+        value = filters.get(field)
+        if value is None or value == '' or value == []:
+            continue
+        if isinstance(value, (list, tuple)):
+            clauses.append({field: {'$in': list(value)}})
+        else:
+            clauses.append({field: value})
+    if not clauses:
+        return None
+    return clauses[0] if len(clauses) == 1 else {'$and': clauses}
+
+
+class LRUCache:
+    """线程安全的LRU缓存，ttl大于0时条目超过ttl秒后失效"""
+
+    def __init__(self, maxsize, ttl=0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """返回缓存的值，未命中或已过期时返回None"""
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            value, stored_at = item
+            if self.ttl and time.time() - stored_at > self.ttl:
+                del self._items[key]
+                return None
+            self._items.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._items[key] = (value, time.time())
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+
 class VectorStore:
     def __init__(self):
         # 确保数据库目录存在
@@ -25,56 +93,123 @@ class VectorStore:
             metadata={"hnsw:space": "cosine"}
         )
         
+        # 查询向量只取决于查询文本；搜索结果在写入字幕后失效
+        self.query_cache = LRUCache(SEARCH_QUERY_CACHE_SIZE)
+        self.result_cache = LRUCache(SEARCH_RESULT_CACHE_SIZE, SEARCH_RESULT_CACHE_TTL)
+        
         logger.info("Vector store initialized")
 
     def add_subtitle(self, video_id, subtitle_text, metadata=None):
-        """添加字幕到向量数据库"""
+        """添加字幕到向量数据库，按视频整体替换：写入新的分段后删除该视频多余的旧分段，重复执行结果相同"""
         try:
-            # 将字幕文本分段（这里简单地按句号分割）
-            segments = [s.strip() for s in subtitle_text.split('.') if s.strip()]
+            # 该视频已有的分段
+            existing_ids = self._existing_ids(video_id, (metadata or {}).get('url'))
+
+            # 解析SRT/ASS字幕，把连续字幕合并为带起止时间的滑动窗口
+            chunks = chunk_subtitle(subtitle_text)
+            segments = [chunk['text'] for chunk in chunks]
             
             # 为每个段落生成ID
             ids = [f"{video_id}_{i}" for i in range(len(segments))]
             
-            # 添加元数据
-            if metadata is None:
-                metadata = {}
-            metadatas = [{**metadata, "segment_index": i} for i in range(len(segments))]
+            # 添加元数据，起止时间（秒）用于跳转到视频中的对应位置
+            metadata = {**(metadata or {}), "video_id": video_id}
+            metadatas = []
+            for i, chunk in enumerate(chunks):
+                chunk_metadata = {**metadata, "segment_index": i}
+                if chunk['start'] is not None:
+                    chunk_metadata['start'] = chunk['start']
+                    chunk_metadata['end'] = chunk['end']
+                    chunk_metadata['timestamp'] = format_timestamp(chunk['start'])
+                metadatas.append(chunk_metadata)
             
-            # 添加到集合
-            self.collection.add(
-                documents=segments,
-                ids=ids,
-                metadatas=metadatas
-            )
+            # 按批计算向量并写入集合，避免长视频的全部分段一次性向量化
+            for start, embeddings in embedding_engine.embed_batches(segments):
+                end = start + len(embeddings)
+                self.collection.upsert(
+                    documents=segments[start:end],
+                    embeddings=embeddings,
+                    ids=ids[start:end],
+                    metadatas=metadatas[start:end]
+                )
             
-            logger.info(f"Added {len(segments)} subtitle segments for video {video_id}")
+            # 分段数量变少时删除多余的旧分段
+            stale_ids = list(existing_ids - set(ids))
+            if stale_ids:
+                self.collection.delete(ids=stale_ids)
+
+            self.result_cache.clear()
+
+            logger.info(f"Added {len(segments)} subtitle segments for video {video_id}, removed {len(stale_ids)} stale")
             return True
         except Exception as e:
             logger.error(f"Error adding subtitle to vector store: {str(e)}")
             return False
 
-    def search(self, query, n_results=5):
+    def _existing_ids(self, video_id, url=None):
+        """视频在集合中已有的分段ID。除video_id元数据外，还按确定性ID（video_id_序号）
+        和url元数据查找，覆盖元数据中没有video_id的旧分段"""
+        existing = set(self.collection.get(where={"video_id": video_id}, include=[])['ids'])
+        if url:
+            existing.update(self.collection.get(where={"url": url}, include=[])['ids'])
+        # 分段ID从0开始连续编号，按批探测直到某一批不满
+        start = 0
+        while True:
+            probe = [f"{video_id}_{i}" for i in range(start, start + ID_PROBE_BATCH_SIZE)]
+            found = self.collection.get(ids=probe, include=[])['ids']
+            existing.update(found)
+            if len(found) < len(probe):
+                return existing
+            start += ID_PROBE_BATCH_SIZE
+
+    def search(self, query, n_results=5, where=None, offset=0):
         """搜索相似的字幕片段"""
+        return self.search_batch([query], n_results, where, offset)[0]
+
+    def search_batch(self, queries, n_results=5, where=None, offset=0):
+        """批量搜索：所有查询的向量一次计算，在集合中一次查询。
+        where为元数据过滤条件（如{"url": ...}），在集合查询时过滤；offset/n_results用于分页。
+        返回与queries一一对应的结果列表。向量计算或集合查询失败时抛出异常，
+        由调用方区分“没有结果”和“搜索失败”"""
+        where_key = json.dumps(where, sort_keys=True) if where else None
+        keys = [(query, n_results, offset, where_key) for query in queries]
+        results = [self.result_cache.get(key) for key in keys]
+        pending = [i for i, cached in enumerate(results) if cached is None]
+        if not pending:
+            return results
         try:
-            results = self.collection.query(
-                query_texts=[query],
-                n_results=n_results
-            )
-            
-            # 格式化结果
+            embeddings = self._embed_queries([queries[i] for i in pending])
+            query_args = {'query_embeddings': embeddings, 'n_results': offset + n_results}
+            if where:
+                query_args['where'] = where
+            response = self.collection.query(**query_args)
+        except Exception as e:
+            logger.error(f"Error searching vector store: {str(e)}")
+            raise
+
+        # 格式化结果
+        for j, i in enumerate(pending):
             formatted_results = []
-            for i in range(len(results['documents'][0])):
+            for k in range(offset, len(response['documents'][j])):
                 formatted_results.append({
-                    'text': results['documents'][0][i],
-                    'metadata': results['metadatas'][0][i],
-                    'distance': results['distances'][0][i] if 'distances' in results else None
+                    'text': response['documents'][j][k],
+                    'metadata': response['metadatas'][j][k],
+                    'distance': response['distances'][j][k] if 'distances' in response else None
                 })
-            
-            return formatted_results
-        except Exception as e:
-            logger.error(f"Error searching vector store: {str(e)}")
-            return []
+            self.result_cache.put(keys[i], formatted_results)
+            results[i] = formatted_results
+        return results
+
+    def _embed_queries(self, queries):
+        """计算多个查询的向量，未缓存的查询合并为一批计算"""
+        vectors = [self.query_cache.get(query) for query in queries]
+        misses = list({queries[i] for i, vector in enumerate(vectors) if vector is None})
+        if misses:
+            computed = dict(zip(misses, embedding_engine.embed(misses)))
+            for query, vector in computed.items():
+                self.query_cache.put(query, vector)
+            vectors = [vector if vector is not None else computed[query] for query, vector in zip(queries, vectors)]
+        return vectors
 
 # 创建全局向量存储实例
 vector_store = VectorStore() 
\ No newline at end of file
@@ -3,54 +3,101 @@ import time
 import logging
 from server.url_queue import url_queue
 from server.rule import url_processor
+from server.task_state import task_states
+from server.config import WORKER_COUNT, WORKER_SHUTDOWN_TIMEOUT, PIPELINE_MODE
 
 logger = logging.getLogger(__name__)
 
 class URLWorker:
-    def __init__(self):
+    def __init__(self, worker_count=WORKER_COUNT, pipeline_mode=PIPELINE_MODE):
         self.is_running = False
-        self.thread = None
-        self.processing_interval = 1  # 处理间隔（秒）
+        # 流水线模式下工作线程只负责把URL送入流水线，各阶段由流水线的线程执行
+        self.pipeline_mode = pipeline_mode
+        self.worker_count = max(worker_count, 1)
+        self.threads = []
+        self.processing_interval = 1  # 队列为空时每次阻塞等待通知的时间（秒），用于及时响应stop，等待期间不查询数据库
+        # 正在处理的URL，避免同一URL被重复入队后被两个线程同时处理
+        self.in_flight = set()
+        self._lock = threading.Lock()
 
     def start(self):
-        """启动工作线程"""
+        """启动工作线程池"""
         if not self.is_running:
             self.is_running = True
-            self.thread = threading.Thread(target=self._process_queue)
-            self.thread.daemon = True
-            self.thread.start()
-            logger.info("URL worker started")
+            url_processor.cancel_event.clear()
+            task_states.start()
+            url_queue.start_heartbeat()
+            self.threads = []
+            for i in range(self.worker_count):
+                thread = threading.Thread(target=self._process_queue, name=f"url-worker-{i}")
+                thread.daemon = True
+                thread.start()
+                self.threads.append(thread)
+            logger.info(f"URL worker started with {self.worker_count} threads")
 
-    def stop(self):
-        """停止工作线程"""
+    def stop(self, timeout=WORKER_SHUTDOWN_TIMEOUT):
+        """停止工作线程池，不再领取新URL，等待在途任务处理完成，超时后终止正在执行的外部命令"""
         self.is_running = False
-        if self.thread:
-            self.thread.join()
+        deadline = time.time() + timeout
+        cancel_timer = threading.Timer(timeout, url_processor.cancel_running)
+        cancel_timer.daemon = True
+        cancel_timer.start()
+        for thread in self.threads:
+            thread.join(max(deadline - time.time(), 0))
+        if self.pipeline_mode:
+            url_processor.stop_pipelines()
+        cancel_timer.cancel()
+        task_states.stop()
+        alive = [thread.name for thread in self.threads if thread.is_alive()]
+        if alive:
+            logger.warning(f"URL worker stop timed out, still running: {alive}")
+        else:
             logger.info("URL worker stopped")
 
     def _process_queue(self):
         """处理队列中的URL"""
         while self.is_running:
             try:
-                # 从队列中获取URL
-                url = url_queue.get_url()
-                
-                if url:
+                # 从队列中获取URL，队列为空时阻塞等待
+                url = url_queue.get_url(timeout=self.processing_interval)
+                if not url:
+                    continue
+
+                with self._lock:
+                    if url in self.in_flight:
+                        logger.info(f"URL already being processed, skipping: {url}")
+                        continue
+                    self.in_flight.add(url)
+                if self.pipeline_mode:
+                    logger.info(f"Submitting URL to pipeline: {url}")
+                    url_processor.submit_url(url, lambda success, url=url: self._on_done(url, success))
+                    continue
+                try:
                     logger.info(f"Processing URL: {url}")
                     # 使用URL处理器处理URL
                     success = url_processor.process_url(url)
-                    
+
                     if success:
                         logger.info(f"Successfully processed URL: {url}")
                     else:
                         logger.error(f"Failed to process URL: {url}")
-                else:
-                    # 如果队列为空，等待一段时间
-                    time.sleep(self.processing_interval)
-                    
+                finally:
+                    # 租约随终态一起在任务状态落库时释放，终态写入失败时继续持有租约，由后台线程重试写入
+                    with self._lock:
+                        self.in_flight.discard(url)
+
             except Exception as e:
                 logger.error(f"Error in worker thread: {str(e)}")
                 time.sleep(self.processing_interval)
 
+    def _on_done(self, url, success):
+        """流水线模式下URL处理结束的回调"""
+        with self._lock:
+            self.in_flight.discard(url)
+        if success:
+            logger.info(f"Successfully processed URL: {url}")
+        else:
+            logger.error(f"Failed to process URL: {url}")
+
 # 创建全局工作线程实例
-url_worker = URLWorker() 
\ No newline at end of file
+url_worker = URLWorker()
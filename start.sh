@@ -19,6 +19,8 @@ export EMBEDDING_MODEL="all-MiniLM-L6-v2"
 
 # 任务处理配置
 export MAX_RETRY_COUNT="3"
+# 在服务进程内处理URL（下载、提取字幕、向量化），为false时需要另行运行工作进程
+export RUN_WORKER="false"
 
 # 主从同步配置
 export ROLE="master"
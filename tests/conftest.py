@@ -0,0 +1,39 @@
+import os
+import tempfile
+
+# 配置在导入server模块时读取，需在导入前指向临时目录，避免写入工作目录下的数据库和缓存
+_tmp = tempfile.mkdtemp(prefix='url-saver-tests-')
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(_tmp, 'test.db')}"
+for name in ('ARTIFACT_CACHE_PATH', 'LUX_DOWNLOAD_PATH', 'FFMPEG_OUTPUT_PATH', 'CHROMA_DB_PATH'):
+    os.environ[name] = os.path.join(_tmp, name.lower())
+os.environ['EMBEDDING_CACHE_PATH'] = ''
+
+import pytest
+from sqlalchemy import text
+from server.database import engine, SessionLocal
+from server.models import Base
+from server.fulltext import fulltext_index
+
+
+@pytest.fixture
+def db():
+    """每个测试使用重新建表的空数据库"""
+    with engine.begin() as connection:
+        connection.execute(text('DROP TABLE IF EXISTS urls_fts'))
+    fulltext_index._ready = None
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    session = SessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
+
+
+@pytest.fixture
+def client(db):
+    """Flask测试客户端，使用db夹具建好的空数据库"""
+    from server.main import app
+    app.config['TESTING'] = True
+    with app.test_client() as test_client:
+        yield test_client
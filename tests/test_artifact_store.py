@@ -0,0 +1,39 @@
+import os
+import pytest
+from server.artifact_store import ArtifactStore
+
+MEDIA_ID = 'bilibili:BV1xx411c7mD:p1'
+
+
+@pytest.fixture
+def store(db, tmp_path):
+    return ArtifactStore(root=str(tmp_path / 'cache'), quota_bytes=1024 * 1024)
+
+
+def _file(tmp_path, name, content):
+    path = tmp_path / name
+    path.write_text(content)
+    return str(path)
+
+
+def test_put_replaces_unreferenced_previous_file(store, tmp_path):
+    old = store.put(MEDIA_ID, 'video', _file(tmp_path, 'old.mp4', 'old'))
+    store.release(MEDIA_ID, 'video')
+
+    new = store.put(MEDIA_ID, 'video', _file(tmp_path, 'new.mp4', 'new'))
+
+    assert new != old
+    assert not os.path.exists(old)
+    assert store.describe(MEDIA_ID, 'video')['path'] == new
+
+
+def test_put_keeps_previous_file_still_in_use(store, tmp_path):
+    old = store.put(MEDIA_ID, 'video', _file(tmp_path, 'old.mp4', 'old'))
+    staged = _file(tmp_path, 'new.mp4', 'new')
+
+    stored = store.put(MEDIA_ID, 'video', staged)
+
+    assert stored == old
+    assert open(old).read() == 'old'
+    assert not os.path.exists(staged)
+    assert store.describe(MEDIA_ID, 'video')['path'] == old
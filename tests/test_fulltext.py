@@ -0,0 +1,73 @@
+from sqlalchemy import text
+from server.database import engine
+from server.fulltext import fulltext_index, build_match_query
+from server.models import URL
+
+
+def _add(db, url, title, **kwargs):
+    db.add(URL(url=url, title=title, **kwargs))
+    db.commit()
+
+
+def _ids(db, query):
+    return [url_id for url_id, _ in fulltext_index.search(db, query, 10)]
+
+
+def test_backfill_after_migration(db):
+    _add(db, 'https://example.com/1', '机器学习入门教程', tags=['人工智能'])
+    _add(db, 'https://example.com/2', 'Python tutorial')
+    # 迁移add_urls_fts只建空表
+    with engine.begin() as connection:
+        connection.execute(text(
+            "CREATE VIRTUAL TABLE urls_fts USING fts5(title, notes, tags, domain, tokenize='unicode61')"
+        ))
+    fulltext_index._ready = None
+    assert _ids(db, '学习') == []
+
+    assert fulltext_index.ensure()
+
+    assert _ids(db, '学习') == [1]
+    assert _ids(db, '人工智能') == [1]
+    assert _ids(db, 'python') == [2]
+
+
+def test_index_follows_insert_update_delete(db):
+    assert fulltext_index.ensure()
+    _add(db, 'https://example.com/1', '深度学习', notes='课程笔记')
+    assert _ids(db, '笔记') == [1]
+
+    row = db.query(URL).one()
+    row.title = 'cooking'
+    db.commit()
+    assert _ids(db, '学习') == []
+    assert _ids(db, 'cooking') == [1]
+
+    db.delete(row)
+    db.commit()
+    assert _ids(db, 'cooking') == []
+
+
+def test_title_ranks_above_notes(db):
+    assert fulltext_index.ensure()
+    _add(db, 'https://example.com/notes', 'other', notes='数据库 优化')
+    _add(db, 'https://example.com/title', '数据库 优化')
+
+    assert _ids(db, '数据库') == [2, 1]
+
+
+def test_build_match_query_quotes_words():
+    assert build_match_query('机器学习 "x') == '"机器" "学习" "x"'
+    assert build_match_query('  !!  ') == ''
+
+
+def test_non_string_fields_are_indexed_as_text(db):
+    assert fulltext_index.ensure()
+    db.add(URL(url='https://example.com/1', title=5, notes=2026))
+    db.commit()
+
+    assert _ids(db, '5') == [1]
+
+    row = db.query(URL).one()
+    row.title = 12345
+    db.commit()
+    assert _ids(db, '12345') == [1]
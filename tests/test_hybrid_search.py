@@ -0,0 +1,34 @@
+from server.hybrid_search import reciprocal_rank_fusion
+
+
+def test_rrf_sums_reciprocal_ranks():
+    fused = reciprocal_rank_fusion({'keyword': ['a', 'b'], 'vector': ['b', 'c']}, k=60)
+
+    assert [key for key, _, _ in fused] == ['b', 'a', 'c']
+    scores = {key: score for key, score, _ in fused}
+    assert scores['b'] == 1 / 62 + 1 / 61
+    assert scores['a'] == 1 / 61
+    assert scores['c'] == 1 / 62
+
+
+def test_rrf_reports_rank_per_source():
+    fused = reciprocal_rank_fusion({'keyword': ['a', 'b'], 'vector': ['b']})
+
+    assert {key: ranks for key, _, ranks in fused} == {'a': {'keyword': 1}, 'b': {'keyword': 2, 'vector': 1}}
+
+
+def test_rrf_agreement_beats_single_top_hit():
+    fused = reciprocal_rank_fusion({'keyword': ['solo', 'both'], 'vector': ['other', 'both']})
+
+    assert fused[0][0] == 'both'
+
+
+def test_rrf_k_flattens_rank_differences():
+    sharp = reciprocal_rank_fusion({'keyword': ['a', 'b']}, k=1)
+    flat = reciprocal_rank_fusion({'keyword': ['a', 'b']}, k=1000)
+
+    assert sharp[0][1] / sharp[1][1] > flat[0][1] / flat[1][1]
+
+
+def test_rrf_empty():
+    assert reciprocal_rank_fusion({'keyword': [], 'vector': []}) == []
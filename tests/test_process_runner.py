@@ -0,0 +1,38 @@
+import os
+import sys
+import pytest
+from server.process_runner import run_command
+
+posix_only = pytest.mark.skipif(os.name != 'posix', reason='resource limits require POSIX')
+
+
+def _python(code):
+    return [sys.executable, '-c', code]
+
+
+@posix_only
+def test_limits_are_applied_to_child():
+    # 等待父进程设置完限制后再读取
+    result = run_command(_python(
+        'import os, resource, time; time.sleep(0.5); '
+        'print(os.getpriority(os.PRIO_PROCESS, 0), resource.getrlimit(resource.RLIMIT_CPU)[0])'
+    ), timeout=10, nice=5, cpu_seconds=120)
+
+    assert result.success
+    niceness, cpu_limit = result.output.split()
+    assert int(niceness) == os.getpriority(os.PRIO_PROCESS, 0) + 5
+    assert int(cpu_limit) == 120
+
+
+def test_child_stdin_is_closed():
+    result = run_command(_python('import sys; print(repr(sys.stdin.read()))'), timeout=10)
+
+    assert result.success
+    assert result.output == "''"
+
+
+def test_timeout_kills_child():
+    result = run_command(_python('import time; time.sleep(30)'), timeout=1)
+
+    assert result.timed_out
+    assert not result.success
@@ -0,0 +1,119 @@
+import os
+import pytest
+from server.config import DOMAIN_CONFIGS
+from server.models import URL, Task, TaskStatus
+from server.rule import THROTTLE_PATTERN, URLProcessor, PROCESSOR_STAGES
+from server.task_state import task_states
+from server.url_queue import URLQueue
+
+
+@pytest.mark.parametrize('line', [
+    'request error: HTTP 412 Precondition Failed',
+    'HTTP/1.1 429 Too Many Requests',
+    'HTTP/2 412',
+    'response status code: 412',
+    'status=429',
+    'Server returned 429',
+    'Precondition Failed',
+    'too many requests',
+])
+def test_throttle_pattern_matches_http_status(line):
+    assert THROTTLE_PATTERN.search(line)
+
+
+@pytest.mark.parametrize('line', [
+    ' 412.34 MiB / 900.00 MiB [=====>-------] 45.81% 2.10 MiB/s',
+    ' 1.20 GiB / 429.50 MiB',
+    '412 KiB',
+    '429MB',
+    'downloaded 412 segments',
+    'frame=  429 fps= 30 time=00:00:14.30 speed=1.0x',
+    'BV1412429xyz',
+])
+def test_throttle_pattern_ignores_progress_output(line):
+    assert not THROTTLE_PATTERN.search(line)
+
+
+URL_0 = 'https://www.bilibili.com/video/BV1xx411c7mD'
+
+
+@pytest.fixture
+def processor(db, tmp_path, monkeypatch):
+    """外部命令替换为直接生成文件的处理器，calls记录实际执行的处理器，fail中的处理器返回失败"""
+    processor = URLProcessor()
+    processor.calls = []
+    processor.fail = set()
+
+    def fake(name, outputs):
+        def run(job, config):
+            processor.calls.append(name)
+            task_states.update(job.url, TaskStatus.PROCESSING, stage=PROCESSOR_STAGES[name])
+            if name in processor.fail:
+                return False
+            for kind in outputs:
+                path = tmp_path / f'{kind}_{len(processor.calls)}.{kind}'
+                path.write_text(f'{kind} of {job.url}')
+                stored = processor._store_artifact(job, kind, str(path))
+                job.result_data[f'{kind}_file'] = stored
+                if kind == 'video':
+                    job.input_file = stored
+                if kind == 'subtitle':
+                    job.subtitle_file = stored
+            return True
+        return run
+
+    processor.stage_runners = {
+        'lux': fake('lux', ['video']),
+        'ffmpeg_audio': fake('ffmpeg_audio', ['audio']),
+        'ffmpeg_subtitle': fake('ffmpeg_subtitle', ['subtitle']),
+        'ffmpeg_combined': fake('ffmpeg_combined', ['audio', 'subtitle']),
+    }
+    return processor
+
+
+def _run_claimed(processor, db):
+    """像工作线程一样领取任务（失败的任务先重置为待处理）后处理"""
+    if not db.query(URL).filter(URL.url == URL_0).first():
+        db.add(URL(url=URL_0))
+        db.commit()
+    queue = URLQueue()
+    queue._scan()
+    assert queue.claim() == URL_0
+    processor.calls.clear()
+    return processor.process_url(URL_0)
+
+
+@pytest.mark.parametrize('mode,chain,failing,resumed', [
+    ('separate', ['lux', 'ffmpeg_audio', 'ffmpeg_subtitle'], 'ffmpeg_subtitle', ['ffmpeg_subtitle']),
+    ('separate', ['lux', 'ffmpeg_audio', 'ffmpeg_subtitle'], 'ffmpeg_audio', ['ffmpeg_audio', 'ffmpeg_subtitle']),
+    ('combined', ['lux', 'ffmpeg_combined'], 'ffmpeg_combined', ['ffmpeg_combined']),
+])
+def test_retry_skips_completed_stages(processor, db, monkeypatch, mode, chain, failing, resumed):
+    monkeypatch.setitem(DOMAIN_CONFIGS['bilibili.com'], 'ffmpeg_mode', mode)
+    processor.fail = {failing}
+
+    assert _run_claimed(processor, db) is False
+    assert processor.calls == chain[:chain.index(failing) + 1]
+
+    processor.fail = set()
+    assert _run_claimed(processor, db) is True
+    assert processor.calls == resumed
+
+    db.expire_all()
+    task = db.query(Task).one()
+    assert task.status == TaskStatus.SUCCESS
+    assert set(task.result_data['stages']) == set(chain)
+    assert os.path.exists(task.result_data['video_file'])
+
+
+def test_retry_reruns_stage_with_corrupted_artifact(processor, db, monkeypatch):
+    monkeypatch.setitem(DOMAIN_CONFIGS['bilibili.com'], 'ffmpeg_mode', 'separate')
+    processor.fail = {'ffmpeg_subtitle'}
+    _run_claimed(processor, db)
+    audio_file = db.query(Task).one().result_data['audio_file']
+    with open(audio_file, 'a') as f:
+        f.write('garbage')
+
+    processor.fail = set()
+    assert _run_claimed(processor, db) is True
+    assert processor.calls == ['ffmpeg_audio', 'ffmpeg_subtitle']
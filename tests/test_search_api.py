@@ -0,0 +1,54 @@
+import sys
+import types
+import pytest
+import server.main
+from server.hybrid_search import hybrid_searcher
+
+
+class BrokenStore:
+    """查询时失败的向量库"""
+
+    def search(self, *args, **kwargs):
+        raise RuntimeError('collection unavailable')
+
+    def search_batch(self, *args, **kwargs):
+        raise RuntimeError('collection unavailable')
+
+
+@pytest.fixture
+def broken_store(monkeypatch):
+    # 向量库模块依赖chromadb，接口只用到其中的过滤条件构造函数
+    module = types.ModuleType('server.vector_store')
+    module.SEARCH_FILTER_FIELDS = ()
+    module.build_where = lambda filters: None
+    module.vector_store = BrokenStore()
+    monkeypatch.setitem(sys.modules, 'server.vector_store', module)
+    monkeypatch.setattr(server.main, '_get_vector_store', lambda: module.vector_store)
+    return module.vector_store
+
+
+def test_search_failure_is_server_error(client, broken_store):
+    response = client.get('/search?q=hello')
+
+    assert response.status_code == 500
+    assert 'collection unavailable' in response.get_json()['error']
+
+
+def test_batch_search_failure_is_server_error(client, broken_store):
+    response = client.post('/search/batch', json={'queries': ['hello', 'world']})
+
+    assert response.status_code == 500
+    assert 'collection unavailable' in response.get_json()['error']
+
+
+def test_hybrid_search_reports_vector_failure(client, monkeypatch):
+    def broken_leg(query, candidates):
+        raise RuntimeError('collection unavailable')
+    monkeypatch.setattr(hybrid_searcher, '_vector_leg', broken_leg)
+
+    response = client.get('/search/hybrid?q=hello')
+
+    assert response.status_code == 200
+    data = response.get_json()
+    assert data['results'] == []
+    assert data['errors']['vector'] == 'collection unavailable'
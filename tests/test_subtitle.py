@@ -0,0 +1,100 @@
+from server.subtitle import parse_srt, parse_ass, parse_subtitle, chunk_cues, count_tokens, Cue
+
+SRT = """1
+00:00:01,000 --> 00:00:02,500
+<i>Hello</i> world
+
+2
+00:00:03,000 --> 00:00:04,000
+第二行
+字幕
+
+3
+00:01:02,345 --> 00:01:04,000
+third
+"""
+
+ASS = """[Script Info]
+Title: test
+
+[Events]
+Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text
+Dialogue: 0,0:00:05.00,0:00:06.50,Default,,0,0,0,,{\\an8}second, with comma
+Dialogue: 0,0:00:01.25,0:00:02.00,Default,,0,0,0,,first\\Nline
+Comment: 0,0:00:03.00,0:00:04.00,Default,,0,0,0,,ignored
+"""
+
+
+def test_parse_srt():
+    cues = parse_srt(SRT.replace('\n', '\r\n'))
+
+    assert [(cue.start, cue.end, cue.text) for cue in cues] == [
+        (1.0, 2.5, 'Hello world'),
+        (3.0, 4.0, '第二行 字幕'),
+        (62.345, 64.0, 'third'),
+    ]
+
+
+def test_parse_webvtt():
+    cues = parse_subtitle("WEBVTT\n\n00:01.000 --> 00:02.000\nhi\n\n01:00:00.500 --> 01:00:01.000\nbye\n")
+
+    assert [(cue.start, cue.end, cue.text) for cue in cues] == [(1.0, 2.0, 'hi'), (3600.5, 3601.0, 'bye')]
+
+
+def test_parse_ass_sorts_and_keeps_commas():
+    cues = parse_ass(ASS)
+
+    assert [(cue.start, cue.end, cue.text) for cue in cues] == [
+        (1.25, 2.0, 'first line'),
+        (5.0, 6.5, 'second, with comma'),
+    ]
+    assert [cue.text for cue in parse_subtitle(ASS)] == ['first line', 'second, with comma']
+
+
+def test_plain_text_falls_back_to_sentences():
+    cues = parse_subtitle('第一句。第二句！\nthird line')
+
+    assert [cue.text for cue in cues] == ['第一句。', '第二句！', 'third line']
+    assert all(cue.start is None for cue in cues)
+
+
+def test_count_tokens_cjk_and_words():
+    assert count_tokens('机器学习 is fun') == 6
+
+
+def _cues(n, seconds=2, text='word'):
+    return [Cue(i * seconds, i * seconds + seconds, f'{text}{i}') for i in range(n)]
+
+
+def test_chunk_cues_token_window_with_overlap():
+    chunks = chunk_cues(_cues(10), max_tokens=4, overlap_tokens=1, max_seconds=0)
+
+    assert [chunk['text'] for chunk in chunks] == [
+        'word0 word1 word2 word3',
+        'word3 word4 word5 word6',
+        'word6 word7 word8 word9',
+    ]
+    assert (chunks[1]['start'], chunks[1]['end']) == (6, 14)
+
+
+def test_chunk_cues_time_window():
+    chunks = chunk_cues(_cues(6, seconds=10), max_tokens=100, overlap_tokens=0, max_seconds=30)
+
+    assert [(chunk['start'], chunk['end']) for chunk in chunks] == [(0, 30), (30, 60)]
+
+
+def test_chunk_cues_dedupes_rolling_repeats():
+    cues = [Cue(0, 1, 'same'), Cue(1, 2, 'same'), Cue(2, 3, 'next')]
+
+    chunks = chunk_cues(cues, max_tokens=10, overlap_tokens=0, max_seconds=0)
+
+    assert chunks == [{'text': 'same next', 'start': 0, 'end': 3}]
+
+
+def test_chunk_cues_oversized_cue_stands_alone():
+    cues = [Cue(0, 1, 'a'), Cue(1, 2, ' '.join(['long'] * 20)), Cue(2, 3, 'b')]
+
+    chunks = chunk_cues(cues, max_tokens=5, overlap_tokens=0, max_seconds=0)
+
+    assert [chunk['text'].split()[0] for chunk in chunks] == ['a', 'long', 'b']
+    assert chunk_cues([], max_tokens=5) == []
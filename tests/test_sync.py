@@ -0,0 +1,174 @@
+import pytest
+from datetime import datetime, timedelta
+from server.models import URL, Change
+from server.sync import apply_sync_urls, url_to_sync_dict, SyncEncoder, decode_sync_body, COLUMNS_CONTENT_TYPE
+from server.sync import safe_seq, changed_urls_since, compact_changes, set_peer_seq, SYNC_GAP_LAG
+
+
+def _record(url, title, updated_at):
+    return {'url': url, 'title': title, 'updated_at': updated_at}
+
+
+def test_apply_canonicalizes_query_variants(db):
+    count, invalid = apply_sync_urls(db, [
+        _record('https://ex.org/q?z=1', 'old', '2026-01-01T00:00:00'),
+        _record('https://ex.org/q?z=2', 'new', '2026-01-02T00:00:00'),
+    ])
+    db.commit()
+
+    assert (count, invalid) == (1, 0)
+    rows = db.query(URL).all()
+    assert [(row.url, row.title, row.query_params) for row in rows] == [('https://ex.org/q', 'new', {'z': ['2']})]
+
+
+def test_apply_updates_existing_canonical_row(db):
+    db.add(URL(url='https://ex.org/q', title='local'))
+    db.commit()
+
+    count, _ = apply_sync_urls(db, [_record('https://ex.org/q?z=3#top', 'remote', '2999-01-01T00:00:00')])
+    db.commit()
+
+    assert count == 1
+    row = db.query(URL).one()
+    assert (row.url, row.title, row.query_params) == ('https://ex.org/q', 'remote', {'z': ['3']})
+
+
+def test_apply_keeps_newer_local_row(db):
+    db.add(URL(url='https://ex.org/q', title='local'))
+    db.commit()
+
+    count, _ = apply_sync_urls(db, [_record('https://ex.org/q', 'stale', '2000-01-01T00:00:00')])
+
+    assert count == 0
+    assert db.query(URL).one().title == 'local'
+
+
+def test_apply_counts_invalid_records(db):
+    count, invalid = apply_sync_urls(db, [{'title': 'no url'}, {'url': None}, _record('https://ex.org/a', 'a', None)])
+
+    assert (count, invalid) == (1, 2)
+
+
+@pytest.mark.parametrize('field,value', [
+    ('query_params', 'zz'),
+    ('query_params', {'z': 1}),
+    ('tags', 'a,b'),
+    ('tags', ['a', 2]),
+    ('title', 5),
+    ('notes', ['x']),
+])
+def test_apply_rejects_malformed_fields(db, field, value):
+    record = dict(_record('https://ex.org/bad', 't', '2026-01-01T00:00:00'), **{field: value})
+
+    count, invalid = apply_sync_urls(db, [record, _record('https://ex.org/good', 'ok', None)])
+
+    assert (count, invalid) == (1, 1)
+    assert [row.url for row in db.query(URL).all()] == ['https://ex.org/good']
+
+
+def test_pull_after_push_of_valid_query_params(db):
+    apply_sync_urls(db, [dict(_record('https://ex.org/q', 't', None), query_params={'z': ['1']})])
+    db.commit()
+
+    body = SyncEncoder(COLUMNS_CONTENT_TYPE).encode([url_to_sync_dict(row) for row in db.query(URL).all()])
+
+    records, _ = decode_sync_body(body, COLUMNS_CONTENT_TYPE)
+    assert records[0]['query_params'] == {'z': ['1']}
+
+
+def _write(db, *urls, origin=None):
+    """逐个写入URL（已存在时修改标题），每次写入产生一条变更"""
+    db.info['sync_origin'] = origin
+    for url in urls:
+        row = db.query(URL).filter(URL.url == url).first()
+        if row is None:
+            db.add(URL(url=url))
+        else:
+            row.title = (row.title or '') + '+'
+        db.commit()
+    db.info.pop('sync_origin')
+
+
+def _open_gap(db, seq):
+    """删除一条变更，模拟尚未提交（或已回滚）的事务留下的序列号空洞"""
+    db.query(Change).filter(Change.id == seq).delete()
+    db.commit()
+
+
+def _age_changes(db, seconds):
+    db.query(Change).update({Change.created_at: datetime.utcnow() - timedelta(seconds=seconds)})
+    db.commit()
+
+
+def test_safe_seq_stops_before_recent_gap(db):
+    _write(db, 'https://ex.org/1', 'https://ex.org/2', 'https://ex.org/3')
+    _open_gap(db, 2)
+
+    assert safe_seq(db, 0) == 1
+    assert safe_seq(db, 1) == 1
+    rows, next_seq = changed_urls_since(db, 0, 10)
+    assert [row.url for _, row in rows] == ['https://ex.org/1']
+    assert next_seq == 1
+
+
+def test_safe_seq_passes_gap_after_lag(db):
+    _write(db, 'https://ex.org/1', 'https://ex.org/2', 'https://ex.org/3')
+    _open_gap(db, 2)
+    _age_changes(db, SYNC_GAP_LAG + 1)
+
+    assert safe_seq(db, 0) == 3
+    rows, next_seq = changed_urls_since(db, 1, 10)
+    assert [row.url for _, row in rows] == ['https://ex.org/3']
+    assert next_seq == 3
+
+
+def test_changed_urls_since_returns_latest_change_once(db):
+    _write(db, 'https://ex.org/1', 'https://ex.org/2', 'https://ex.org/1')
+
+    rows, next_seq = changed_urls_since(db, 0, 10)
+
+    assert [(seq, row.url) for seq, row in rows] == [(2, 'https://ex.org/2'), (3, 'https://ex.org/1')]
+    assert next_seq == 3
+
+
+def test_changed_urls_since_pages_by_limit(db):
+    _write(db, 'https://ex.org/1', 'https://ex.org/2', 'https://ex.org/3')
+
+    rows, next_seq = changed_urls_since(db, 0, 2)
+    assert [seq for seq, _ in rows] == [1, 2]
+    assert next_seq == 2
+
+    rows, next_seq = changed_urls_since(db, next_seq, 2)
+    assert [seq for seq, _ in rows] == [3]
+    assert next_seq == 3
+
+
+def test_changed_urls_since_excludes_origin_but_advances(db):
+    _write(db, 'https://ex.org/local')
+    _write(db, 'https://ex.org/remote', origin='master')
+
+    rows, next_seq = changed_urls_since(db, 0, 10, exclude_origin='master')
+
+    assert [row.url for _, row in rows] == ['https://ex.org/local']
+    assert next_seq == 2
+    rows, _ = changed_urls_since(db, 0, 10, exclude_origin='slave-1')
+    assert [row.url for _, row in rows] == ['https://ex.org/local', 'https://ex.org/remote']
+
+
+def test_compact_changes_keeps_unacked_tail_and_latest_per_url(db):
+    _write(db, 'https://ex.org/1', 'https://ex.org/1', 'https://ex.org/2', 'https://ex.org/1', 'https://ex.org/2')
+    set_peer_seq(db, 'slave-1', 4)
+    set_peer_seq(db, 'slave-2', 2)
+    db.commit()
+
+    assert compact_changes(db) == 2
+    db.commit()
+
+    # 1、2已被同一url之后的变更覆盖且所有对端都已确认；3虽被5覆盖，但slave-2只确认到2
+    assert [change.id for change in db.query(Change).order_by(Change.id)] == [3, 4, 5]
+
+
+def test_compact_changes_without_peers_keeps_everything(db):
+    _write(db, 'https://ex.org/1', 'https://ex.org/1')
+
+    assert compact_changes(db) == 0
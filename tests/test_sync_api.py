@@ -0,0 +1,51 @@
+import pytest
+from sqlalchemy.exc import OperationalError
+import server.main
+
+
+@pytest.fixture
+def master(monkeypatch):
+    monkeypatch.setattr(server.main, 'ROLE', 'master')
+
+
+@pytest.fixture
+def notified(monkeypatch):
+    calls = []
+    monkeypatch.setattr(server.main, '_notify_urls_written', lambda: calls.append(1))
+    return calls
+
+
+def test_pull_since_seq_rejects_ndjson(client, master):
+    response = client.get('/sync/url/pull?since_seq=0&format=ndjson')
+
+    assert response.status_code == 400
+
+
+def test_pull_since_seq_returns_changes(client, master):
+    client.post('/sync/url/push', json={'urls': [{'url': 'https://example.com/a'}]})
+
+    response = client.get('/sync/url/pull?since_seq=0')
+
+    assert response.status_code == 200
+    data = response.get_json()
+    assert [u['url'] for u in data['urls']] == ['https://example.com/a']
+    assert data['last_seq'] > 0
+    assert data['more'] is False
+
+
+def test_push_notifies_after_commit(client, master, notified):
+    response = client.post('/sync/url/push', json={'urls': [{'url': 'https://example.com/a'}]})
+
+    assert response.status_code == 200
+    assert notified == [1]
+
+
+def test_failed_push_does_not_notify(client, master, notified, monkeypatch):
+    def locked(db, urls):
+        raise OperationalError('INSERT', {}, 'database is locked')
+    monkeypatch.setattr(server.main, 'apply_sync_urls', locked)
+
+    response = client.post('/sync/url/push', json={'urls': [{'url': 'https://example.com/a'}]})
+
+    assert response.status_code == 500
+    assert notified == []
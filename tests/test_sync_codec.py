@@ -0,0 +1,77 @@
+import pytest
+from server.sync import SyncEncoder, decode_sync_body, supported_content_types, supported_encodings
+from server.sync import JSON_CONTENT_TYPE, COLUMNS_CONTENT_TYPE, WIRE_COLUMNS
+
+RECORDS = [
+    {
+        'url': 'https://www.bilibili.com/video/BV1xx411c7mD',
+        'title': '机器学习入门',
+        'domain': 'www.bilibili.com',
+        'path': '/video/BV1xx411c7mD',
+        'query_params': {'p': ['2'], 'tag': ['a', 'b']},
+        'tags': ['学习', 'ai'],
+        'notes': 'line1\nline2 "quoted"',
+        'created_at': '2026-01-01T00:00:00',
+        'updated_at': '2026-01-02T03:04:05.123456',
+    },
+    {
+        'url': 'https://example.com/',
+        'title': None,
+        'domain': 'example.com',
+        'path': '/',
+        'query_params': {},
+        'tags': [],
+        'notes': None,
+        'created_at': None,
+        'updated_at': None,
+    },
+]
+
+FORMATS = [(content_type, encoding)
+           for content_type in supported_content_types()
+           for encoding in [None] + supported_encodings()]
+
+
+@pytest.mark.parametrize('content_type,encoding', FORMATS)
+def test_round_trip(content_type, encoding):
+    encoder = SyncEncoder(content_type, encoding)
+    body = encoder.encode(RECORDS, next_cursor='abc', count=2)
+
+    records, trailer = decode_sync_body(body, content_type, encoding)
+
+    assert trailer == {'next_cursor': 'abc', 'count': 2}
+    if content_type == JSON_CONTENT_TYPE:
+        assert records == RECORDS
+    else:
+        # 列式格式只传输WIRE_COLUMNS，domain/path/query_params由url重新解析
+        assert records == [{column: record[column] for column in WIRE_COLUMNS} | {
+            'domain': record['domain'], 'path': record['path'], 'query_params': record['query_params']
+        } for record in RECORDS]
+
+
+def test_streamed_chunks_match_one_shot_encoding():
+    encoder = SyncEncoder(COLUMNS_CONTENT_TYPE, 'gzip')
+    body = encoder.begin() + b''.join(encoder.row(record) for record in RECORDS) + encoder.end()
+
+    records, trailer = decode_sync_body(body, COLUMNS_CONTENT_TYPE, 'gzip')
+
+    assert [record['url'] for record in records] == [record['url'] for record in RECORDS]
+    assert trailer == {'next_cursor': None}
+
+
+def test_columnar_decode_canonicalizes_url():
+    body = SyncEncoder(COLUMNS_CONTENT_TYPE).encode([{'url': 'https://ex.org/q?z=1#frag', 'title': 't'}])
+
+    records, _ = decode_sync_body(body, COLUMNS_CONTENT_TYPE)
+
+    assert records[0]['url'] == 'https://ex.org/q'
+    assert records[0]['domain'] == 'ex.org'
+    assert records[0]['path'] == '/q'
+    assert records[0]['query_params'] == {'z': ['1']}
+
+
+def test_unsupported_body_raises():
+    with pytest.raises(ValueError):
+        decode_sync_body(b'{}', 'text/csv')
+    with pytest.raises(ValueError):
+        decode_sync_body(b'{}', JSON_CONTENT_TYPE, 'br')
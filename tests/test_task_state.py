@@ -0,0 +1,109 @@
+from sqlalchemy.exc import OperationalError
+from server.database import SessionLocal
+from server.models import URL, Task, TaskStatus, ProcessingStage
+from server.task_state import TaskStateManager
+from server.url_queue import URLQueue
+
+URL_0 = 'https://example.com/0'
+
+
+def _claimed(db, owner='node-a'):
+    """添加一个URL并由owner领取，返回对应的任务状态管理器"""
+    db.add(URL(url=URL_0))
+    db.commit()
+    queue = URLQueue(owner=owner)
+    queue._scan()
+    assert queue.claim() == URL_0
+    states = TaskStateManager(flush_interval=3600, owner=owner)
+    states.load(URL_0)
+    return states
+
+
+def _task(db):
+    db.expire_all()
+    return db.query(Task).one()
+
+
+def test_updates_are_batched_until_flush(db):
+    states = _claimed(db)
+
+    states.update(URL_0, TaskStatus.PROCESSING, stage=ProcessingStage.DOWNLOAD)
+    states.update(URL_0, progress={'percent': 50})
+
+    assert _task(db).current_stage != ProcessingStage.DOWNLOAD
+    assert states.get(URL_0)['progress'] == {'percent': 50}
+
+    assert states.flush() == 1
+    task = _task(db)
+    assert task.current_stage == ProcessingStage.DOWNLOAD
+    assert task.progress == {'percent': 50}
+    assert states.flush() == 0
+
+
+def test_updates_are_coalesced(db):
+    states = _claimed(db)
+
+    for percent in range(10):
+        states.update(URL_0, progress={'percent': percent})
+    states.update(URL_0, stage=ProcessingStage.AUDIO_EXTRACT)
+    states.update(URL_0, progress={'percent': 99})
+
+    entry = states.entries[URL_0]
+    assert entry.pending == {
+        'current_stage': ProcessingStage.AUDIO_EXTRACT,
+        'progress': {'percent': 99},
+    }
+
+
+def test_terminal_status_flushes_releases_lease_and_clears_progress(db):
+    states = _claimed(db)
+    states.update(URL_0, TaskStatus.PROCESSING, stage=ProcessingStage.DOWNLOAD)
+    states.update(URL_0, progress={'percent': 80})
+
+    states.update(URL_0, TaskStatus.SUCCESS, result_data={'subtitle': 'ok'})
+
+    task = _task(db)
+    assert task.status == TaskStatus.SUCCESS
+    assert task.progress is None
+    assert task.completed_at is not None
+    assert task.result_data == {'subtitle': 'ok'}
+    assert task.lease_owner is None
+    assert task.lease_expires_at is None
+    assert URL_0 not in states.entries
+
+
+def test_flush_skips_task_whose_lease_was_taken_over(db):
+    states = _claimed(db)
+    db.query(Task).update({Task.lease_owner: 'node-b'})
+    db.commit()
+
+    states.update(URL_0, TaskStatus.FAILED, 'too late')
+
+    task = _task(db)
+    assert task.status == TaskStatus.PROCESSING
+    assert task.lease_owner == 'node-b'
+    assert URL_0 not in states.entries
+
+
+def test_failed_flush_keeps_pending_state(db, monkeypatch):
+    states = _claimed(db)
+    states.update(URL_0, progress={'percent': 10})
+
+    def locked_commit():
+        raise OperationalError('COMMIT', {}, 'database is locked')
+
+    def locked_db():
+        session = SessionLocal()
+        session.commit = locked_commit
+        yield session
+    monkeypatch.setattr('server.task_state.get_db', locked_db)
+    states.update(URL_0, progress={'percent': 20})
+    assert states.flush() == 0
+    assert states.entries[URL_0].pending == {'progress': {'percent': 20}}
+
+    monkeypatch.undo()
+    states.update(URL_0, stage=ProcessingStage.DOWNLOAD)
+    assert states.flush() == 1
+    task = _task(db)
+    assert task.current_stage == ProcessingStage.DOWNLOAD
+    assert task.progress is None
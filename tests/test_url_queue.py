@@ -0,0 +1,97 @@
+from datetime import datetime, timedelta
+from server.models import URL, Task, TaskStatus
+from server.url_queue import URLQueue
+
+
+def _add_urls(db, count):
+    for i in range(count):
+        db.add(URL(url=f'https://example.com/{i}'))
+    db.commit()
+
+
+def test_scan_creates_pending_tasks(db):
+    _add_urls(db, 3)
+    queue = URLQueue(owner='node-a')
+
+    queue._scan()
+
+    assert db.query(Task).filter(Task.status == TaskStatus.PENDING).count() == 3
+
+
+def test_claim_takes_lease_once(db):
+    _add_urls(db, 2)
+    first, second = URLQueue(owner='node-a'), URLQueue(owner='node-b')
+    first._scan()
+
+    claimed = {first.claim(), second.claim()}
+
+    assert claimed == {'https://example.com/0', 'https://example.com/1'}
+    assert first.claim() is None
+    tasks = {task.url: task for task in db.query(Task).all()}
+    assert tasks['https://example.com/0'].status == TaskStatus.PROCESSING
+    assert {task.lease_owner for task in tasks.values()} == {'node-a', 'node-b'}
+    assert all(task.lease_expires_at > datetime.utcnow() for task in tasks.values())
+
+
+def test_expired_lease_is_reclaimed_and_retried(db):
+    _add_urls(db, 1)
+    crashed, survivor = URLQueue(owner='crashed'), URLQueue(owner='survivor')
+    crashed._scan()
+    url = crashed.claim()
+    db.query(Task).update({Task.lease_expires_at: datetime.utcnow() - timedelta(seconds=1)})
+    db.commit()
+
+    survivor._scan()
+    db.expire_all()
+
+    task = db.query(Task).one()
+    assert task.status == TaskStatus.PENDING
+    assert task.retry_count == 1
+    assert task.lease_owner is None
+    assert survivor.claim() == url
+
+
+def test_heartbeat_keeps_lease_alive(db):
+    _add_urls(db, 1)
+    queue = URLQueue(owner='node-a')
+    queue._scan()
+    queue.claim()
+    db.query(Task).update({Task.lease_expires_at: datetime.utcnow() + timedelta(seconds=1)})
+    db.commit()
+
+    assert queue.heartbeat() == 1
+    queue._expire_leases(db)
+    db.expire_all()
+
+    task = db.query(Task).one()
+    assert task.status == TaskStatus.PROCESSING
+    assert task.lease_expires_at > datetime.utcnow() + timedelta(seconds=60)
+
+
+def test_processing_task_without_expired_lease_is_not_reclaimed(db):
+    _add_urls(db, 1)
+    queue = URLQueue(owner='node-a')
+    queue._scan()
+    queue.claim()
+
+    queue._expire_leases(db)
+    db.expire_all()
+
+    task = db.query(Task).one()
+    assert task.status == TaskStatus.PROCESSING
+    assert task.lease_owner == 'node-a'
+
+
+def test_idle_get_url_does_not_poll_until_notified(db):
+    queue = URLQueue(owner='node-a')
+    calls = []
+    claim = queue.claim
+    queue.claim = lambda: calls.append(1) or claim()
+
+    assert queue.get_url(timeout=0.01) is None
+    assert queue.get_url(timeout=0.01) is None
+    assert len(calls) == 1
+
+    _add_urls(db, 1)
+    queue._scan()
+    assert queue.get_url(timeout=0.01) == 'https://example.com/0'
@@ -0,0 +1,141 @@
+import json
+import pytest
+from datetime import datetime, timedelta
+from server.models import URL
+
+
+@pytest.fixture(autouse=True)
+def quiet_notify(monkeypatch):
+    # 写入URL后的通知会唤醒队列和复制线程，测试中不需要
+    import server.main
+    monkeypatch.setattr(server.main, '_notify_urls_written', lambda: None)
+
+
+def _statuses(response):
+    assert response.status_code == 200
+    return [(r['url'], r['status']) for r in response.get_json()['results']]
+
+
+def test_create_and_get_url(client):
+    response = client.post('/extension/urls', json={'url': 'https://ex.org/a?x=1', 'title': 'A', 'tags': ['t']})
+
+    assert response.status_code == 201
+    created = response.get_json()
+    assert created['url'] == 'https://ex.org/a'
+    assert created['tags'] == ['t']
+    response = client.get(f"/extension/urls/{created['id']}")
+    assert response.get_json() == created
+
+
+def test_create_duplicate_url_conflicts(client):
+    first = client.post('/extension/urls', json={'url': 'https://ex.org/a'}).get_json()
+
+    response = client.post('/extension/urls', json={'url': 'https://ex.org/a#frag'})
+
+    assert response.status_code == 409
+    assert response.get_json()['id'] == first['id']
+
+
+def test_batch_json_array_statuses(client):
+    client.post('/extension/urls', json={'url': 'https://ex.org/old', 'title': 'old'})
+
+    response = client.post('/extension/urls/batch', json=[
+        'https://ex.org/new',
+        {'url': 'https://ex.org/old', 'title': 'old'},
+        {'url': 'https://ex.org/new?utm=1', 'tags': ['x']},
+        {'url': 'not a url'},
+        {'title': 'no url'},
+        {'url': 'https://ex.org/old', 'title': 'renamed'},
+    ])
+
+    assert _statuses(response) == [
+        ('https://ex.org/new', 'inserted'),
+        ('https://ex.org/old', 'duplicate'),
+        ('https://ex.org/new', 'duplicate'),
+        (None, 'invalid'),
+        (None, 'invalid'),
+        ('https://ex.org/old', 'updated'),
+    ]
+    data = response.get_json()
+    assert (data['inserted'], data['updated'], data['duplicate'], data['invalid']) == (1, 1, 2, 2)
+
+
+def test_batch_urls_object(client, db):
+    response = client.post('/extension/urls/batch', json={'urls': ['https://ex.org/1', 'https://ex.org/2']})
+
+    assert _statuses(response) == [('https://ex.org/1', 'inserted'), ('https://ex.org/2', 'inserted')]
+    assert db.query(URL).count() == 2
+
+
+def test_batch_ndjson(client):
+    body = '\n'.join([
+        json.dumps({'url': 'https://ex.org/1'}),
+        '{broken',
+        '',
+        json.dumps({'url': 'https://ex.org/1'}),
+    ])
+
+    response = client.post('/extension/urls/batch', data=body, content_type='application/x-ndjson')
+
+    assert _statuses(response) == [
+        ('https://ex.org/1', 'inserted'),
+        (None, 'invalid'),
+        ('https://ex.org/1', 'duplicate'),
+    ]
+
+
+def test_batch_requires_array(client):
+    response = client.post('/extension/urls/batch', json={'url': 'https://ex.org/1'})
+
+    assert response.status_code == 400
+
+
+def _add_urls(db, count, tags=None):
+    """按创建时间从早到晚添加URL"""
+    start = datetime(2026, 1, 1)
+    for i in range(count):
+        db.add(URL(url=f'https://ex.org/{i}', tags=tags(i) if tags else [], created_at=start + timedelta(minutes=i)))
+    db.commit()
+
+
+def _pages(client, query):
+    """沿X-Next-Cursor翻页，返回每页的url路径列表"""
+    pages = []
+    cursor = None
+    while True:
+        response = client.get(f'/extension/urls?{query}' + (f'&cursor={cursor}' if cursor else ''))
+        assert response.status_code == 200
+        pages.append([item['path'] for item in response.get_json()])
+        cursor = response.headers.get('X-Next-Cursor')
+        if not cursor:
+            return pages
+
+
+def test_pagination_cursor_round_trip(client, db):
+    _add_urls(db, 5)
+
+    assert _pages(client, 'limit=2') == [['/4', '/3'], ['/2', '/1'], ['/0']]
+    assert _pages(client, 'limit=2&order=asc') == [['/0', '/1'], ['/2', '/3'], ['/4']]
+
+
+def test_pagination_by_tag(client, db):
+    _add_urls(db, 6, tags=lambda i: ['even'] if i % 2 == 0 else ['odd'])
+
+    assert _pages(client, 'limit=2&tag=even') == [['/4', '/2'], ['/0']]
+    assert _pages(client, 'limit=5&tag=odd&order=asc') == [['/1', '/3', '/5']]
+
+
+def test_pagination_exact_page_has_no_cursor(client, db):
+    _add_urls(db, 2)
+
+    response = client.get('/extension/urls?limit=2')
+
+    assert len(response.get_json()) == 2
+    assert 'X-Next-Cursor' not in response.headers
+
+
+@pytest.mark.parametrize('query', ['cursor=not-a-cursor', 'limit=abc', 'order=sideways', 'since=yesterday'])
+def test_pagination_rejects_bad_parameters(client, query):
+    response = client.get(f'/extension/urls?{query}')
+
+    assert response.status_code == 400